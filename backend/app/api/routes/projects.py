@@ -1,53 +1,78 @@
+import uuid
 from pathlib import Path
 
-import polars as pl
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import FileResponse
+from fastapi import (
+    APIRouter,
+    Depends,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, StreamingResponse
 from loguru import logger
+from starlette.background import BackgroundTask
 
 from app.api.deps import (
     CurrentUser,
     SessionDep,
     get_current_active_superuser,
+    get_db_context,
 )
 from app.core.config import settings
 from app.crud.audit import (
     get_line_item_audit_logs,
     get_line_item_message_audit_logs,
 )
+from app.crud.exports import create_project_export, get_project_export
 from app.crud.projects import (
     assign_task,
     confirm_line_item,
     create_project,
+    decode_line_item_cursor,
     delete_user_tasks,
     get_line_item_by_index,
     get_line_items,
     get_project_by_id,
-    get_project_for_download,
     get_projects,
     get_projects_dashboard,
     get_projects_dashboard_user,
     get_user_task_summary_in_project,
+    iter_project_for_download,
     modify_task_assignment,
+    rebalance_tasks,
+    resume_project_ingestion,
     update_line_item_message,
 )
+from app.crud.status_counts import get_project_task_totals
 from app.models import (
     AssignTaskRequest,
+    AuditLogCount,
     AuditLogsPublic,
+    DatasetSourceType,
     DeleteUserTasksRequest,
+    ExportFormat,
     LineItemAuditLogRead,
     LineItemConfirmRequest,
+    LineItemFields,
     LineItemMessageAuditLogRead,
     LineItemMessageUpdateRequest,
     LineItemRead,
     LineItemsPublic,
     LineItemStatus,
     ModifyTaskAssignmentRequest,
+    Project,
     ProjectCreate,
     ProjectDownloadRequest,
+    ProjectExportPublic,
     ProjectPublic,
     ProjectStatus,
+    RebalanceTasksPublic,
+    RebalanceTasksRequest,
+    TaskAssignmentPublic,
 )
+from app.utils import encode_ndjson, get_export_file_suffix, write_export_file
 
 router = APIRouter(prefix="/projects", tags=["projects"])
 
@@ -74,11 +99,59 @@ def create_project_route(
             project_in=project,
             current_user=current_user,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post(
+    "/upload",
+    response_model=ProjectPublic,
+    dependencies=[Depends(get_current_active_superuser)],
+)
+def upload_project_route(
+    session: SessionDep,
+    current_user: CurrentUser,
+    file: UploadFile,
+    name: str = Form(min_length=1, max_length=255),
+    description: str | None = Form(default=None, max_length=255),
+):
+    """Create a project from a JSONL file uploaded with the request"""
+    project = ProjectCreate(
+        name=name,
+        description=description,
+        url=(file.filename or "upload.jsonl")[:255],
+        source=DatasetSourceType.UPLOAD,
+    )
+    try:
+        return create_project(
+            session=session,
+            project_in=project,
+            current_user=current_user,
+            upload_file=file.file,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post(
+    "/{project_id}/resume",
+    response_model=ProjectPublic,
+    dependencies=[Depends(get_current_active_superuser)],
+)
+def resume_project_ingestion_route(project_id: int, session: SessionDep):
+    project = session.get(Project, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    return resume_project_ingestion(session=session, project=project)
+
+
 @router.get("/{project_id}/status", response_model=ProjectStatus)
 def get_project_status_route(project_id: int, session: SessionDep):
     project = get_project_by_id(session=session, project_id=project_id)
@@ -87,8 +160,10 @@ def get_project_status_route(project_id: int, session: SessionDep):
 
     state = project.status
     info = project.info
-    num_samples = len(project.line_items)
-    num_task_assigned = len(project.tasks)
+    # Polled during ingestion, so totals come from the status counters
+    num_samples, num_task_assigned = get_project_task_totals(
+        session=session, project_id=project_id
+    )
     num_task_not_assigned = num_samples - num_task_assigned
     user_task_summary = get_user_task_summary_in_project(
         session=session, project_id=project_id
@@ -137,8 +212,23 @@ def get_line_items_route(
     page: int = Query(default=1, ge=1, description="Page number"),
     limit: int = Query(default=10, ge=1, description="Number of items per page"),
     status: LineItemStatus | None = None,
+    after_line_index: int | None = Query(
+        default=None, ge=0, description="Keyset mode, items after this line index"
+    ),
+    cursor: str | None = Query(
+        default=None, description="next_cursor or prev_cursor of a previous page"
+    ),
+    include_status_counts: bool = Query(
+        default=True, description="Set to false when status counts are cached"
+    ),
+    fields: LineItemFields = Query(
+        default=LineItemFields.FULL, description="summary leaves out messages"
+    ),
 ):
-    line_items, total_count, num_pages, status_counts = get_line_items(
+    before_line_index = None
+    if cursor:
+        after_line_index, before_line_index = decode_line_item_cursor(cursor)
+    return get_line_items(
         session=session,
         project_id=project_id,
         page=page,
@@ -146,31 +236,35 @@ def get_line_items_route(
         status=status,
         user_id=current_user.id,
         is_superuser=current_user.is_superuser,
-    )
-    return LineItemsPublic(
-        data=line_items,
-        total_count=total_count,
-        num_pages=num_pages,
-        status_counts=status_counts,
+        after_line_index=after_line_index,
+        before_line_index=before_line_index,
+        include_status_counts=include_status_counts,
+        fields=fields,
     )
 
 
 @router.post(
     "/{project_id}/assign",
     dependencies=[Depends(get_current_active_superuser)],
+    response_model=TaskAssignmentPublic,
 )
 def assign_task_route(
     project_id: int,
     assign_task_request: AssignTaskRequest,
     session: SessionDep,
 ):
-    assign_task(
+    num_assigned, first_line_index, last_line_index = assign_task(
         project_id=project_id,
         user_id=assign_task_request.user_id,
         num_samples=assign_task_request.num_samples,
         session=session,
     )
-    return {"message": "Task assigned successfully"}
+    return TaskAssignmentPublic(
+        message="Task assigned successfully",
+        num_assigned=num_assigned,
+        first_line_index=first_line_index,
+        last_line_index=last_line_index,
+    )
 
 
 @router.put(
@@ -191,6 +285,24 @@ def modify_task_assignment_route(
     return {"message": "Task assignment modified successfully"}
 
 
+@router.post(
+    "/{project_id}/rebalance-assignment",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=RebalanceTasksPublic,
+)
+def rebalance_tasks_route(
+    project_id: int,
+    rebalance_request: RebalanceTasksRequest,
+    session: SessionDep,
+):
+    data = rebalance_tasks(
+        project_id=project_id,
+        rebalance_request=rebalance_request,
+        session=session,
+    )
+    return RebalanceTasksPublic(message="Tasks rebalanced successfully", data=data)
+
+
 @router.delete(
     "/{project_id}/delete-user-tasks",
     dependencies=[Depends(get_current_active_superuser)],
@@ -230,8 +342,15 @@ def confirm_line_item_message_route(
 
 
 @router.get("/dashboard", dependencies=[Depends(get_current_active_superuser)])
-def get_dashboard_admin(session: SessionDep):
-    return get_projects_dashboard(session=session)
+def get_dashboard_admin(
+    session: SessionDep,
+    skip: int = Query(default=0, ge=0),
+    limit: int | None = Query(default=None, ge=1, description="All when empty"),
+    search: str | None = Query(default=None, description="Filter by project name"),
+):
+    return get_projects_dashboard(
+        session=session, skip=skip, limit=limit, search=search
+    )
 
 
 @router.get("/dashboard_user")
@@ -261,28 +380,119 @@ def update_line_item_message_route(
 @router.post(
     "/{project_id}/download",
     dependencies=[Depends(get_current_active_superuser)],
-    response_class=FileResponse,
+    response_class=StreamingResponse,
 )
 def download_project(
     project_id: int,
     session: SessionDep,
     project_download_request: ProjectDownloadRequest,
 ):
-    results = get_project_for_download(
+    if not session.get(Project, project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    file_name = project_download_request.file_name + get_export_file_suffix(
+        project_download_request
+    )
+
+    if project_download_request.format != ExportFormat.JSONL:
+        # Columnar files are only readable once complete, write them to a
+        # temporary file first and delete it once served
+        file_path = Path(settings.TEMP_DOWNLOAD_FOLDER) / (
+            f"download_{uuid.uuid4().hex}{Path(file_name).suffix}"
+        )
+        write_export_file(
+            iter_project_for_download(
+                session=session,
+                project_id=project_id,
+                limit=project_download_request.limit,
+                include_statuses=project_download_request.include_statuses,
+            ),
+            file_path,
+            project_download_request,
+        )
+        return FileResponse(
+            file_path,
+            filename=file_name,
+            background=BackgroundTask(file_path.unlink, missing_ok=True),
+        )
+
+    def stream_export():
+        # The request session is not usable while the body is streamed,
+        # so the export pages through line items with its own session
+        with get_db_context() as export_session:
+            yield from encode_ndjson(
+                iter_project_for_download(
+                    session=export_session,
+                    project_id=project_id,
+                    limit=project_download_request.limit,
+                    include_statuses=project_download_request.include_statuses,
+                ),
+                compress=project_download_request.compress,
+            )
+
+    return StreamingResponse(
+        stream_export(),
+        media_type=(
+            "application/gzip"
+            if project_download_request.compress
+            else "application/x-ndjson"
+        ),
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+    )
+
+
+@router.post(
+    "/{project_id}/exports",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=ProjectExportPublic,
+)
+def create_project_export_route(
+    project_id: int,
+    session: SessionDep,
+    project_download_request: ProjectDownloadRequest,
+):
+    """Export a project in the background, reusing an unchanged snapshot"""
+    if not session.get(Project, project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    return create_project_export(
         session=session,
         project_id=project_id,
-        limit=project_download_request.limit,
-        include_statuses=project_download_request.include_statuses,
+        export_request=project_download_request,
     )
-    pl.DataFrame(results).write_ndjson(
-        Path(settings.TEMP_DOWNLOAD_FOLDER)
-        / f"{project_download_request.file_name}.jsonl"
+
+
+@router.get(
+    "/{project_id}/exports/{export_id}",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=ProjectExportPublic,
+)
+def get_project_export_route(project_id: int, export_id: int, session: SessionDep):
+    db_export = get_project_export(
+        session=session, project_id=project_id, export_id=export_id
     )
-    return FileResponse(
-        Path(settings.TEMP_DOWNLOAD_FOLDER)
-        / f"{project_download_request.file_name}.jsonl",
-        filename=f"{project_download_request.file_name}.jsonl",
+    if not db_export:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return db_export
+
+
+@router.get(
+    "/{project_id}/exports/{export_id}/download",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_class=FileResponse,
+)
+def download_project_export_route(project_id: int, export_id: int, session: SessionDep):
+    db_export = get_project_export(
+        session=session, project_id=project_id, export_id=export_id
     )
+    if not db_export:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if db_export.status != "SUCCESS":
+        raise HTTPException(status_code=400, detail="Export is not ready")
+    if not db_export.file_path or not Path(db_export.file_path).exists():
+        raise HTTPException(
+            status_code=410, detail="Export has expired, please export again"
+        )
+    return FileResponse(db_export.file_path, filename=db_export.file_name)
 
 
 @router.get("/{project_id}/audit/line-items", response_model=AuditLogsPublic)
@@ -295,8 +505,15 @@ def get_line_item_audit_logs_route(
     end_date: str | None = None,
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=50, ge=1, le=100),
+    cursor: str | None = None,
+    count: AuditLogCount = AuditLogCount.EXACT,
 ):
-    """Get audit logs for line items in a project"""
+    """
+    Get audit logs for line items in a project.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to fetch the next one by
+    keyset, which stays fast on deep pages. Cursor pages are not counted.
+    """
     from datetime import datetime
 
     # Convert string dates to datetime objects
@@ -304,7 +521,7 @@ def get_line_item_audit_logs_route(
     end_datetime = datetime.fromisoformat(end_date) if end_date else None
 
     # Get audit logs
-    logs, total_count, total_pages = get_line_item_audit_logs(
+    logs, total_count, total_pages, next_cursor = get_line_item_audit_logs(
         session=session,
         project_id=project_id,
         line_item_id=line_item_id,
@@ -313,6 +530,8 @@ def get_line_item_audit_logs_route(
         end_date=end_datetime,
         page=page,
         limit=limit,
+        cursor=cursor,
+        count=count,
     )
 
     # Convert to response model
@@ -338,7 +557,11 @@ def get_line_item_audit_logs_route(
     ]
 
     return AuditLogsPublic(
-        data=log_reads, count=total_count, page=page, total_pages=total_pages
+        data=log_reads,
+        count=total_count,
+        page=page,
+        total_pages=total_pages,
+        next_cursor=next_cursor,
     )
 
 
@@ -353,8 +576,14 @@ def get_line_item_message_audit_logs_route(
     end_date: str | None = None,
     page: int = Query(default=1, ge=1),
     limit: int = Query(default=50, ge=1, le=100),
+    cursor: str | None = None,
+    count: AuditLogCount = AuditLogCount.EXACT,
 ):
-    """Get audit logs for line item messages in a project"""
+    """
+    Get audit logs for line item messages in a project.
+
+    Paginated like the line item audit logs, with ``cursor`` and ``count``.
+    """
     from datetime import datetime
 
     # Convert string dates to datetime objects
@@ -362,7 +591,7 @@ def get_line_item_message_audit_logs_route(
     end_datetime = datetime.fromisoformat(end_date) if end_date else None
 
     # Get audit logs
-    logs, total_count, total_pages = get_line_item_message_audit_logs(
+    logs, total_count, total_pages, next_cursor = get_line_item_message_audit_logs(
         session=session,
         project_id=project_id,
         line_item_id=line_item_id,
@@ -372,6 +601,8 @@ def get_line_item_message_audit_logs_route(
         end_date=end_datetime,
         page=page,
         limit=limit,
+        cursor=cursor,
+        count=count,
     )
 
     # Convert to response model
@@ -398,5 +629,9 @@ def get_line_item_message_audit_logs_route(
     ]
 
     return AuditLogsPublic(
-        data=log_reads, count=total_count, page=page, total_pages=total_pages
+        data=log_reads,
+        count=total_count,
+        page=page,
+        total_pages=total_pages,
+        next_cursor=next_cursor,
     )
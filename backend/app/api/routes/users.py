@@ -11,6 +11,7 @@ from app.api.deps import (
 from app.core.config import settings
 from app.core.security import get_password_hash, verify_password
 from app.crud import users
+from app.crud.status_counts import delete_user_status_counts
 from app.models import (
     Message,
     Project,
@@ -133,6 +134,7 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
+    delete_user_status_counts(session=session, user_id=current_user.id)
     session.delete(current_user)
     session.commit()
     return Message(message="User deleted successfully")
@@ -220,6 +222,7 @@ def delete_user(
         )
     statement = delete(Project).where(col(Project.owner_id) == user_id)
     session.exec(statement)  # type: ignore
+    delete_user_status_counts(session=session, user_id=user_id)
     session.delete(user)
     session.commit()
     return Message(message="User deleted successfully")
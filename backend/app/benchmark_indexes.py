@@ -0,0 +1,295 @@
+"""
+Compare the query plans of the hot lookups with and without their indexes.
+
+Seeds a throwaway project on the configured MySQL database (8.0.18 or newer,
+for EXPLAIN ANALYZE), then runs each query once with its index and once with
+``IGNORE INDEX`` on the new indexes of its table. Before the new indexes,
+these lookups used the single-column indexes MySQL creates for foreign keys,
+which the new indexes replaced. The benchmark recreates those as
+``benchmark_*`` indexes for the "before" plan and ignores them in the
+"after" plan, so each side only has the indexes of its revision.
+
+    python app/benchmark_indexes.py --rows 1000000
+"""
+
+import argparse
+import time
+
+from loguru import logger
+from sqlalchemy import Connection, text
+
+from app.core.db import engine
+
+NUM_USERS = 10
+BENCHMARK_EMAIL = "benchmark-{}@example.com"
+BASELINE_INDEX_PREFIX = "benchmark_"
+
+# (name, index the query is meant to use, table the hint applies to,
+# foreign key columns of that table whose index served the lookup before, query)
+# The query has a {hint} placeholder right after that table.
+QUERIES = [
+    (
+        "tasks of a user",
+        "ix_task_project_id_user_id",
+        "task",
+        ["project_id", "user_id"],
+        """
+        SELECT COUNT(*) FROM task {hint}
+        WHERE project_id = :project_id AND user_id = :user_id
+        """,
+    ),
+    (
+        "unassigned line items",
+        "uq_task_line_item_id",
+        "task",
+        ["line_item_id"],
+        """
+        SELECT line_item.id FROM line_item
+        LEFT JOIN task {hint} ON task.line_item_id = line_item.id
+        WHERE line_item.project_id = :project_id AND task.id IS NULL
+        ORDER BY line_item.line_index LIMIT 1000
+        """,
+    ),
+    (
+        "line item page",
+        "uq_line_item_project_id_line_index",
+        "line_item",
+        ["project_id"],
+        """
+        SELECT id FROM line_item {hint}
+        WHERE project_id = :project_id AND line_index > :line_index
+        ORDER BY line_index LIMIT 50
+        """,
+    ),
+    (
+        "line items by status",
+        "ix_line_item_project_id_status",
+        "line_item",
+        ["project_id"],
+        """
+        SELECT COUNT(*) FROM line_item {hint}
+        WHERE project_id = :project_id AND status = 'CONFIRMED'
+        """,
+    ),
+    (
+        "messages of a page",
+        "ix_line_item_message_line_item_id_line_message_index",
+        "line_item_message",
+        ["line_item_id"],
+        """
+        SELECT line_item_message.id FROM line_item_message {hint}
+        JOIN line_item ON line_item.id = line_item_message.line_item_id
+        WHERE line_item.project_id = :project_id
+            AND line_item.line_index BETWEEN :line_index AND :line_index + 49
+        ORDER BY line_item_message.line_item_id, line_item_message.line_message_index
+        """,
+    ),
+    (
+        "audit log page",
+        "idx_line_item_audit_project_id_timestamp",
+        "line_item_audit_log",
+        ["project_id"],
+        """
+        SELECT id FROM line_item_audit_log {hint}
+        WHERE project_id = :project_id
+        ORDER BY timestamp DESC LIMIT 50
+        """,
+    ),
+]
+
+
+def seed(connection: Connection, num_rows: int) -> tuple[int, int]:
+    """Insert a project with ``num_rows`` line items, returns its id and a user id"""
+    user_ids = []
+    for i in range(NUM_USERS):
+        result = connection.execute(
+            text(
+                """
+                INSERT INTO user (email, is_active, is_superuser, hashed_password)
+                VALUES (:email, 1, 0, '!')
+                """
+            ),
+            {"email": BENCHMARK_EMAIL.format(i)},
+        )
+        user_ids.append(result.lastrowid)
+
+    project_id = connection.execute(
+        text(
+            """
+            INSERT INTO project (name, url, source, status, owner_id)
+            VALUES ('benchmark', 'benchmark', 'LOCAL', 'SUCCESS', :owner_id)
+            """
+        ),
+        {"owner_id": user_ids[0]},
+    ).lastrowid
+
+    connection.execute(
+        text("SET SESSION cte_max_recursion_depth = :depth"), {"depth": num_rows + 1}
+    )
+    connection.execute(
+        text(
+            """
+            INSERT INTO line_item
+                (project_id, line_index, status, tools, created_at, updated_at)
+            WITH RECURSIVE seq (n) AS (
+                SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :num_rows
+            )
+            SELECT :project_id, n,
+                ELT(1 + n % 4, 'UNLABELED', 'CONFIRMED', 'APPROVED', 'REJECTED'),
+                '[]', NOW(), NOW()
+            FROM seq
+            """
+        ),
+        {"project_id": project_id, "num_rows": num_rows},
+    )
+    # Two messages per line item
+    connection.execute(
+        text(
+            """
+            INSERT INTO line_item_message
+                (line_item_id, line_message_index, role, content, created_at, updated_at)
+            SELECT line_item.id, turn.n, ELT(turn.n, 'user', 'assistant'),
+                'benchmark', NOW(), NOW()
+            FROM line_item
+            CROSS JOIN (SELECT 1 AS n UNION ALL SELECT 2) AS turn
+            WHERE line_item.project_id = :project_id
+            """
+        ),
+        {"project_id": project_id},
+    )
+    # The first half of the line items is assigned, round robin
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO task (project_id, user_id, line_item_id, created_at, updated_at)
+            SELECT :project_id, ELT(1 + line_index % {NUM_USERS}, {", ".join(map(str, user_ids))}),
+                id, NOW(), NOW()
+            FROM line_item
+            WHERE project_id = :project_id AND line_index <= :num_rows / 2
+            """
+        ),
+        {"project_id": project_id, "num_rows": num_rows},
+    )
+    # One audit row per ten line items, spread over the last year
+    connection.execute(
+        text(
+            """
+            INSERT INTO line_item_audit_log
+                (line_item_id, project_id, user_id, action, timestamp,
+                 created_at, updated_at)
+            SELECT id, project_id, NULL, 'STATUS_CHANGE',
+                NOW() - INTERVAL (line_index % 525600) MINUTE, NOW(), NOW()
+            FROM line_item
+            WHERE project_id = :project_id AND line_index % 10 = 0
+            """
+        ),
+        {"project_id": project_id},
+    )
+    create_baseline_indexes(connection)
+    for table in ("line_item", "line_item_message", "task", "line_item_audit_log"):
+        connection.execute(text(f"ANALYZE TABLE {table}"))
+    return project_id, user_ids[1]
+
+
+def baseline_index_name(table: str, column: str) -> str:
+    return f"{BASELINE_INDEX_PREFIX}{table}_{column}"
+
+
+def create_baseline_indexes(connection: Connection) -> None:
+    """Recreate the foreign key indexes the lookups used before their indexes"""
+    baseline = {
+        (table, column) for _, _, table, columns, _ in QUERIES for column in columns
+    }
+    for table, column in sorted(baseline):
+        connection.execute(
+            text(
+                f"CREATE INDEX {baseline_index_name(table, column)} "
+                f"ON {table} ({column})"
+            )
+        )
+
+
+def cleanup(connection: Connection) -> None:
+    """Delete the benchmark users, their projects cascade, and baseline indexes"""
+    connection.execute(
+        text("DELETE FROM user WHERE email LIKE :pattern"),
+        {"pattern": BENCHMARK_EMAIL.format("%")},
+    )
+    connection.commit()
+    indexes = connection.execute(
+        text(
+            """
+            SELECT DISTINCT table_name, index_name FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND index_name LIKE :pattern
+            """
+        ),
+        {"pattern": f"{BASELINE_INDEX_PREFIX}%"},
+    ).all()
+    for table, index in indexes:
+        connection.execute(text(f"DROP INDEX {index} ON {table}"))
+
+
+def explain(connection: Connection, query: str, params: dict) -> tuple[str, float]:
+    started_at = time.perf_counter()
+    plan = connection.execute(text(f"EXPLAIN ANALYZE {query}"), params).scalar()
+    return plan, time.perf_counter() - started_at
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the seeded project and baseline indexes afterwards",
+    )
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        cleanup(connection)
+        logger.info(f"Seeding {args.rows} line items")
+        started_at = time.perf_counter()
+        project_id, user_id = seed(connection, args.rows)
+        connection.commit()
+        logger.info(f"Seeded in {time.perf_counter() - started_at:.1f}s")
+
+        params = {
+            "project_id": project_id,
+            "user_id": user_id,
+            "line_index": args.rows // 2,
+        }
+        try:
+            for name, index, table, _, query in QUERIES:
+                new_indexes = ", ".join(
+                    sorted({other[1] for other in QUERIES if other[2] == table})
+                )
+                baseline = ", ".join(
+                    sorted(
+                        {
+                            baseline_index_name(table, column)
+                            for other in QUERIES
+                            if other[2] == table
+                            for column in other[3]
+                        }
+                    )
+                )
+                before, before_seconds = explain(
+                    connection,
+                    query.format(hint=f"IGNORE INDEX ({new_indexes})"),
+                    params,
+                )
+                after, after_seconds = explain(
+                    connection, query.format(hint=f"IGNORE INDEX ({baseline})"), params
+                )
+                logger.info(
+                    f"{name} ({table}.{index}): "
+                    f"{before_seconds * 1000:.1f}ms -> {after_seconds * 1000:.1f}ms\n"
+                    f"Without the index:\n{before}\nWith the index:\n{after}"
+                )
+        finally:
+            if not args.keep:
+                cleanup(connection)
+
+
+if __name__ == "__main__":
+    main()
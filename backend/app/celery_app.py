@@ -10,14 +10,19 @@ from app.core.config import settings
 load_dotenv()
 
 
-Path(settings.TEMP_DOWNLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
-logger.info(f"Created temp download folder: {settings.TEMP_DOWNLOAD_FOLDER}")
+Path(settings.INGESTION_FOLDER).mkdir(parents=True, exist_ok=True)
+logger.info(f"Created ingestion folder: {settings.INGESTION_FOLDER}")
 
 celery_app = Celery(
     "labelling_tools",
     backend=os.getenv("CELERY_BACKEND"),
     broker=os.getenv("CELERY_BROKER_URL"),
-    include=["app.tasks.extract_data"],
+    include=[
+        "app.tasks.extract_data",
+        "app.tasks.export_data",
+        "app.tasks.status_counts",
+        "app.tasks.audit_archive",
+    ],
 )
 
 celery_app.conf.update(
@@ -25,7 +30,26 @@ celery_app.conf.update(
     task_serializer="json",
     result_serializer="json",
     accept_content=["json"],
-    broker_transport_options={"global_keyprefix": "labelling_tool_"},
+    broker_transport_options={
+        "global_keyprefix": "labelling_tool_",
+        # Ingestion tasks are acked late, keep long imports from being
+        # re-delivered to another worker while they are still running
+        "visibility_timeout": 12 * 60 * 60,
+    },
     timezone="UTC",
     enable_utc=True,
+    beat_schedule={
+        # A no-op unless AUDIT_RETENTION_DAYS is set
+        "archive-audit-logs": {
+            "task": "app.tasks.audit_archive.archive_old_audit_logs",
+            "schedule": settings.AUDIT_ARCHIVE_INTERVAL,
+        },
+    },
 )
+
+if settings.STATUS_COUNTS_RECONCILE_INTERVAL is not None:
+    # Repair status counter drift, e.g. from rows changed outside the API
+    celery_app.conf.beat_schedule["reconcile-status-counts"] = {
+        "task": "app.tasks.status_counts.reconcile_project_status_counts",
+        "schedule": settings.STATUS_COUNTS_RECONCILE_INTERVAL,
+    }
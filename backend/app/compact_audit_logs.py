@@ -0,0 +1,74 @@
+"""
+Store the old content of existing message audit rows as patches.
+
+Rows are rewritten in batches, each batch in its own transaction, so the
+tool can be stopped and run again. ``--expand`` restores the full texts,
+before downgrading past the content_encoding migration.
+
+    python app/compact_audit_logs.py [--batch-size 1000] [--expand]
+"""
+
+import argparse
+
+from loguru import logger
+from sqlmodel import Session, select
+
+from app.core.db import engine
+from app.crud.audit import compact_message_audit_log, expand_message_audit_log
+from app.models import LineItemMessageAuditLog
+
+
+def rewrite(*, batch_size: int, expand: bool) -> None:
+    if expand:
+        pending = LineItemMessageAuditLog.content_encoding.is_not(None)
+    else:
+        pending = LineItemMessageAuditLog.content_encoding.is_(None)
+
+    last_id = 0
+    num_rows = num_rewritten = bytes_before = bytes_after = 0
+    while True:
+        with Session(engine) as session:
+            audit_logs = session.exec(
+                select(LineItemMessageAuditLog)
+                .where(LineItemMessageAuditLog.id > last_id, pending)
+                .order_by(LineItemMessageAuditLog.id)
+                .limit(batch_size)
+            ).all()
+            if not audit_logs:
+                break
+
+            for audit_log in audit_logs:
+                before = len(audit_log.old_content or "")
+                if expand:
+                    expand_message_audit_log(audit_log)
+                else:
+                    compact_message_audit_log(audit_log)
+                after = len(audit_log.old_content or "")
+                if after != before:
+                    num_rewritten += 1
+                bytes_before += before
+                bytes_after += after
+            session.commit()
+
+            num_rows += len(audit_logs)
+            last_id = audit_logs[-1].id
+        logger.info(f"Processed {num_rows} audit logs, rewrote {num_rewritten}")
+
+    logger.info(
+        f"Rewrote {num_rewritten} of {num_rows} audit logs, old content went "
+        f"from {bytes_before} to {bytes_after} characters"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--expand", action="store_true", help="Restore the full old contents"
+    )
+    args = parser.parse_args()
+    rewrite(batch_size=args.batch_size, expand=args.expand)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from loguru import logger
+
+# Queued by ``stop`` to wake the writer thread up
+_STOP = object()
+
+
+class AuditSink:
+    """
+    In-memory queue of audit rows, written in batches by a daemon thread so
+    requests do not wait for their audit commits.
+
+    A batch is written once ``flush_size`` rows are queued or
+    ``flush_interval`` seconds after its first row, whichever comes first.
+    Rows still queued when the process dies are lost, ``stop`` flushes them
+    on a clean shutdown. While the sink is not running, rows are written
+    synchronously.
+    """
+
+    def __init__(
+        self,
+        *,
+        write: Callable[[list[Any]], None],
+        flush_size: int,
+        flush_interval: float,
+    ) -> None:
+        self._write = write
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._queue: queue.Queue[Any] = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="audit-sink", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Audit sink started, flushing {self._flush_size} rows or every "
+            f"{self._flush_interval}s"
+        )
+
+    def stop(self) -> None:
+        """Stop the writer thread and write the rows still queued"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def enqueue(self, rows: Sequence[Any]) -> None:
+        if not self.running:
+            self._write_batch(list(rows))
+            return
+        for row in rows:
+            self._queue.put(row)
+
+    def flush(self) -> None:
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = []
+            try:
+                while len(batch) < self._flush_size:
+                    row = self._queue.get_nowait()
+                    if row is not _STOP:
+                        batch.append(row)
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _next_batch(self) -> list[Any]:
+        try:
+            row = self._queue.get(timeout=self._flush_interval)
+        except queue.Empty:
+            return []
+        if row is _STOP:
+            return []
+        batch = [row]
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _STOP:
+                break
+            batch.append(row)
+        return batch
+
+    def _write_batch(self, batch: list[Any]) -> None:
+        try:
+            self._write(batch)
+        except Exception as e:
+            logger.exception(f"Failed to write {len(batch)} audit logs: {e}")
@@ -1,5 +1,6 @@
 import secrets
 import warnings
+from pathlib import Path
 from typing import Annotated, Any, Literal
 
 from pydantic import (
@@ -112,6 +113,60 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER_PASSWORD: str
     TEMP_DOWNLOAD_FOLDER: str = "/tmp/labelling_tool"
 
+    @property
+    def INGESTION_FOLDER(self) -> str:
+        # Datasets being ingested live in a subfolder, the temp folder cleanup
+        # only removes top-level files
+        return str(Path(self.TEMP_DOWNLOAD_FOLDER) / "ingestion")
+
+    # "bulk" inserts line items and messages in multi-row batches,
+    # "row" keeps the one-insert-per-line-item path
+    INGESTION_MODE: Literal["bulk", "row"] = "bulk"
+    INGESTION_BATCH_SIZE: int = 1000
+    # Progress is written to the project and Celery backend at most every
+    # N rows or T seconds, whichever comes first
+    INGESTION_PROGRESS_EVERY_ROWS: int = 5000
+    INGESTION_PROGRESS_EVERY_SECONDS: float = 2.0
+    # Files of at least INGESTION_SHARD_MIN_BYTES are split into
+    # INGESTION_SHARDS byte ranges ingested by parallel Celery tasks
+    INGESTION_SHARDS: int = 4
+    INGESTION_SHARD_MIN_BYTES: int = 64 * 1024 * 1024
+    # A shard whose transaction hits a lock deadlock or timeout is retried,
+    # from its checkpoint, up to N times
+    INGESTION_DEADLOCK_RETRIES: int = 5
+    # Parse and insert while the dataset is still downloading, in a single
+    # range, instead of downloading first and then sharding
+    INGESTION_STREAMING: bool = False
+    HTTP_TIMEOUT: float = 60.0
+    # Line items fetched per keyset page when streaming a project export
+    EXPORT_BATCH_SIZE: int = 1000
+    # A pending or running export without a progress write for this long is
+    # considered lost with its worker, and a new one is started
+    EXPORT_STALE_AFTER_SECONDS: int = 15 * 60
+    # The API queues audit rows and inserts them from a background thread in
+    # batches of AUDIT_FLUSH_SIZE rows or every AUDIT_FLUSH_INTERVAL seconds,
+    # False writes them inline in the request
+    AUDIT_ASYNC: bool = True
+    AUDIT_FLUSH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL: float = 1.0
+    # "diff" stores the old content of message audit rows as a patch of the
+    # new content, "full" stores both texts
+    AUDIT_CONTENT_ENCODING: Literal["full", "diff"] = "full"
+    # Celery beat moves audit rows older than AUDIT_RETENTION_DAYS, rounded
+    # down to whole months, to Parquet files under AUDIT_ARCHIVE_FOLDER and
+    # deletes them. None keeps audit rows forever
+    AUDIT_RETENTION_DAYS: int | None = None
+    AUDIT_ARCHIVE_FOLDER: str = "/var/lib/labelling_tool/audit_archive"
+    AUDIT_ARCHIVE_BATCH_SIZE: int = 10000
+    # Seconds between archival runs
+    AUDIT_ARCHIVE_INTERVAL: float = 24 * 60 * 60
+    # Seconds between rebuilds of the status counters of every project by
+    # Celery beat, each one scans the project's line items. None disables it,
+    # the counters are kept in step by the API
+    STATUS_COUNTS_RECONCILE_INTERVAL: float | None = None
+    # Local dataset paths are resolved under this folder, None disables them
+    LOCAL_DATASET_ROOT: str | None = None
+
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
             message = (
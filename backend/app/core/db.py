@@ -1,4 +1,5 @@
 from loguru import logger
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel, create_engine, select
 
@@ -9,6 +10,16 @@ from app.models import User, UserCreate
 engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
 async_engine = create_async_engine(str(settings.SQLALCHEMY_DATABASE_URI_ASYNC))
 
+# MySQL errors after which the whole transaction can simply be run again
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+
+
+def is_deadlock(error: DBAPIError) -> bool:
+    """Whether the transaction was rolled back by a deadlock or lock timeout"""
+    args = getattr(error.orig, "args", ())
+    return bool(args) and args[0] in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT)
+
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
 # otherwise, SQLModel might fail to initialize relationships properly
@@ -1,20 +1,29 @@
+import base64
+import json
 from datetime import datetime
 
-from fastapi import Request
-from sqlalchemy import func
-from sqlmodel import Session, select
+from fastapi import HTTPException, Request
+from sqlalchemy import ColumnElement, and_, event, func, insert, or_
+from sqlalchemy.orm import SessionTransaction
+from sqlmodel import Session, SQLModel, select
 
+from app.core.audit_sink import AuditSink
+from app.core.config import settings
+from app.core.db import engine
 from app.models import (
+    AuditLogCount,
     LineItem,
     LineItemAuditLog,
     LineItemMessage,
     LineItemMessageAuditLog,
 )
+from app.utils import apply_content_diff, encode_content_diff
 
+CONTENT_ENCODING_DIFF = "diff"
 
-def log_line_item_change(
+
+def build_line_item_audit_log(
     *,
-    session: Session,
     line_item: LineItem,
     action: str,
     user_id: int | None,
@@ -23,8 +32,8 @@ def log_line_item_change(
     new_values: dict | None = None,
     additional_data: dict | None = None,
 ) -> LineItemAuditLog:
-    """Log changes to LineItem"""
-    audit_log = LineItemAuditLog(
+    """Audit row of a LineItem change, not added to the session"""
+    return LineItemAuditLog(
         line_item_id=line_item.id,
         project_id=line_item.project_id,
         user_id=user_id,
@@ -39,14 +48,10 @@ def log_line_item_change(
         user_agent=request.headers.get("user-agent") if request else None,
         additional_data=additional_data,
     )
-    session.add(audit_log)
-    session.commit()
-    return audit_log
 
 
-def log_line_item_message_change(
+def build_line_item_message_audit_log(
     *,
-    session: Session,
     line_item_message: LineItemMessage,
     line_item_id: int,
     project_id: int,
@@ -57,8 +62,8 @@ def log_line_item_message_change(
     new_values: dict | None = None,
     additional_data: dict | None = None,
 ) -> LineItemMessageAuditLog:
-    """Log changes to LineItemMessage"""
-    audit_log = LineItemMessageAuditLog(
+    """Audit row of a LineItemMessage change, not added to the session"""
+    return LineItemMessageAuditLog(
         line_item_message_id=line_item_message.id,
         line_item_id=line_item_id,
         project_id=project_id,
@@ -74,70 +79,272 @@ def log_line_item_message_change(
         user_agent=request.headers.get("user-agent") if request else None,
         additional_data=additional_data,
     )
-    session.add(audit_log)
-    session.commit()
-    return audit_log
 
 
-def get_line_item_audit_logs(
+def compact_message_audit_log(audit_log: LineItemMessageAuditLog) -> None:
+    """Replace the old content by a patch of the new content, when smaller"""
+    if (
+        audit_log.content_encoding is not None
+        or audit_log.old_content is None
+        or audit_log.new_content is None
+    ):
+        return
+    patch = encode_content_diff(audit_log.new_content, audit_log.old_content)
+    if len(patch) < len(audit_log.old_content):
+        audit_log.old_content = patch
+        audit_log.content_encoding = CONTENT_ENCODING_DIFF
+
+
+def expand_message_audit_log(audit_log: LineItemMessageAuditLog) -> None:
+    """Rebuild the full old content of a compacted audit row"""
+    if audit_log.content_encoding == CONTENT_ENCODING_DIFF:
+        audit_log.old_content = apply_content_diff(
+            audit_log.new_content, audit_log.old_content
+        )
+        audit_log.content_encoding = None
+
+
+# Key of the session info holding audit rows queued when the session commits
+PENDING_AUDIT_LOGS = "pending_audit_logs"
+
+
+def insert_audit_logs(
+    *,
+    session: Session,
+    audit_logs: list[LineItemAuditLog | LineItemMessageAuditLog],
+) -> None:
+    """Insert audit rows with one statement per table, without committing"""
+    rows_by_model: dict[type[SQLModel], list[dict]] = {}
+    for audit_log in audit_logs:
+        if (
+            isinstance(audit_log, LineItemMessageAuditLog)
+            and settings.AUDIT_CONTENT_ENCODING == "diff"
+        ):
+            compact_message_audit_log(audit_log)
+        columns = audit_log.__table__.columns
+        rows_by_model.setdefault(type(audit_log), []).append(
+            {
+                column.name: getattr(audit_log, column.name)
+                for column in columns
+                if column.name != "id"
+            }
+        )
+    for model, rows in rows_by_model.items():
+        session.execute(insert(model), rows)
+
+
+def write_audit_logs(
+    audit_logs: list[LineItemAuditLog | LineItemMessageAuditLog],
+) -> None:
+    with Session(engine) as session:
+        insert_audit_logs(session=session, audit_logs=audit_logs)
+        session.commit()
+
+
+# Started by the API, elsewhere audit rows are written inline
+audit_sink = AuditSink(
+    write=write_audit_logs,
+    flush_size=settings.AUDIT_FLUSH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+)
+
+
+def add_audit_logs(
+    *,
+    session: Session,
+    audit_logs: list[LineItemAuditLog | LineItemMessageAuditLog],
+) -> None:
+    """
+    Record the audit rows of the session's transaction. With the audit sink
+    running they are queued once the transaction commits, otherwise they are
+    inserted in it.
+    """
+    if audit_sink.running:
+        # Rows belong to the current transaction, begun here if need be
+        if not session.in_transaction():
+            session.begin()
+        session.info.setdefault(PENDING_AUDIT_LOGS, []).extend(audit_logs)
+    else:
+        insert_audit_logs(session=session, audit_logs=audit_logs)
+
+
+@event.listens_for(Session, "after_commit")
+def enqueue_pending_audit_logs(session: Session) -> None:
+    audit_logs = session.info.pop(PENDING_AUDIT_LOGS, None)
+    if audit_logs:
+        audit_sink.enqueue(audit_logs)
+
+
+# Unlike after_rollback, also fired when the transaction ran no statement
+@event.listens_for(Session, "after_soft_rollback")
+def discard_pending_audit_logs(session: Session, _: SessionTransaction) -> None:
+    session.info.pop(PENDING_AUDIT_LOGS, None)
+
+
+def log_line_item_message_change(
     *,
     session: Session,
+    line_item_message: LineItemMessage,
+    line_item_id: int,
+    project_id: int,
+    action: str,
+    user_id: int | None,
+    request: Request | None = None,
+    old_values: dict | None = None,
+    new_values: dict | None = None,
+    additional_data: dict | None = None,
+) -> LineItemMessageAuditLog:
+    """Log changes to LineItemMessage, through the audit sink when it is running"""
+    audit_log = build_line_item_message_audit_log(
+        line_item_message=line_item_message,
+        line_item_id=line_item_id,
+        project_id=project_id,
+        action=action,
+        user_id=user_id,
+        request=request,
+        old_values=old_values,
+        new_values=new_values,
+        additional_data=additional_data,
+    )
+    if audit_sink.running:
+        audit_sink.enqueue([audit_log])
+    else:
+        if settings.AUDIT_CONTENT_ENCODING == "diff":
+            compact_message_audit_log(audit_log)
+        session.add(audit_log)
+        session.commit()
+    return audit_log
+
+
+def encode_audit_log_cursor(timestamp: datetime, audit_log_id: int) -> str:
+    """Opaque cursor for the audit logs older than ``(timestamp, id)``"""
+    payload = {"timestamp": timestamp.isoformat(), "id": audit_log_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_audit_log_cursor(cursor: str) -> tuple[datetime, int]:
+    """Returns the ``(timestamp, id)`` of a cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, dict) or not isinstance(payload.get("id"), int):
+            raise ValueError(payload)
+        timestamp = datetime.fromisoformat(payload["timestamp"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return timestamp, payload["id"]
+
+
+def build_audit_log_filters(
+    model: type[LineItemAuditLog] | type[LineItemMessageAuditLog],
+    *,
     project_id: int,
     line_item_id: int | None = None,
+    line_item_message_id: int | None = None,
     user_id: int | None = None,
     start_date: datetime | None = None,
     end_date: datetime | None = None,
-    page: int = 1,
-    limit: int = 50,
-) -> tuple[list[LineItemAuditLog], int, int]:
-    """Get audit logs for LineItem with pagination"""
-    # Build query
-    statement = select(LineItemAuditLog).where(
-        LineItemAuditLog.project_id == project_id
-    )
-
+) -> list[ColumnElement[bool]]:
+    """WHERE clauses of an audit log query, shared by both audit tables"""
+    filters = [model.project_id == project_id]
     if line_item_id:
-        statement = statement.where(LineItemAuditLog.line_item_id == line_item_id)
+        filters.append(model.line_item_id == line_item_id)
+    if line_item_message_id:
+        filters.append(
+            LineItemMessageAuditLog.line_item_message_id == line_item_message_id
+        )
     if user_id:
-        statement = statement.where(LineItemAuditLog.user_id == user_id)
+        filters.append(model.user_id == user_id)
     if start_date:
-        statement = statement.where(LineItemAuditLog.timestamp >= start_date)
+        filters.append(model.timestamp >= start_date)
     if end_date:
-        statement = statement.where(LineItemAuditLog.timestamp <= end_date)
+        filters.append(model.timestamp <= end_date)
+    return filters
 
-    # Get total count
-    count_statement = (
-        select(func.count())
-        .select_from(LineItemAuditLog)
-        .where(LineItemAuditLog.project_id == project_id)
-    )
-    if line_item_id:
-        count_statement = count_statement.where(
-            LineItemAuditLog.line_item_id == line_item_id
-        )
-    if user_id:
-        count_statement = count_statement.where(LineItemAuditLog.user_id == user_id)
-    if start_date:
-        count_statement = count_statement.where(
-            LineItemAuditLog.timestamp >= start_date
+
+def get_audit_log_page(
+    *,
+    session: Session,
+    model: type[LineItemAuditLog] | type[LineItemMessageAuditLog],
+    filters: list[ColumnElement[bool]],
+    page: int,
+    limit: int,
+    cursor: str | None,
+    count: AuditLogCount,
+) -> tuple[list, int | None, int | None, str | None]:
+    """
+    A page of audit logs, newest first, with its total count, number of pages
+    and next cursor.
+
+    With a cursor the page is fetched by keyset on ``(timestamp, id)``
+    instead of ``page``, and is not counted. Otherwise the total comes from a
+    separate ``COUNT(*)``, which the filter indexes answer without reading
+    the rows.
+    """
+    statement = select(model).where(*filters)
+    if cursor:
+        timestamp, audit_log_id = decode_audit_log_cursor(cursor)
+        statement = statement.where(
+            or_(
+                model.timestamp < timestamp,
+                and_(model.timestamp == timestamp, model.id < audit_log_id),
+            )
         )
-    if end_date:
-        count_statement = count_statement.where(LineItemAuditLog.timestamp <= end_date)
+    else:
+        statement = statement.offset((page - 1) * limit)
+    # One extra row tells whether there is a next page
+    rows = session.exec(
+        statement.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1)
+    ).all()
+
+    logs = list(rows)
 
-    total_count = session.exec(count_statement).one()
+    total_count = None
+    if count == AuditLogCount.EXACT and cursor is None:
+        total_count = session.exec(
+            select(func.count()).select_from(model).where(*filters)
+        ).one()
 
-    # Apply pagination
-    offset = (page - 1) * limit
-    statement = (
-        statement.order_by(LineItemAuditLog.timestamp.desc())
-        .offset(offset)
-        .limit(limit)
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = encode_audit_log_cursor(logs[-1].timestamp, logs[-1].id)
+    total_pages = (
+        (total_count + limit - 1) // limit if total_count is not None else None
     )
+    return logs, total_count, total_pages, next_cursor
 
-    logs = session.exec(statement).all()
-    total_pages = (total_count + limit - 1) // limit
 
-    return logs, total_count, total_pages
+def get_line_item_audit_logs(
+    *,
+    session: Session,
+    project_id: int,
+    line_item_id: int | None = None,
+    user_id: int | None = None,
+    start_date: datetime | None = None,
+    end_date: datetime | None = None,
+    page: int = 1,
+    limit: int = 50,
+    cursor: str | None = None,
+    count: AuditLogCount = AuditLogCount.EXACT,
+) -> tuple[list[LineItemAuditLog], int | None, int | None, str | None]:
+    """Get audit logs for LineItem with pagination"""
+    filters = build_audit_log_filters(
+        LineItemAuditLog,
+        project_id=project_id,
+        line_item_id=line_item_id,
+        user_id=user_id,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    return get_audit_log_page(
+        session=session,
+        model=LineItemAuditLog,
+        filters=filters,
+        page=page,
+        limit=limit,
+        cursor=cursor,
+        count=count,
+    )
 
 
 def get_line_item_message_audit_logs(
@@ -151,66 +358,32 @@ def get_line_item_message_audit_logs(
     end_date: datetime | None = None,
     page: int = 1,
     limit: int = 50,
-) -> tuple[list[LineItemMessageAuditLog], int, int]:
+    cursor: str | None = None,
+    count: AuditLogCount = AuditLogCount.EXACT,
+) -> tuple[list[LineItemMessageAuditLog], int | None, int | None, str | None]:
     """Get audit logs for LineItemMessage with pagination"""
-    # Build query
-    statement = select(LineItemMessageAuditLog).where(
-        LineItemMessageAuditLog.project_id == project_id
-    )
-
-    if line_item_id:
-        statement = statement.where(
-            LineItemMessageAuditLog.line_item_id == line_item_id
-        )
-    if line_item_message_id:
-        statement = statement.where(
-            LineItemMessageAuditLog.line_item_message_id == line_item_message_id
-        )
-    if user_id:
-        statement = statement.where(LineItemMessageAuditLog.user_id == user_id)
-    if start_date:
-        statement = statement.where(LineItemMessageAuditLog.timestamp >= start_date)
-    if end_date:
-        statement = statement.where(LineItemMessageAuditLog.timestamp <= end_date)
-
-    # Get total count
-    count_statement = (
-        select(func.count())
-        .select_from(LineItemMessageAuditLog)
-        .where(LineItemMessageAuditLog.project_id == project_id)
+    filters = build_audit_log_filters(
+        LineItemMessageAuditLog,
+        project_id=project_id,
+        line_item_id=line_item_id,
+        line_item_message_id=line_item_message_id,
+        user_id=user_id,
+        start_date=start_date,
+        end_date=end_date,
     )
-    if line_item_id:
-        count_statement = count_statement.where(
-            LineItemMessageAuditLog.line_item_id == line_item_id
-        )
-    if line_item_message_id:
-        count_statement = count_statement.where(
-            LineItemMessageAuditLog.line_item_message_id == line_item_message_id
-        )
-    if user_id:
-        count_statement = count_statement.where(
-            LineItemMessageAuditLog.user_id == user_id
-        )
-    if start_date:
-        count_statement = count_statement.where(
-            LineItemMessageAuditLog.timestamp >= start_date
-        )
-    if end_date:
-        count_statement = count_statement.where(
-            LineItemMessageAuditLog.timestamp <= end_date
-        )
-
-    total_count = session.exec(count_statement).one()
-
-    # Apply pagination
-    offset = (page - 1) * limit
-    statement = (
-        statement.order_by(LineItemMessageAuditLog.timestamp.desc())
-        .offset(offset)
-        .limit(limit)
+    logs, total_count, total_pages, next_cursor = get_audit_log_page(
+        session=session,
+        model=LineItemMessageAuditLog,
+        filters=filters,
+        page=page,
+        limit=limit,
+        cursor=cursor,
+        count=count,
     )
+    for log in logs:
+        if log.content_encoding is not None:
+            # Detached, so the expanded content is never written back
+            session.expunge(log)
+            expand_message_audit_log(log)
 
-    logs = session.exec(statement).all()
-    total_pages = (total_count + limit - 1) // limit
-
-    return logs, total_count, total_pages
+    return logs, total_count, total_pages, next_cursor
@@ -0,0 +1,108 @@
+import itertools
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+from loguru import logger
+from sqlalchemy import JSON, DateTime, Integer, Table, delete
+from sqlmodel import Session, SQLModel, select
+
+from app.crud.audit import CONTENT_ENCODING_DIFF
+from app.models import LineItemAuditLog, LineItemMessageAuditLog
+from app.utils import apply_content_diff
+
+AUDIT_LOG_MODELS: list[type[SQLModel]] = [LineItemAuditLog, LineItemMessageAuditLog]
+
+
+def get_archive_cutoff(*, now: datetime, retention_days: int) -> datetime:
+    """First day of the month of the retention limit, whole months are archived"""
+    limit = now - timedelta(days=retention_days)
+    return limit.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_archive_schema(table: Table) -> pl.Schema:
+    # JSON columns are archived as JSON strings, to keep one schema per table
+    return pl.Schema(
+        {
+            column.name: (
+                pl.Int64
+                if isinstance(column.type, Integer)
+                else pl.Datetime("us")
+                if isinstance(column.type, DateTime)
+                else pl.String
+            )
+            for column in table.columns
+        }
+    )
+
+
+def to_archive_row(table: Table, row: dict[str, Any]) -> dict[str, Any]:
+    row = dict(row)
+    for column in table.columns:
+        if isinstance(column.type, JSON) and row[column.name] is not None:
+            row[column.name] = json.dumps(row[column.name], ensure_ascii=False)
+    # Archives hold full texts, they are read without the app
+    if row.get("content_encoding") == CONTENT_ENCODING_DIFF:
+        row["old_content"] = apply_content_diff(row["new_content"], row["old_content"])
+        row["content_encoding"] = None
+    return row
+
+
+def archive_audit_logs(
+    *,
+    session: Session,
+    model: type[SQLModel],
+    before: datetime,
+    folder: Path,
+    batch_size: int,
+) -> int:
+    """
+    Move the audit rows older than ``before`` to Parquet files, one folder
+    per month: ``folder/<table>/<YYYY-MM>/<first id>-<last id>.parquet``.
+
+    Each batch is deleted once its files are written, a failed run leaves
+    its remaining rows in the table for the next one.
+    """
+    table: Table = model.__table__  # type: ignore[attr-defined]
+    schema = get_archive_schema(table)
+    num_archived = 0
+    while True:
+        rows = (
+            session.execute(
+                select(table)
+                .where(table.c.timestamp < before)
+                .order_by(table.c.timestamp, table.c.id)
+                .limit(batch_size)
+            )
+            .mappings()
+            .all()
+        )
+        if not rows:
+            break
+
+        for (year, month), month_rows in itertools.groupby(
+            rows, key=lambda row: (row["timestamp"].year, row["timestamp"].month)
+        ):
+            month_rows = list(month_rows)
+            month_folder = folder / table.name / f"{year:04d}-{month:02d}"
+            month_folder.mkdir(parents=True, exist_ok=True)
+            file_path = (
+                month_folder / f"{month_rows[0]['id']}-{month_rows[-1]['id']}.parquet"
+            )
+            part_path = file_path.with_suffix(".parquet.part")
+            pl.DataFrame(
+                [to_archive_row(table, row) for row in month_rows], schema=schema
+            ).write_parquet(part_path, compression="zstd")
+            part_path.rename(file_path)
+
+        session.execute(
+            delete(table).where(table.c.id.in_([row["id"] for row in rows]))
+        )
+        session.commit()
+        num_archived += len(rows)
+
+    if num_archived:
+        logger.info(f"Archived {num_archived} rows of {table.name} to {folder}")
+    return num_archived
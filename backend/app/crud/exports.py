@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from fastapi import HTTPException
+from loguru import logger
+from sqlalchemy import func, or_
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models import LineItem, ProjectDownloadRequest, ProjectExport
+from app.tasks.export_data import export_project
+from app.utils import get_export_file_suffix
+
+
+def get_export_file_path(cache_key: str, export_request: ProjectDownloadRequest) -> str:
+    # Artifacts live at the top of the temp folder, so the temp folder cleanup
+    # expires the ones that are not downloaded again
+    suffix = get_export_file_suffix(export_request)
+    return str(Path(settings.TEMP_DOWNLOAD_FOLDER) / f"export_{cache_key}{suffix}")
+
+
+def get_export_cache_key(
+    *, session: Session, project_id: int, export_request: ProjectDownloadRequest
+) -> str:
+    """
+    Hash the export options with the project's data version, the number of
+    line items and their latest ``updated_at``, so edits invalidate the cache.
+    """
+    num_line_items, last_updated_at = session.exec(
+        select(func.count(), func.max(LineItem.updated_at)).where(
+            LineItem.project_id == project_id
+        )
+    ).one()
+    key = {
+        "project_id": project_id,
+        "limit": export_request.limit,
+        "include_statuses": sorted(
+            status.value for status in export_request.include_statuses
+        ),
+        "format": export_request.format.value,
+        "compress": export_request.compress,
+        "parquet_compression": export_request.parquet_compression,
+        "num_line_items": num_line_items,
+        "last_updated_at": last_updated_at.isoformat() if last_updated_at else None,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def get_project_export(
+    *, session: Session, project_id: int, export_id: int
+) -> ProjectExport | None:
+    return session.exec(
+        select(ProjectExport).where(
+            ProjectExport.id == export_id, ProjectExport.project_id == project_id
+        )
+    ).first()
+
+
+def create_project_export(
+    *, session: Session, project_id: int, export_request: ProjectDownloadRequest
+) -> ProjectExport:
+    """
+    Start a background export, or reuse the export of an unchanged snapshot.
+
+    An identical export still running is returned as is, unless it has not
+    reported progress for ``settings.EXPORT_STALE_AFTER_SECONDS``. A finished
+    one whose artifact is still on disk is copied to a new, already
+    successful export.
+    """
+    cache_key = get_export_cache_key(
+        session=session, project_id=project_id, export_request=export_request
+    )
+    stale_before = datetime.now() - timedelta(
+        seconds=settings.EXPORT_STALE_AFTER_SECONDS
+    )
+    existing = session.exec(
+        select(ProjectExport)
+        .where(
+            ProjectExport.project_id == project_id,
+            ProjectExport.cache_key == cache_key,
+            or_(
+                ProjectExport.status == "SUCCESS",
+                ProjectExport.status.in_(["PENDING", "PROGRESS"])
+                & (ProjectExport.updated_at >= stale_before),
+            ),
+        )
+        .order_by(ProjectExport.id.desc())
+    ).first()
+    if existing and existing.status != "SUCCESS":
+        return existing
+
+    file_name = export_request.file_name + get_export_file_suffix(export_request)
+
+    if existing and existing.file_path and Path(existing.file_path).exists():
+        # Keep the artifact from being cleaned up while it is in use
+        os.utime(existing.file_path)
+        db_export = ProjectExport(
+            project_id=project_id,
+            cache_key=cache_key,
+            status="SUCCESS",
+            info={
+                "type": "completed",
+                "content": f"Reused the artifact of export {existing.id}",
+            },
+            file_name=file_name,
+            file_path=existing.file_path,
+            num_records=existing.num_records,
+        )
+        session.add(db_export)
+        session.commit()
+        session.refresh(db_export)
+        return db_export
+
+    db_export = ProjectExport(
+        project_id=project_id,
+        cache_key=cache_key,
+        file_name=file_name,
+    )
+    session.add(db_export)
+    session.commit()
+    session.refresh(db_export)
+
+    # The worker needs the committed row, so an export that could not be
+    # queued is failed instead, for the next request not to reuse it
+    try:
+        task = export_project.delay(
+            db_export.id,
+            get_export_file_path(cache_key, export_request),
+            export_request.model_dump(mode="json"),
+        )
+    except Exception as e:
+        logger.exception(e)
+        db_export.status = "FAILURE"
+        db_export.info = {"type": "failed", "content": f"Export not queued: {e}"}
+        db_export.updated_at = datetime.now()
+        session.add(db_export)
+        session.commit()
+        raise HTTPException(status_code=503, detail="Could not queue the export") from e
+
+    db_export.task_id = task.id
+    session.add(db_export)
+    session.commit()
+    session.refresh(db_export)
+
+    return db_export
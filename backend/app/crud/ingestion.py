@@ -0,0 +1,233 @@
+from collections.abc import Callable, Iterable
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.crud.status_counts import adjust_status_counts
+from app.models import (
+    IngestionCheckpoint,
+    LineItem,
+    LineItemBase,
+    LineItemMessage,
+    LineItemMessageBase,
+    LineItemStatus,
+)
+
+IngestionRow = tuple[LineItemBase, list[LineItemMessageBase]]
+
+
+def insert_line_item(
+    *,
+    session: Session,
+    project_id: int,
+    line_index: int,
+    item_base: LineItemBase,
+    line_messages: list[LineItemMessageBase],
+) -> None:
+    """Insert a single line item and its messages, without committing.
+
+    The status counters are left to the caller, see ``ingest_records``.
+    """
+    db_line_item = LineItem(
+        project_id=project_id,
+        tools=item_base.tools,
+        line_index=line_index,
+    )
+    session.add(db_line_item)
+    session.flush()
+
+    for line_message in line_messages:
+        session.add(
+            LineItemMessage(
+                line_item_id=db_line_item.id,
+                role=line_message.role,
+                content=line_message.content,
+                line_message_index=line_message.line_message_index,
+            )
+        )
+    session.flush()
+
+
+def insert_line_items_batch(
+    *,
+    session: Session,
+    project_id: int,
+    start_index: int,
+    rows: list[IngestionRow],
+) -> int:
+    """Insert a chunk of line items and their messages, without committing.
+
+    Line items get consecutive ``line_index`` values starting at ``start_index``.
+    Both tables are written with a single executemany each, the generated
+    ``line_item.id`` values are resolved with one range query on
+    ``(project_id, line_index)``.
+
+    The status counters are left to the caller, see ``ingest_records``.
+
+    Returns the number of messages inserted.
+    """
+    if not rows:
+        return 0
+
+    now = datetime.now()
+    end_index = start_index + len(rows) - 1
+    session.execute(
+        insert(LineItem),
+        [
+            {
+                "project_id": project_id,
+                "line_index": start_index + offset,
+                "tools": item_base.tools,
+                "status": LineItemStatus.UNLABELED,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for offset, (item_base, _) in enumerate(rows)
+        ],
+    )
+
+    line_item_ids = dict(
+        session.exec(
+            select(LineItem.line_index, LineItem.id).where(
+                LineItem.project_id == project_id,
+                LineItem.line_index >= start_index,
+                LineItem.line_index <= end_index,
+            )
+        ).all()
+    )
+
+    message_values = [
+        {
+            "line_item_id": line_item_ids[start_index + offset],
+            "role": line_message.role,
+            "content": line_message.content,
+            "line_message_index": line_message.line_message_index,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for offset, (_, line_messages) in enumerate(rows)
+        for line_message in line_messages
+    ]
+    if message_values:
+        session.execute(insert(LineItemMessage), message_values)
+
+    return len(message_values)
+
+
+def get_ingestion_checkpoints(
+    *, session: Session, project_id: int
+) -> list[IngestionCheckpoint]:
+    statement = (
+        select(IngestionCheckpoint)
+        .where(IngestionCheckpoint.project_id == project_id)
+        .order_by(IngestionCheckpoint.shard_start)
+    )
+    return session.exec(statement).all()
+
+
+def create_ingestion_checkpoints(
+    *,
+    session: Session,
+    project_id: int,
+    shards: list[tuple[int, int | None, int | None]],
+) -> list[IngestionCheckpoint]:
+    """Create one checkpoint per ``(start, end, num_records)`` byte range.
+
+    Line indexes are pre-assigned to the ranges in file order, so only the
+    last range may have an unknown end and number of records.
+    """
+    checkpoints = []
+    first_line_index = 1
+    for start, end, num_records in shards:
+        checkpoint = IngestionCheckpoint(
+            project_id=project_id,
+            shard_start=start,
+            shard_end=end,
+            first_line_index=first_line_index,
+            num_records=num_records,
+            byte_offset=start,
+            line_index=first_line_index - 1,
+        )
+        session.add(checkpoint)
+        checkpoints.append(checkpoint)
+        first_line_index += num_records or 0
+    session.commit()
+    for checkpoint in checkpoints:
+        session.refresh(checkpoint)
+    return checkpoints
+
+
+def ingest_records(
+    *,
+    session: Session,
+    project_id: int,
+    records: Iterable[tuple[int, LineItemBase, list[LineItemMessageBase]]],
+    checkpoint: IngestionCheckpoint,
+    on_progress: Callable[[int], None] | None = None,
+) -> int:
+    """Insert the ``(byte_offset, item_base, line_messages)`` records of a range.
+
+    Records get consecutive line indexes after ``checkpoint.line_index``. Each
+    chunk (``settings.INGESTION_MODE == "bulk"``) or row is committed in the
+    same transaction as the checkpoint update, so a re-delivered task resumes
+    from ``checkpoint.byte_offset`` without duplicating rows. ``on_progress``
+    is called after every commit with the number of rows ingested for the
+    range, including earlier runs.
+
+    Returns the number of line items ingested for the range.
+    """
+
+    def commit(byte_offset: int, num_rows: int) -> None:
+        checkpoint.byte_offset = byte_offset
+        checkpoint.line_index += num_rows
+        checkpoint.updated_at = datetime.now()
+        session.add(checkpoint)
+        session.flush()
+        # Last statement before the commit, parallel shards hold the lock of
+        # the project-wide UNLABELED counter as briefly as possible
+        adjust_status_counts(
+            session=session,
+            project_id=project_id,
+            deltas={LineItemStatus.UNLABELED: num_rows},
+        )
+        session.commit()
+        if on_progress:
+            on_progress(checkpoint.line_index - checkpoint.first_line_index + 1)
+
+    byte_offset = checkpoint.byte_offset
+    batch: list[IngestionRow] = []
+    for byte_offset, item_base, line_messages in records:
+        if settings.INGESTION_MODE == "bulk":
+            batch.append((item_base, line_messages))
+            if len(batch) < settings.INGESTION_BATCH_SIZE:
+                continue
+            insert_line_items_batch(
+                session=session,
+                project_id=project_id,
+                start_index=checkpoint.line_index + 1,
+                rows=batch,
+            )
+            commit(byte_offset, len(batch))
+            batch.clear()
+        else:
+            insert_line_item(
+                session=session,
+                project_id=project_id,
+                line_index=checkpoint.line_index + 1,
+                item_base=item_base,
+                line_messages=line_messages,
+            )
+            commit(byte_offset, 1)
+
+    insert_line_items_batch(
+        session=session,
+        project_id=project_id,
+        start_index=checkpoint.line_index + 1,
+        rows=batch,
+    )
+    checkpoint.completed = True
+    commit(byte_offset, len(batch))
+
+    return checkpoint.line_index - checkpoint.first_line_index + 1
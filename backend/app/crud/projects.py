@@ -1,25 +1,56 @@
+import base64
+import json
 import math
-import uuid
+import shutil
+from collections import Counter
+from collections.abc import Generator
+from datetime import datetime
 from pathlib import Path
+from typing import Any, BinaryIO
 
 from fastapi import HTTPException, Request
-from sqlalchemy import case, func
+from sqlalchemy import case, delete, func, insert, literal
 from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
 
 from app.core.config import settings
-from app.crud.audit import log_line_item_change, log_line_item_message_change
+from app.crud.audit import (
+    add_audit_logs,
+    build_line_item_audit_log,
+    build_line_item_message_audit_log,
+    log_line_item_message_change,
+)
+from app.crud.status_counts import (
+    PROJECT_WIDE,
+    adjust_status_counts,
+    create_status_counts,
+    get_project_task_totals,
+    get_status_counts,
+    move_line_item_status,
+)
 from app.models import (
+    AssignmentStrategy,
+    DatasetSourceType,
     LineItem,
+    LineItemAuditLog,
     LineItemConfirmRequest,
+    LineItemFields,
     LineItemMessage,
+    LineItemMessageAuditLog,
     LineItemMessageUpdateRequest,
+    LineItemRead,
+    LineItemsPublic,
     LineItemStatus,
+    LineItemStatusCount,
+    LineItemSummary,
     Project,
     ProjectCreate,
+    RebalanceTasksRequest,
     Task,
     User,
+    UserTaskRebalance,
 )
+from app.sources import resolve_local_dataset_path
 from app.tasks.extract_data import extract_data
 
 
@@ -37,12 +68,30 @@ def get_projects(*, session: Session, current_user: User) -> list[Project]:
 
 
 def get_project_by_id(*, session: Session, project_id: int) -> Project | None:
-    statement = (
-        select(Project)
-        .where(Project.id == project_id)
-        .options(selectinload(Project.line_items))
-    )
-    return session.exec(statement).first()
+    """Get a project without its line items, use the counters for totals"""
+    return session.get(Project, project_id)
+
+
+def encode_line_item_cursor(
+    *, after: int | None = None, before: int | None = None
+) -> str:
+    """Opaque cursor for the line items after or before a ``line_index``"""
+    payload = {"after": after} if after is not None else {"before": before}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_line_item_cursor(cursor: str) -> tuple[int | None, int | None]:
+    """Returns the ``(after_line_index, before_line_index)`` of a cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, dict):
+            raise ValueError(payload)
+        after, before = payload.get("after"), payload.get("before")
+        if not isinstance(after, int | None) or not isinstance(before, int | None):
+            raise ValueError(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after, before
 
 
 def get_line_items(
@@ -54,25 +103,33 @@ def get_line_items(
     status: LineItemStatus | None = None,
     user_id: int | None = None,
     is_superuser: bool = False,
-) -> tuple[list[LineItem], int, int]:
-    # Get total count of line items
-    total_statement = (
-        select(func.count())
-        .select_from(LineItem)
-        .where(LineItem.project_id == project_id)
-    )
-    if status:
-        total_statement = total_statement.where(LineItem.status == status)
-    if user_id and not is_superuser:
-        total_statement = total_statement.join(
-            Task, LineItem.id == Task.line_item_id
-        ).where(Task.user_id == user_id, Task.project_id == project_id)
+    after_line_index: int | None = None,
+    before_line_index: int | None = None,
+    include_status_counts: bool = True,
+    fields: LineItemFields = LineItemFields.FULL,
+) -> LineItemsPublic:
+    """
+    Get a page of line items ordered by ``line_index``.
 
-    total_count = session.exec(total_statement).one()
+    With ``after_line_index`` or ``before_line_index`` the page is fetched by
+    keyset on ``(project_id, line_index)`` instead of ``page``, so deep pages
+    cost the same as the first one. Without ``include_status_counts``,
+    ``status_counts`` is None. ``LineItemFields.SUMMARY`` skips the messages.
+    """
+    # Totals come from the status counters, no line item is scanned to count
+    status_counts = get_status_counts(
+        session=session,
+        project_id=project_id,
+        user_id=user_id if user_id and not is_superuser else PROJECT_WIDE,
+    )
+    total_count = status_counts[status.value] if status else sum(status_counts.values())
+    if not include_status_counts:
+        status_counts = None
 
     # Get line items
-    offset = (page - 1) * limit
     statement = select(LineItem).where(LineItem.project_id == project_id)
+    if fields == LineItemFields.FULL:
+        statement = statement.options(selectinload(LineItem.line_messages))
     if status:
         statement = statement.where(LineItem.status == status)
     if user_id and not is_superuser:
@@ -82,55 +139,101 @@ def get_line_items(
             .where(Task.user_id == user_id, Task.project_id == project_id)
         )
 
-    statement = statement.offset(offset).limit(limit)
-    line_items = session.exec(statement).all()
+    # One extra row tells whether there is a page after this one
+    if before_line_index is not None:
+        statement = (
+            statement.where(LineItem.line_index < before_line_index)
+            .order_by(LineItem.line_index.desc())
+            .limit(limit + 1)
+        )
+        line_items = session.exec(statement).all()
+        has_prev, has_next = len(line_items) > limit, True
+        line_items = line_items[:limit][::-1]
+    else:
+        statement = statement.order_by(LineItem.line_index)
+        if after_line_index is not None:
+            statement = statement.where(LineItem.line_index > after_line_index)
+            has_prev = after_line_index > 0
+        else:
+            statement = statement.offset((page - 1) * limit)
+            has_prev = page > 1
+        line_items = session.exec(statement.limit(limit + 1)).all()
+        has_next = len(line_items) > limit
+        line_items = line_items[:limit]
     num_pages = math.ceil(total_count / limit)
 
-    # Get status counts
-    status_counts_stmt = (
-        select(LineItem.status, func.count())
-        .where(LineItem.project_id == project_id)
-        .group_by(LineItem.status)
+    item_model = LineItemRead if fields == LineItemFields.FULL else LineItemSummary
+    return LineItemsPublic(
+        data=[item_model.model_validate(line_item) for line_item in line_items],
+        total_count=total_count,
+        num_pages=num_pages,
+        status_counts=status_counts,
+        next_cursor=(
+            encode_line_item_cursor(after=line_items[-1].line_index)
+            if line_items and has_next
+            else None
+        ),
+        prev_cursor=(
+            encode_line_item_cursor(before=line_items[0].line_index)
+            if line_items and has_prev
+            else None
+        ),
     )
-    if user_id and not is_superuser:
-        status_counts_stmt = (
-            status_counts_stmt.select_from(LineItem)
-            .join(Task, LineItem.id == Task.line_item_id)
-            .where(Task.user_id == user_id, Task.project_id == project_id)
-        )
-
-    status_counts_result = session.exec(status_counts_stmt).all()
 
-    # Always include all statuses with default = 0
-    status_counts = {status.value: 0 for status in LineItemStatus}
-    for status, count in status_counts_result:
-        status_counts[status.value] = count
 
-    return line_items, total_count, num_pages, status_counts
+def get_ingestion_file_path(project_id: int) -> str:
+    # Stable per project, so a resumed ingestion finds the downloaded file
+    return str(Path(settings.INGESTION_FOLDER) / f"project_{project_id}.jsonl")
 
 
 def create_project(
-    *, session: Session, project_in: ProjectCreate, current_user: User
+    *,
+    session: Session,
+    project_in: ProjectCreate,
+    current_user: User,
+    upload_file: BinaryIO | None = None,
 ) -> Project:
-    file_path = str(Path(settings.TEMP_DOWNLOAD_FOLDER) / f"{uuid.uuid4()}.jsonl")
+    """Create a project and start ingesting its dataset.
+
+    ``upload_file`` is the dataset of ``DatasetSourceType.UPLOAD`` projects,
+    it is copied to the project's ingestion path before the task starts.
+    """
+    if project_in.source == DatasetSourceType.LOCAL:
+        try:
+            resolve_local_dataset_path(project_in.url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if (project_in.source == DatasetSourceType.UPLOAD) != (upload_file is not None):
+        raise HTTPException(
+            status_code=400, detail="Uploaded datasets must be sent as a file"
+        )
+
     db_project = Project(
         name=project_in.name,
         description=project_in.description,
         url=project_in.url,
+        source=project_in.source,
         owner_id=current_user.id,
+        # Set before the task starts, so that it can't overwrite a failure
+        status="processing",
     )
     session.add(db_project)
+    session.flush()
+    create_status_counts(session=session, project_id=db_project.id)
     session.commit()
     session.refresh(db_project)
 
+    if upload_file is not None:
+        with open(get_ingestion_file_path(db_project.id), "wb") as f:
+            shutil.copyfileobj(upload_file, f, length=1024 * 1024)
+
     task = extract_data.delay(
         project_in.url,
-        file_path,
+        get_ingestion_file_path(db_project.id),
         db_project.id,
     )
 
     db_project.task_id = task.id
-    db_project.status = "processing"
     session.add(db_project)
     session.commit()
     session.refresh(db_project)
@@ -138,6 +241,35 @@ def create_project(
     return db_project
 
 
+# Statuses of a project whose extract_data task is queued or running
+INGESTION_IN_FLIGHT_STATUSES = ("processing", "PENDING", "PROGRESS")
+
+
+def resume_project_ingestion(*, session: Session, project: Project) -> Project:
+    """Re-run the ingestion of a project, continuing from its checkpoints"""
+    # Lock the project until the commit, so only one of concurrent resumes
+    # finds it stopped and starts an ingestion
+    session.refresh(project, with_for_update=True)
+    if project.status == "SUCCESS":
+        raise HTTPException(status_code=400, detail="Project is already ingested")
+    if project.status in INGESTION_IN_FLIGHT_STATUSES:
+        raise HTTPException(status_code=409, detail="Project is already ingesting")
+
+    task = extract_data.delay(
+        project.url,
+        get_ingestion_file_path(project.id),
+        project.id,
+    )
+
+    project.task_id = task.id
+    project.status = "processing"
+    session.add(project)
+    session.commit()
+    session.refresh(project)
+
+    return project
+
+
 def get_line_item_by_index(
     *, session: Session, project_id: int, line_index: int
 ) -> LineItem | None:
@@ -149,47 +281,115 @@ def get_line_item_by_index(
     return session.exec(statement).first()
 
 
-def assign_task(
+def lock_project_assignments(*, session: Session, project_id: int) -> None:
+    """
+    Serialize the assignments of a project until the end of the transaction,
+    so two of them never pick the same unassigned line items
+    """
+    project = session.exec(
+        select(Project.id).where(Project.id == project_id).with_for_update()
+    ).first()
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+
+def assign_unassigned_line_items(
     *, session: Session, project_id: int, user_id: int, num_samples: int
-) -> None:
-    # First, get all line items are assigned to the user
-    assigned_line_items = session.exec(
-        select(Task.line_item_id).where(Task.project_id == project_id)
-    ).all()
-    line_items_ids = session.exec(
-        select(LineItem.id).where(LineItem.project_id == project_id)
-    ).all()
-    line_items_ids = [
-        line_item_id
-        for line_item_id in line_items_ids
-        if line_item_id not in assigned_line_items
-    ]
-    if len(line_items_ids) < num_samples:
-        raise HTTPException(status_code=400, detail="Not enough line items to assign")
+) -> tuple[int, int | None, int | None]:
+    """
+    Assign the first ``num_samples`` unassigned line items of a project to a
+    user, without committing. Returns the number of assigned line items and
+    the first and last of their line indexes.
+    """
+    lock_project_assignments(session=session, project_id=project_id)
 
-    # Then, assign the tasks
-    for line_item_id in line_items_ids[:num_samples]:
-        task = Task(
-            project_id=project_id,
-            user_id=user_id,
-            line_item_id=line_item_id,
+    # Tasks inserted below get ids above the current maximum
+    last_task_id = session.exec(select(func.max(Task.id))).one() or 0
+
+    now = datetime.now()
+    unassigned_line_items = (
+        select(
+            literal(project_id),
+            literal(user_id),
+            LineItem.id,
+            literal(now),
+            literal(now),
+        )
+        .outerjoin(Task, Task.line_item_id == LineItem.id)
+        .where(LineItem.project_id == project_id, Task.id.is_(None))
+        .order_by(LineItem.line_index)
+        .limit(num_samples)
+    )
+    session.execute(
+        insert(Task).from_select(
+            ["project_id", "user_id", "line_item_id", "created_at", "updated_at"],
+            unassigned_line_items,
+        )
+    )
+
+    assigned = session.exec(
+        select(
+            LineItem.status,
+            func.count(),
+            func.min(LineItem.line_index),
+            func.max(LineItem.line_index),
+        )
+        .join(Task, Task.line_item_id == LineItem.id)
+        .where(
+            Task.project_id == project_id,
+            Task.user_id == user_id,
+            Task.id > last_task_id,
+        )
+        .group_by(LineItem.status)
+        .with_for_update(read=True)
+    ).all()
+    num_assigned = sum(count for _, count, _, _ in assigned)
+    if num_assigned < num_samples:
+        session.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=f"Not enough unassigned line items. Available: {num_assigned}, Requested: {num_samples}",
         )
-        session.add(task)
-        session.commit()
+
+    adjust_status_counts(
+        session=session,
+        project_id=project_id,
+        user_id=user_id,
+        deltas={status: count for status, count, _, _ in assigned},
+    )
+    if not assigned:
+        return 0, None, None
+    return (
+        num_assigned,
+        min(first for _, _, first, _ in assigned),
+        max(last for _, _, _, last in assigned),
+    )
+
+
+def assign_task(
+    *, session: Session, project_id: int, user_id: int, num_samples: int
+) -> tuple[int, int | None, int | None]:
+    """Assign unassigned line items to a user, in line index order"""
+    assigned = assign_unassigned_line_items(
+        session=session,
+        project_id=project_id,
+        user_id=user_id,
+        num_samples=num_samples,
+    )
+    session.commit()
+    return assigned
 
 
 def modify_task_assignment(
     *, session: Session, project_id: int, user_id: int, new_num_samples: int
 ) -> None:
-    # Get current tasks assigned to the user in this project
-    current_tasks = session.exec(
-        select(Task)
+    # Count the current tasks assigned to the user in this project
+    current_count = session.exec(
+        select(func.count())
+        .select_from(Task)
         .where(Task.project_id == project_id)
         .where(Task.user_id == user_id)
-        .order_by(Task.created_at)
-    ).all()
-
-    current_count = len(current_tasks)
+    ).one()
 
     if new_num_samples == current_count:
         # No change needed
@@ -197,34 +397,12 @@ def modify_task_assignment(
 
     elif new_num_samples > current_count:
         # Increase: assign more tasks
-        # Get all assigned line item IDs in the project
-        all_assigned_line_items = session.exec(
-            select(Task.line_item_id).where(Task.project_id == project_id)
-        ).all()
-
-        # Get all unassigned line items
-        unassigned_line_items = session.exec(
-            select(LineItem.id)
-            .where(LineItem.project_id == project_id)
-            .where(LineItem.id.not_in(all_assigned_line_items))
-        ).all()
-
-        num_to_add = new_num_samples - current_count
-
-        if len(unassigned_line_items) < num_to_add:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Not enough unassigned line items. Available: {len(unassigned_line_items)}, Requested: {num_to_add}",
-            )
-
-        # Assign new tasks
-        for line_item_id in unassigned_line_items[:num_to_add]:
-            task = Task(
-                project_id=project_id,
-                user_id=user_id,
-                line_item_id=line_item_id,
-            )
-            session.add(task)
+        assign_unassigned_line_items(
+            session=session,
+            project_id=project_id,
+            user_id=user_id,
+            num_samples=new_num_samples - current_count,
+        )
         session.commit()
 
     else:
@@ -251,20 +429,220 @@ def modify_task_assignment(
         # Delete the tasks
         for task in unlabeled_tasks:
             session.delete(task)
+        adjust_status_counts(
+            session=session,
+            project_id=project_id,
+            user_id=user_id,
+            deltas={LineItemStatus.UNLABELED: -len(unlabeled_tasks)},
+        )
         session.commit()
 
 
+def get_rebalance_targets(
+    *, session: Session, project_id: int, rebalance_request: RebalanceTasksRequest
+) -> dict[int, int]:
+    """Target number of tasks per user, percentages are of the line items"""
+    counts = rebalance_request.counts
+    percentages = rebalance_request.percentages
+    if (counts is None) == (percentages is None):
+        raise HTTPException(
+            status_code=400, detail="Provide either counts or percentages"
+        )
+
+    if percentages is not None:
+        if any(percentage < 0 for percentage in percentages.values()) or (
+            sum(percentages.values()) > 100
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail="Percentages must be positive and add up to at most 100",
+            )
+        num_samples, _ = get_project_task_totals(session=session, project_id=project_id)
+        return {
+            user_id: math.floor(num_samples * percentage / 100)
+            for user_id, percentage in percentages.items()
+        }
+
+    if any(count < 0 for count in counts.values()):
+        raise HTTPException(status_code=400, detail="Counts must not be negative")
+    return dict(counts)
+
+
+def deal_line_items(needs: dict[int, int], strategy: AssignmentStrategy) -> list[int]:
+    """User id of each line item taken from the unassigned pool, in pool order"""
+    if strategy != AssignmentStrategy.ROUND_ROBIN:
+        return [user_id for user_id, need in needs.items() for _ in range(need)]
+
+    user_ids = []
+    remaining = {user_id: need for user_id, need in needs.items() if need}
+    while remaining:
+        for user_id in list(remaining):
+            user_ids.append(user_id)
+            remaining[user_id] -= 1
+            if not remaining[user_id]:
+                del remaining[user_id]
+    return user_ids
+
+
+def rebalance_tasks(
+    *, session: Session, project_id: int, rebalance_request: RebalanceTasksRequest
+) -> list[UserTaskRebalance]:
+    """
+    Bring the task counts of several users to their targets in one transaction.
+
+    Users above their target lose their newest UNLABELED tasks, like
+    ``modify_task_assignment``. The freed and the unassigned line items are
+    then dealt to the users below their target following the strategy.
+    """
+    lock_project_assignments(session=session, project_id=project_id)
+    targets = get_rebalance_targets(
+        session=session, project_id=project_id, rebalance_request=rebalance_request
+    )
+    if not targets:
+        return []
+
+    existing_user_ids = session.exec(
+        select(User.id).where(User.id.in_(list(targets)))
+    ).all()
+    unknown_user_ids = sorted(set(targets) - set(existing_user_ids))
+    if unknown_user_ids:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown users: {unknown_user_ids}"
+        )
+
+    current_counts = dict(
+        session.exec(
+            select(Task.user_id, func.count())
+            .where(Task.project_id == project_id, Task.user_id.in_(list(targets)))
+            .group_by(Task.user_id)
+        ).all()
+    )
+    to_remove = {
+        user_id: current_counts.get(user_id, 0) - target
+        for user_id, target in targets.items()
+        if current_counts.get(user_id, 0) > target
+    }
+    to_add = {
+        user_id: target - current_counts.get(user_id, 0)
+        for user_id, target in targets.items()
+        if current_counts.get(user_id, 0) < target
+    }
+
+    if to_remove:
+        # Rank each user's UNLABELED tasks newest first, keep the ones to remove
+        rank = (
+            func.row_number()
+            .over(
+                partition_by=Task.user_id,
+                order_by=(Task.created_at.desc(), Task.id.desc()),
+            )
+            .label("rank")
+        )
+        removable = (
+            select(Task.id, Task.user_id, rank)
+            .join(LineItem, Task.line_item_id == LineItem.id)
+            .where(Task.project_id == project_id)
+            .where(Task.user_id.in_(list(to_remove)))
+            .where(LineItem.status == LineItemStatus.UNLABELED)
+            .subquery()
+        )
+        removed_tasks = session.exec(
+            select(removable.c.id, removable.c.user_id).where(
+                removable.c.rank <= case(to_remove, value=removable.c.user_id)
+            )
+        ).all()
+        num_removed = Counter(user_id for _, user_id in removed_tasks)
+        for user_id, num_to_remove in to_remove.items():
+            if num_removed[user_id] < num_to_remove:
+                session.rollback()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Cannot remove {num_to_remove} tasks of user {user_id}. Only {num_removed[user_id]} tasks have UNLABELED status",
+                )
+
+        session.execute(
+            delete(Task).where(Task.id.in_([task_id for task_id, _ in removed_tasks]))
+        )
+        for user_id, num_to_remove in to_remove.items():
+            adjust_status_counts(
+                session=session,
+                project_id=project_id,
+                user_id=user_id,
+                deltas={LineItemStatus.UNLABELED: -num_to_remove},
+            )
+
+    num_to_add = sum(to_add.values())
+    if num_to_add:
+        # The line items freed above are unassigned again at this point
+        order_by = (
+            func.rand()
+            if rebalance_request.strategy == AssignmentStrategy.RANDOM
+            else LineItem.line_index
+        )
+        pool = session.exec(
+            select(LineItem.id, LineItem.status)
+            .outerjoin(Task, Task.line_item_id == LineItem.id)
+            .where(LineItem.project_id == project_id, Task.id.is_(None))
+            .order_by(order_by)
+            .limit(num_to_add)
+        ).all()
+        if len(pool) < num_to_add:
+            session.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail=f"Not enough unassigned line items. Available: {len(pool)}, Requested: {num_to_add}",
+            )
+
+        now = datetime.now()
+        user_ids = deal_line_items(to_add, rebalance_request.strategy)
+        session.execute(
+            insert(Task),
+            [
+                {
+                    "project_id": project_id,
+                    "user_id": user_id,
+                    "line_item_id": line_item_id,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for user_id, (line_item_id, _) in zip(user_ids, pool, strict=True)
+            ],
+        )
+        deltas: dict[int, Counter] = {user_id: Counter() for user_id in to_add}
+        for user_id, (_, status) in zip(user_ids, pool, strict=True):
+            deltas[user_id][status] += 1
+        for user_id, user_deltas in deltas.items():
+            adjust_status_counts(
+                session=session,
+                project_id=project_id,
+                user_id=user_id,
+                deltas=user_deltas,
+            )
+
+    session.commit()
+    return [
+        UserTaskRebalance(
+            user_id=user_id,
+            previous_count=current_counts.get(user_id, 0),
+            new_count=target,
+            num_added=to_add.get(user_id, 0),
+            num_removed=to_remove.get(user_id, 0),
+        )
+        for user_id, target in targets.items()
+    ]
+
+
 def get_user_task_summary_in_project(
     *, session: Session, project_id: int
 ) -> list[dict]:
+    task_count = func.sum(LineItemStatusCount.count)
     statement = (
-        select(
-            User.id, User.full_name, User.email, func.count(Task.id).label("task_count")
-        )
-        .join(Task, Task.user_id == User.id)
-        .where(Task.project_id == project_id)
+        select(User.id, User.full_name, User.email, task_count.label("task_count"))
+        .join(LineItemStatusCount, LineItemStatusCount.user_id == User.id)
+        .where(LineItemStatusCount.project_id == project_id)
         .group_by(User.id, User.full_name, User.email)
-        .order_by(func.count(Task.id).desc())
+        .having(task_count > 0)
+        .order_by(task_count.desc())
     )
     results = session.exec(statement).all()
 
@@ -273,7 +651,7 @@ def get_user_task_summary_in_project(
             "user_id": user_id,
             "full_name": full_name,
             "email": email,
-            "task_count": task_count,
+            "task_count": int(task_count),
         }
         for user_id, full_name, email, task_count in results
     ]
@@ -289,10 +667,11 @@ def confirm_line_item(
     line_item_confirm_request: LineItemConfirmRequest,
     request: Request | None = None,
 ) -> None:
+    # Locked, so concurrent confirms move the status counters one at a time
     line_item = session.exec(
-        select(LineItem).where(
-            LineItem.id == line_item_id, LineItem.project_id == project_id
-        )
+        select(LineItem)
+        .where(LineItem.id == line_item_id, LineItem.project_id == project_id)
+        .with_for_update()
     ).first()
     task = session.exec(
         select(Task).where(
@@ -307,12 +686,27 @@ def confirm_line_item(
     if not line_item:
         raise HTTPException(status_code=400, detail="Line item not found")
 
+    # All the messages are loaded at once and diffed in memory
+    line_messages = {
+        line_message.id: line_message
+        for line_message in session.exec(
+            select(LineItemMessage).where(LineItemMessage.line_item_id == line_item_id)
+        ).all()
+    }
+    if any(
+        line_message_confirm_request.id not in line_messages
+        for line_message_confirm_request in line_item_confirm_request.line_messages
+    ):
+        raise HTTPException(status_code=400, detail="Line message not found")
+
     # Capture old values for audit logging
     old_values = {
         "status": line_item.status.value if line_item.status else None,
         "feedback": line_item.feedback,
         "tools": line_item.tools,
     }
+    audit_logs: list[LineItemAuditLog | LineItemMessageAuditLog] = []
+    now = datetime.now()
 
     # Track if any changes were made
     has_changes = False
@@ -331,14 +725,22 @@ def confirm_line_item(
         line_item.feedback = line_item_confirm_request.feedback
         has_changes = True
 
+    old_status = line_item.status
     if line_item_confirm_request.status != line_item.status:
         line_item.status = line_item_confirm_request.status
         has_changes = True
 
     # Only update and log if there were actual changes
     if has_changes:
+        line_item.updated_at = now
         session.add(line_item)
-        session.commit()
+        if line_item.status != old_status:
+            move_line_item_status(
+                session=session,
+                line_item=line_item,
+                old_status=old_status,
+                new_status=line_item.status,
+            )
 
         # Capture new values for audit logging
         new_values = {
@@ -353,25 +755,19 @@ def confirm_line_item(
             if old_values["status"] != new_values["status"]
             else "UPDATE"
         )
-        log_line_item_change(
-            session=session,
-            line_item=line_item,
-            action=action,
-            user_id=user_id,
-            request=request,
-            old_values=old_values,
-            new_values=new_values,
+        audit_logs.append(
+            build_line_item_audit_log(
+                line_item=line_item,
+                action=action,
+                user_id=user_id,
+                request=request,
+                old_values=old_values,
+                new_values=new_values,
+            )
         )
 
     for line_message_confirm_request in line_item_confirm_request.line_messages:
-        line_message = session.exec(
-            select(LineItemMessage).where(
-                LineItemMessage.id == line_message_confirm_request.id,
-                LineItemMessage.line_item_id == line_item_id,
-            )
-        ).first()
-        if not line_message:
-            raise HTTPException(status_code=400, detail="Line message not found")
+        line_message = line_messages[line_message_confirm_request.id]
 
         # Capture old values for audit logging
         old_message_values = {
@@ -404,8 +800,10 @@ def confirm_line_item(
 
         # Only update and log if there were actual changes
         if has_message_changes:
+            # The line item's updated_at versions its messages too, for exports
+            line_message.updated_at = line_item.updated_at = now
             session.add(line_message)
-            session.commit()
+            session.add(line_item)
 
             # Capture new values for audit logging
             new_message_values = {
@@ -415,158 +813,185 @@ def confirm_line_item(
             }
 
             # Log the message change
-            log_line_item_message_change(
-                session=session,
-                line_item_message=line_message,
-                line_item_id=line_item_id,
-                project_id=project_id,
-                action="UPDATE",
-                user_id=user_id,
-                request=request,
-                old_values=old_message_values,
-                new_values=new_message_values,
+            audit_logs.append(
+                build_line_item_message_audit_log(
+                    line_item_message=line_message,
+                    line_item_id=line_item_id,
+                    project_id=project_id,
+                    action="UPDATE",
+                    user_id=user_id,
+                    request=request,
+                    old_values=old_message_values,
+                    new_values=new_message_values,
+                )
             )
 
+    # The updates, the counters and the audit rows are committed together
+    if audit_logs:
+        add_audit_logs(session=session, audit_logs=audit_logs)
+        session.commit()
+
 
-def get_projects_dashboard(*, session: Session) -> list[dict]:
-    # 1. Get all projects
-    project_stmt = select(Project)
+def get_projects_dashboard(
+    *,
+    session: Session,
+    skip: int = 0,
+    limit: int | None = None,
+    search: str | None = None,
+) -> list[dict]:
+    """
+    Summaries of the projects, optionally paginated and filtered by name.
+
+    Takes three queries whatever the number of projects, the counts are
+    grouped across all the projects of the page.
+    """
+    # 1. Get the projects of the page
+    project_stmt = select(Project).order_by(Project.id).offset(skip)
+    if search:
+        project_stmt = project_stmt.where(Project.name.contains(search))
+    if limit is not None:
+        project_stmt = project_stmt.limit(limit)
     projects = session.exec(project_stmt).all()
-    project_data = []
-
-    for project in projects:
-        # 2. Count total samples (line_items)
-        num_samples_stmt = select(func.count()).where(LineItem.project_id == project.id)
-        num_samples = session.exec(num_samples_stmt).one()
-
-        # 3. Get all tasks by project with user info + count by status
-        status_counts_stmt = (
-            select(
-                User.id.label("user_id"),
-                User.full_name,
-                User.email,
-                func.count(Task.id).label("task_count"),
-                func.sum(
-                    case((LineItem.status == LineItemStatus.CONFIRMED, 1), else_=0)
-                ).label("confirmed"),
-                func.sum(
-                    case((LineItem.status == LineItemStatus.UNLABELED, 1), else_=0)
-                ).label("unlabeled"),
-                func.sum(
-                    case((LineItem.status == LineItemStatus.APPROVED, 1), else_=0)
-                ).label("approved"),
-                func.sum(
-                    case((LineItem.status == LineItemStatus.REJECTED, 1), else_=0)
-                ).label("rejected"),
-            )
-            .join(Task, Task.user_id == User.id)
-            .join(LineItem, LineItem.id == Task.line_item_id)
-            .where(Task.project_id == project.id)
-            .group_by(User.id, User.full_name, User.email)
+    project_ids = [project.id for project in projects]
+    if not project_ids:
+        return []
+
+    # 2. Count total samples (line_items) of every project
+    num_samples_stmt = (
+        select(LineItemStatusCount.project_id, func.sum(LineItemStatusCount.count))
+        .where(
+            LineItemStatusCount.project_id.in_(project_ids),
+            LineItemStatusCount.user_id == PROJECT_WIDE,
         )
+        .group_by(LineItemStatusCount.project_id)
+    )
+    num_samples = dict(session.exec(num_samples_stmt).all())
 
-        user_summaries = session.exec(status_counts_stmt).all()
-        user_task_summary = []
-        for row in user_summaries:
-            user_task_summary.append(
-                {
-                    "user_id": row.user_id,
-                    "full_name": row.full_name,
-                    "email": row.email,
-                    "task_count": row.task_count,
-                    "confirmed": row.confirmed,
-                    "unlabeled": row.unlabeled,
-                    "approved": row.approved,
-                    "rejected": row.rejected,
-                }
-            )
+    # 3. Get the status counters of every user of every project
+    status_counts_stmt = (
+        select(
+            LineItemStatusCount.project_id,
+            User.id,
+            User.full_name,
+            User.email,
+            LineItemStatusCount.status,
+            LineItemStatusCount.count,
+        )
+        .join(LineItemStatusCount, LineItemStatusCount.user_id == User.id)
+        .where(LineItemStatusCount.project_id.in_(project_ids))
+        .order_by(LineItemStatusCount.project_id, User.id)
+    )
 
-        # 4. Merge all data
-        project_data.append(
+    user_summaries: dict[int, dict[int, dict]] = {
+        project_id: {} for project_id in project_ids
+    }
+    for project_id, user_id, full_name, email, status, count in session.exec(
+        status_counts_stmt
+    ).all():
+        summary = user_summaries[project_id].setdefault(
+            user_id,
             {
-                "project_id": project.id,
-                "project_name": project.name,
-                "project_description": project.description,
-                "num_samples": num_samples,
-                "user_task_summary": user_task_summary,
-            }
+                "user_id": user_id,
+                "full_name": full_name,
+                "email": email,
+                "task_count": 0,
+                "confirmed": 0,
+                "unlabeled": 0,
+                "approved": 0,
+                "rejected": 0,
+            },
         )
+        summary["task_count"] += count
+        summary[status.value.lower()] += count
 
-    return project_data
+    # 4. Merge all data
+    return [
+        {
+            "project_id": project.id,
+            "project_name": project.name,
+            "project_description": project.description,
+            "num_samples": int(num_samples.get(project.id) or 0),
+            "user_task_summary": [
+                summary
+                for summary in user_summaries[project.id].values()
+                if summary["task_count"]
+            ],
+        }
+        for project in projects
+    ]
 
 
 def get_projects_dashboard_user(*, session: Session, current_user: User) -> list[dict]:
-    # 1. Lấy danh sách các project mà user này đã được assign task
-    project_stmt = (
-        select(Project)
-        .join(Task, Project.id == Task.project_id)
-        .where(Task.user_id == current_user.id)
-        .distinct()
-    )
-
-    projects = session.exec(project_stmt).all()
-    project_data = []
-
-    for project in projects:
-        # 2. Đếm số task user được assign trong project này
-        task_count_stmt = (
-            select(func.count())
-            .select_from(Task)
-            .where(Task.project_id == project.id, Task.user_id == current_user.id)
-        )
-        task_count = session.exec(task_count_stmt).one()
-
-        # 3. Đếm số lượng theo từng status
-        status_stmt = (
-            select(LineItem.status, func.count())
-            .select_from(LineItem)
-            .join(Task, LineItem.id == Task.line_item_id)
-            .where(Task.project_id == project.id, Task.user_id == current_user.id)
-            .group_by(LineItem.status)
+    # 1. Lấy bộ đếm status của user trong mọi project, trong một truy vấn
+    status_stmt = (
+        select(
+            Project.id,
+            Project.name,
+            Project.description,
+            LineItemStatusCount.status,
+            LineItemStatusCount.count,
         )
-        status_result = session.exec(status_stmt).all()
-
-        # Đảm bảo đủ mọi status (kể cả = 0)
-        status_counts = {status.value: 0 for status in LineItemStatus}
-        for status, count in status_result:
-            status_counts[status.value] = count
+        .join(LineItemStatusCount, LineItemStatusCount.project_id == Project.id)
+        .where(LineItemStatusCount.user_id == current_user.id)
+        .order_by(Project.id)
+    )
 
-        # 4. Gộp dữ liệu
-        project_data.append(
+    # 2. Gộp dữ liệu theo project, đảm bảo đủ mọi status (kể cả = 0)
+    project_data: dict[int, dict] = {}
+    for project_id, name, description, status, count in session.exec(status_stmt).all():
+        data = project_data.setdefault(
+            project_id,
             {
-                "project_id": project.id,
-                "project_name": project.name,
-                "project_description": project.description,
-                "task_count": task_count,
-                "status_counts": status_counts,
-            }
+                "project_id": project_id,
+                "project_name": name,
+                "project_description": description,
+                "task_count": 0,
+                "status_counts": {status.value: 0 for status in LineItemStatus},
+            },
         )
+        data["task_count"] += count
+        data["status_counts"][status.value] += count
 
-    return project_data
+    # 3. Chỉ giữ các project mà user còn được assign task
+    return [data for data in project_data.values() if data["task_count"]]
 
 
-def get_project_for_download(
+def iter_project_for_download(
     *,
     session: Session,
     project_id: int,
     limit: int | None = None,
     include_statuses: list[LineItemStatus] | None = None,
-) -> list[LineItem]:
-    statement = (
-        select(LineItem)
-        .where(LineItem.project_id == project_id)
-        .order_by(LineItem.line_index)
-        .options(selectinload(LineItem.line_messages))
-    )
-    if limit:
-        statement = statement.limit(limit)
-    if include_statuses:
-        statement = statement.where(LineItem.status.in_(include_statuses))
-    line_items = session.exec(statement).all()
-    results = []
-    for line_item in line_items:
-        results.append(
-            {
+    batch_size: int = settings.EXPORT_BATCH_SIZE,
+) -> Generator[dict[str, Any], None, None]:
+    """
+    Yield the export records of a project in ``line_index`` order.
+
+    Line items are paged by keyset on ``line_index``, ``batch_size`` at a time
+    with their messages, and released from the session after each page, so
+    memory stays bounded by a single page.
+    """
+    last_line_index = 0
+    remaining = limit
+    while remaining is None or remaining > 0:
+        statement = (
+            select(LineItem)
+            .where(
+                LineItem.project_id == project_id,
+                LineItem.line_index > last_line_index,
+            )
+            .order_by(LineItem.line_index)
+            .options(selectinload(LineItem.line_messages))
+            .limit(batch_size if remaining is None else min(batch_size, remaining))
+        )
+        if include_statuses:
+            statement = statement.where(LineItem.status.in_(include_statuses))
+        line_items = session.exec(statement).all()
+        if not line_items:
+            break
+
+        for line_item in line_items:
+            yield {
                 "tools": line_item.tools,
                 "messages": [
                     {
@@ -576,8 +1001,10 @@ def get_project_for_download(
                     for message in line_item.line_messages
                 ],
             }
-        )
-    return results
+        last_line_index = line_items[-1].line_index
+        if remaining is not None:
+            remaining -= len(line_items)
+        session.expunge_all()
 
 
 def update_line_item_message(
@@ -630,7 +1057,10 @@ def update_line_item_message(
 
     # Only update and log if there were actual changes
     if has_changes:
+        # The line item's updated_at versions its messages too, for exports
+        line_item_message.updated_at = line_item.updated_at = datetime.now()
         session.add(line_item_message)
+        session.add(line_item)
         session.commit()
         session.refresh(line_item_message)
 
@@ -676,6 +1106,12 @@ def delete_user_tasks(*, session: Session, project_id: int, user_id: int) -> int
     # Delete all the unlabeled tasks
     for task in unlabeled_tasks:
         session.delete(task)
+    adjust_status_counts(
+        session=session,
+        project_id=project_id,
+        user_id=user_id,
+        deltas={LineItemStatus.UNLABELED: -deleted_count},
+    )
 
     session.commit()
 
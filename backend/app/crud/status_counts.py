@@ -0,0 +1,209 @@
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlmodel import Session, select
+
+from app.models import LineItem, LineItemStatus, LineItemStatusCount, Task
+
+# user_id of the counters over all the line items of a project
+PROJECT_WIDE = 0
+
+
+def adjust_status_counts(
+    *,
+    session: Session,
+    project_id: int,
+    deltas: dict[LineItemStatus, int],
+    user_id: int = PROJECT_WIDE,
+) -> None:
+    """Add ``deltas`` to the status counters, without committing"""
+    now = datetime.now()
+    values = [
+        {
+            "project_id": project_id,
+            "user_id": user_id,
+            "status": status,
+            "count": delta,
+            "updated_at": now,
+        }
+        for status, delta in deltas.items()
+        if delta
+    ]
+    if not values:
+        return
+    statement = mysql_insert(LineItemStatusCount).values(values)
+    session.execute(
+        statement.on_duplicate_key_update(
+            count=LineItemStatusCount.count + statement.inserted.count,
+            updated_at=statement.inserted.updated_at,
+        )
+    )
+
+
+def create_status_counts(*, session: Session, project_id: int) -> None:
+    """
+    Create the zero project-wide counters of a new project, without committing.
+
+    Ingestion then only updates existing rows, concurrent upserts of a missing
+    row take gap locks and can deadlock each other.
+    """
+    now = datetime.now()
+    session.execute(
+        insert(LineItemStatusCount),
+        [
+            {
+                "project_id": project_id,
+                "user_id": PROJECT_WIDE,
+                "status": status,
+                "count": 0,
+                "updated_at": now,
+            }
+            for status in LineItemStatus
+        ],
+    )
+
+
+def delete_user_status_counts(*, session: Session, user_id: int) -> None:
+    """Drop the counters of a user's tasks, which are deleted with the user"""
+    session.execute(
+        delete(LineItemStatusCount).where(LineItemStatusCount.user_id == user_id)
+    )
+
+
+def move_line_item_status(
+    *,
+    session: Session,
+    line_item: LineItem,
+    old_status: LineItemStatus,
+    new_status: LineItemStatus,
+) -> None:
+    """Move a line item between status counters, project-wide and per assignee"""
+    deltas = {old_status: -1, new_status: 1}
+    adjust_status_counts(
+        session=session, project_id=line_item.project_id, deltas=deltas
+    )
+    assignee_ids = session.exec(
+        select(Task.user_id).where(Task.line_item_id == line_item.id)
+    ).all()
+    for user_id in assignee_ids:
+        adjust_status_counts(
+            session=session,
+            project_id=line_item.project_id,
+            deltas=deltas,
+            user_id=user_id,
+        )
+
+
+def get_status_counts(
+    *, session: Session, project_id: int, user_id: int = PROJECT_WIDE
+) -> dict[str, int]:
+    """Status counts of a project or of a user's tasks, with all statuses"""
+    rows = session.exec(
+        select(LineItemStatusCount.status, LineItemStatusCount.count).where(
+            LineItemStatusCount.project_id == project_id,
+            LineItemStatusCount.user_id == user_id,
+        )
+    ).all()
+    status_counts = {status.value: 0 for status in LineItemStatus}
+    for status, count in rows:
+        status_counts[status.value] = count
+    return status_counts
+
+
+def get_project_task_totals(*, session: Session, project_id: int) -> tuple[int, int]:
+    """Returns the number of line items and of assigned tasks of a project"""
+    num_samples, num_tasks = session.exec(
+        select(
+            func.sum(
+                case(
+                    (
+                        LineItemStatusCount.user_id == PROJECT_WIDE,
+                        LineItemStatusCount.count,
+                    ),
+                    else_=0,
+                )
+            ),
+            func.sum(
+                case(
+                    (
+                        LineItemStatusCount.user_id != PROJECT_WIDE,
+                        LineItemStatusCount.count,
+                    ),
+                    else_=0,
+                )
+            ),
+        ).where(LineItemStatusCount.project_id == project_id)
+    ).one()
+    return int(num_samples or 0), int(num_tasks or 0)
+
+
+def reconcile_status_counts(*, session: Session, project_id: int) -> None:
+    """
+    Rebuild the status counters of a project from line items and tasks.
+
+    Must start a transaction, the line items are counted without locks, from
+    the snapshot of its first read. The counters are locked only to write the
+    counts back, plus the deltas committed by other sessions since the
+    snapshot, which the counts miss.
+    """
+    counters = (
+        select(
+            LineItemStatusCount.user_id,
+            LineItemStatusCount.status,
+            LineItemStatusCount.count,
+        )
+        .where(LineItemStatusCount.project_id == project_id)
+        .order_by(LineItemStatusCount.id)
+    )
+    snapshot_counts = {
+        (user_id, status): count
+        for user_id, status, count in session.exec(counters).all()
+    }
+    project_counts = session.exec(
+        select(LineItem.status, func.count())
+        .where(LineItem.project_id == project_id, LineItem.status.is_not(None))
+        .group_by(LineItem.status)
+    ).all()
+    user_counts = session.exec(
+        select(Task.user_id, LineItem.status, func.count())
+        .join(LineItem, LineItem.id == Task.line_item_id)
+        .where(Task.project_id == project_id, LineItem.status.is_not(None))
+        .group_by(Task.user_id, LineItem.status)
+    ).all()
+
+    # Every project-wide counter is kept, even at zero, see create_status_counts
+    counts = {(PROJECT_WIDE, status): 0 for status in LineItemStatus}
+    for status, count in project_counts:
+        counts[PROJECT_WIDE, status] = count
+    for user_id, status, count in user_counts:
+        counts[user_id, status] = count
+
+    # Locking reads see the latest committed counters, not the snapshot
+    latest_counts = {
+        (user_id, status): count
+        for user_id, status, count in session.exec(counters.with_for_update()).all()
+    }
+    for key in snapshot_counts.keys() | latest_counts.keys():
+        delta = latest_counts.get(key, 0) - snapshot_counts.get(key, 0)
+        counts[key] = counts.get(key, 0) + delta
+
+    now = datetime.now()
+    session.execute(
+        delete(LineItemStatusCount).where(LineItemStatusCount.project_id == project_id)
+    )
+    session.execute(
+        insert(LineItemStatusCount),
+        [
+            {
+                "project_id": project_id,
+                "user_id": user_id,
+                "status": status,
+                "count": count,
+                "updated_at": now,
+            }
+            for (user_id, status), count in counts.items()
+            if count or user_id == PROJECT_WIDE
+        ],
+    )
+    session.commit()
@@ -13,6 +13,7 @@ from app.api.deps import get_db
 from app.api.main import api_router
 from app.core.config import settings
 from app.core.db import init_db
+from app.crud.audit import audit_sink
 
 
 async def delete_old_files(file_interval: int, clean_interval: int, folder: str):
@@ -60,11 +61,15 @@ def get_db_session() -> Session:
 async def lifespan(app: FastAPI):  # noqa: ARG001
     logger.info("Starting up...")
     session = get_db_session()
-    Path(settings.TEMP_DOWNLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
+    Path(settings.INGESTION_FOLDER).mkdir(parents=True, exist_ok=True)
     await init_db(session)
     logger.success("Database initialized")
     asyncio.create_task(delete_old_files(60, 5, settings.TEMP_DOWNLOAD_FOLDER))
+    if settings.AUDIT_ASYNC:
+        audit_sink.start()
     yield
+    # Write the audit rows still queued
+    audit_sink.stop()
 
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
@@ -1,8 +1,9 @@
 from datetime import datetime
 from enum import Enum
+from typing import Literal
 
 from pydantic import EmailStr
-from sqlalchemy import JSON, Column, Text
+from sqlalchemy import JSON, BigInteger, Column, Index, Text, UniqueConstraint
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlmodel import Field, Relationship, SQLModel
 
@@ -47,10 +48,14 @@ class User(UserBase, table=True):
     id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
     hashed_password: str
     last_login_time: datetime | None = Field(default=None)
+    # The foreign keys cascade in the database, deleting a user or project
+    # does not load its children to delete them one by one
     projects: list["Project"] = Relationship(
-        back_populates="owner", cascade_delete=True
+        back_populates="owner", cascade_delete=True, passive_deletes=True
+    )
+    tasks: list["Task"] = Relationship(
+        back_populates="user", cascade_delete=True, passive_deletes=True
     )
-    tasks: list["Task"] = Relationship(back_populates="user", cascade_delete=True)
 
 
 # Properties to return via API, id is always required
@@ -84,10 +89,21 @@ class NewPassword(SQLModel):
     new_password: str = Field(min_length=8, max_length=40)
 
 
+class DatasetSourceType(str, Enum):
+    GDRIVE = "gdrive"
+    HTTP = "http"
+    UPLOAD = "upload"
+    LOCAL = "local"
+
+
 class ProjectBase(SQLModel):
     name: str = Field(min_length=1, max_length=255)
     description: str | None = Field(default=None, max_length=255)
-    url: str = Field(max_length=255, description="Gdrive URL")
+    url: str = Field(
+        max_length=255,
+        description="Gdrive URL, HTTP URL, uploaded file name or local path",
+    )
+    source: DatasetSourceType = Field(default=DatasetSourceType.GDRIVE)
 
 
 class Project(ProjectBase, table=True):
@@ -98,9 +114,11 @@ class Project(ProjectBase, table=True):
     owner_id: int = Field(foreign_key="user.id", nullable=False, ondelete="CASCADE")
     owner: User = Relationship(back_populates="projects")
     line_items: list["LineItem"] = Relationship(
-        back_populates="project", cascade_delete=True
+        back_populates="project", cascade_delete=True, passive_deletes=True
+    )
+    tasks: list["Task"] = Relationship(
+        back_populates="project", cascade_delete=True, passive_deletes=True
     )
-    tasks: list["Task"] = Relationship(back_populates="project", cascade_delete=True)
 
 
 class ProjectCreate(ProjectBase):
@@ -111,6 +129,7 @@ class ProjectUpdate(ProjectBase):
     name: str | None = Field(default=None, min_length=1, max_length=255)  # type: ignore
     description: str | None = Field(default=None, max_length=255)
     url: str | None = Field(default=None, max_length=255)
+    source: DatasetSourceType | None = None
 
 
 class ProjectPublic(ProjectBase):
@@ -147,6 +166,12 @@ class LineItemBase(SQLModel):
 
 class LineItem(LineItemBase, table=True):
     __tablename__ = "line_item"
+    __table_args__ = (
+        UniqueConstraint(
+            "project_id", "line_index", name="uq_line_item_project_id_line_index"
+        ),
+        Index("ix_line_item_project_id_status", "project_id", "status"),
+    )
     id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
     project_id: int = Field(
         foreign_key="project.id", nullable=False, ondelete="CASCADE"
@@ -161,12 +186,14 @@ class LineItem(LineItemBase, table=True):
     line_messages: list["LineItemMessage"] = Relationship(
         back_populates="line_item",
         cascade_delete=True,
+        passive_deletes=True,
+        # Loaded on access, queries that need messages use selectinload
         sa_relationship_kwargs={
             "order_by": "LineItemMessage.line_message_index",
-            "lazy": "selectin",
+            "lazy": "select",
         },
     )
-    tasks: list["Task"] = Relationship(back_populates="line_item")
+    tasks: list["Task"] = Relationship(back_populates="line_item", passive_deletes=True)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
@@ -187,12 +214,11 @@ class LineItemMessageRead(LineItemMessageBase):
         from_attributes = True
 
 
-class LineItemRead(LineItemBase):
+class LineItemSummary(LineItemBase):
     id: int
     project_id: int
     line_index: int
     feedback: str | None
-    line_messages: list[LineItemMessageRead] = []
     created_at: datetime
     updated_at: datetime
     status: LineItemStatus
@@ -201,11 +227,24 @@ class LineItemRead(LineItemBase):
         from_attributes = True
 
 
+class LineItemRead(LineItemSummary):
+    line_messages: list[LineItemMessageRead] = []
+
+
+class LineItemFields(str, Enum):
+    FULL = "full"
+    # Without messages, for list views
+    SUMMARY = "summary"
+
+
 class LineItemsPublic(SQLModel):
-    data: list[LineItemRead]
+    data: list[LineItemSummary | LineItemRead]
     total_count: int
     num_pages: int
-    status_counts: dict[LineItemStatus, int]
+    status_counts: dict[LineItemStatus, int] | None = None
+    # Opaque keyset cursors for the pages after and before this one
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
 
 
 class LineItemMessageConfirmRequest(SQLModel):
@@ -229,6 +268,13 @@ class LineItemMessageUpdateRequest(SQLModel):
 
 class LineItemMessage(LineItemMessageBase, table=True):
     __tablename__ = "line_item_message"
+    __table_args__ = (
+        Index(
+            "ix_line_item_message_line_item_id_line_message_index",
+            "line_item_id",
+            "line_message_index",
+        ),
+    )
     id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
     line_item_id: int = Field(
         foreign_key="line_item.id", nullable=False, ondelete="CASCADE"
@@ -244,17 +290,59 @@ class AssignTaskRequest(SQLModel):
     num_samples: int
 
 
+class TaskAssignmentPublic(SQLModel):
+    message: str
+    num_assigned: int
+    first_line_index: int | None = None
+    last_line_index: int | None = None
+
+
 class ModifyTaskAssignmentRequest(SQLModel):
     user_id: int
     new_num_samples: int
 
 
+class AssignmentStrategy(str, Enum):
+    # Each user gets a block of consecutive line items
+    CONTIGUOUS = "contiguous"
+    # Line items are dealt to the users in turn
+    ROUND_ROBIN = "round_robin"
+    RANDOM = "random"
+
+
+class RebalanceTasksRequest(SQLModel):
+    """Target number of tasks per user, as counts or as percentages of the
+    project's line items. Users left out keep their tasks."""
+
+    counts: dict[int, int] | None = None
+    percentages: dict[int, float] | None = None
+    strategy: AssignmentStrategy = AssignmentStrategy.CONTIGUOUS
+
+
+class UserTaskRebalance(SQLModel):
+    user_id: int
+    previous_count: int
+    new_count: int
+    num_added: int
+    num_removed: int
+
+
+class RebalanceTasksPublic(SQLModel):
+    message: str
+    data: list[UserTaskRebalance]
+
+
 class DeleteUserTasksRequest(SQLModel):
     user_id: int
 
 
 class Task(SQLModel, table=True):
     __tablename__ = "task"
+    # A line item is assigned to at most one user
+    __table_args__ = (
+        UniqueConstraint("line_item_id", name="uq_task_line_item_id"),
+        Index("ix_task_project_id_user_id", "project_id", "user_id"),
+    )
     id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
     project_id: int = Field(
         foreign_key="project.id", nullable=False, ondelete="CASCADE"
@@ -270,18 +358,119 @@ class Task(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.now)
 
 
+class LineItemStatusCount(SQLModel, table=True):
+    """Number of line items per status in a project, maintained on every change.
+
+    Rows with ``user_id`` 0 count all the line items of the project, other
+    rows count the line items assigned to that user.
+    """
+
+    __tablename__ = "line_item_status_count"
+    __table_args__ = (
+        UniqueConstraint(
+            "project_id",
+            "user_id",
+            "status",
+            name="uq_line_item_status_count_project_id_user_id_status",
+        ),
+    )
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
+    project_id: int = Field(
+        foreign_key="project.id", nullable=False, ondelete="CASCADE"
+    )
+    user_id: int = Field(default=0, nullable=False)
+    status: LineItemStatus = Field(
+        sa_column=Column(SQLAlchemyEnum(LineItemStatus), nullable=False)
+    )
+    count: int = Field(default=0, nullable=False)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+class IngestionCheckpoint(SQLModel, table=True):
+    """Progress of the ingestion of one byte range of a project's dataset file"""
+
+    __tablename__ = "ingestion_checkpoint"
+    __table_args__ = (
+        UniqueConstraint(
+            "project_id",
+            "shard_start",
+            name="uq_ingestion_checkpoint_project_id_shard_start",
+        ),
+    )
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
+    project_id: int = Field(
+        foreign_key="project.id", nullable=False, ondelete="CASCADE"
+    )
+    shard_start: int = Field(sa_column=Column(BigInteger, nullable=False))
+    shard_end: int | None = Field(default=None, sa_column=Column(BigInteger))
+    first_line_index: int = Field(nullable=False)
+    num_records: int | None = Field(default=None)
+    # Byte offset right after the last committed line, and its line index
+    byte_offset: int = Field(sa_column=Column(BigInteger, nullable=False))
+    line_index: int = Field(nullable=False)
+    completed: bool = False
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+class ExportFormat(str, Enum):
+    JSONL = "jsonl"
+    PARQUET = "parquet"
+    ARROW = "arrow"
+
+
 class ProjectDownloadRequest(SQLModel):
     limit: int | None = None
     include_statuses: list[LineItemStatus]
     file_name: str
+    format: ExportFormat = ExportFormat.JSONL
+    # Gzip the NDJSON stream, served as <file_name>.jsonl.gz
+    compress: bool = False
+    parquet_compression: Literal[
+        "zstd", "snappy", "gzip", "lz4", "brotli", "uncompressed"
+    ] = "zstd"
 
     class Config:
         from_attributes = True
 
 
+class ProjectExport(SQLModel, table=True):
+    """Background export of a project, reused while the project is unchanged"""
+
+    __tablename__ = "project_export"
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
+    project_id: int = Field(
+        foreign_key="project.id", nullable=False, ondelete="CASCADE"
+    )
+    # Hash of the export options and the project's data version
+    cache_key: str = Field(max_length=64, index=True)
+    task_id: str | None = Field(default=None, max_length=255)
+    status: str = Field(default="PENDING", max_length=255)
+    info: dict | None = Field(default=None, sa_column=Column(JSON))
+    file_name: str = Field(max_length=255)
+    file_path: str | None = Field(default=None, max_length=255)
+    num_records: int | None = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+class ProjectExportPublic(SQLModel):
+    id: int
+    project_id: int
+    status: str
+    info: dict | None = None
+    file_name: str
+    num_records: int | None = None
+    created_at: datetime
+    updated_at: datetime
+
+
 # Audit Log Models
 class LineItemAuditLog(SQLModel, table=True):
     __tablename__ = "line_item_audit_log"
+    __table_args__ = (
+        Index("idx_line_item_audit_project_id_timestamp", "project_id", "timestamp"),
+    )
     id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
     line_item_id: int = Field(
         foreign_key="line_item.id", nullable=False, ondelete="CASCADE"
@@ -314,6 +503,13 @@ class LineItemAuditLog(SQLModel, table=True):
 
 class LineItemMessageAuditLog(SQLModel, table=True):
     __tablename__ = "line_item_message_audit_log"
+    __table_args__ = (
+        Index(
+            "idx_line_item_message_audit_project_id_timestamp",
+            "project_id",
+            "timestamp",
+        ),
+    )
     id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": True})
     line_item_message_id: int = Field(
         foreign_key="line_item_message.id", nullable=False, ondelete="CASCADE"
@@ -332,6 +528,9 @@ class LineItemMessageAuditLog(SQLModel, table=True):
     new_role: str | None = Field(max_length=50)
     old_content: str | None = Field(sa_column=Column(Text))
     new_content: str | None = Field(sa_column=Column(Text))
+    # None when old_content is the full text, "diff" when it is a patch
+    # turning new_content back into it
+    content_encoding: str | None = Field(default=None, max_length=20)
     old_feedback: str | None = Field(default=None)
     new_feedback: str | None = Field(default=None)
     timestamp: datetime = Field(default_factory=datetime.now)
@@ -386,8 +585,17 @@ class LineItemMessageAuditLogRead(SQLModel):
     additional_data: dict | None
 
 
+class AuditLogCount(str, Enum):
+    EXACT = "exact"
+    # Skips counting, for large logs
+    NONE = "none"
+
+
 class AuditLogsPublic(SQLModel):
     data: list[LineItemAuditLogRead | LineItemMessageAuditLogRead]
-    count: int
+    # Counted on offset pages only, None with a cursor or count=none
+    count: int | None
     page: int
-    total_pages: int
+    total_pages: int | None
+    # Opaque keyset cursor for the next page
+    next_cursor: str | None = None
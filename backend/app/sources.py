@@ -0,0 +1,144 @@
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO
+
+import gdown
+import httpx
+
+from app.core.config import settings
+from app.models import DatasetSourceType
+
+
+class DatasetSource(ABC):
+    """Where the JSONL dataset of a project is read from"""
+
+    label: str
+
+    def local_path(self) -> Path | None:
+        """Path of a file that can be read in place, without downloading"""
+        return None
+
+    @abstractmethod
+    def write_to(self, output: BinaryIO) -> None:
+        """Stream the dataset bytes into ``output``"""
+
+
+class GDriveSource(DatasetSource):
+    label = "Google Drive"
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+    def write_to(self, output: BinaryIO) -> None:
+        gdown.download(self.url, output=output, fuzzy=True)
+
+
+class HttpSource(DatasetSource):
+    label = "URL"
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+    def write_to(self, output: BinaryIO) -> None:
+        with httpx.stream(
+            "GET", self.url, follow_redirects=True, timeout=settings.HTTP_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(chunk_size=1024 * 1024):
+                output.write(chunk)
+
+
+class LocalSource(DatasetSource):
+    label = "local file"
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+
+    def local_path(self) -> Path | None:
+        return self.path
+
+    def write_to(self, output: BinaryIO) -> None:
+        with open(self.path, "rb") as f:
+            shutil.copyfileobj(f, output, length=1024 * 1024)
+
+
+def resolve_local_dataset_path(path: str) -> Path:
+    """Resolve a local dataset path, which must live under LOCAL_DATASET_ROOT"""
+    if not settings.LOCAL_DATASET_ROOT:
+        raise ValueError("Local dataset sources are disabled")
+    root = Path(settings.LOCAL_DATASET_ROOT).resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root) or not resolved.is_file():
+        raise ValueError(f"Dataset file not found: {path}")
+    return resolved
+
+
+def get_dataset_source(
+    source_type: DatasetSourceType, url: str, file_path: str
+) -> DatasetSource:
+    """
+    Args:
+        source_type (DatasetSourceType): the project's source type
+        url (str): the project's URL, or path for local sources
+        file_path (str): ingestion path of the project, where uploads are stored
+    """
+    if source_type == DatasetSourceType.HTTP:
+        return HttpSource(url)
+    if source_type == DatasetSourceType.UPLOAD:
+        return LocalSource(file_path)
+    if source_type == DatasetSourceType.LOCAL:
+        return LocalSource(resolve_local_dataset_path(url))
+    return GDriveSource(url)
+
+
+class BackgroundDownload:
+    """Download a source into ``file_path`` on a background thread.
+
+    Bytes are written to ``<file_path>.part`` while downloading, so readers can
+    follow the partial file, and the file is renamed to ``file_path`` once
+    complete. A present ``file_path`` is therefore always a full download.
+    """
+
+    def __init__(self, source: DatasetSource, file_path: str | Path) -> None:
+        self.source = source
+        self.file_path = Path(file_path)
+        self.part_path = Path(f"{file_path}.part")
+        self.error: BaseException | None = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        try:
+            with open(self.part_path, "ab") as output:
+                self.source.write_to(output)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def start(self) -> "BackgroundDownload":
+        # Create the partial file up front so readers can open it right away
+        self.part_path.unlink(missing_ok=True)
+        self.part_path.touch()
+        self._thread.start()
+        return self
+
+    def finished(self) -> bool:
+        """Whether the download is complete, raises the download error if any"""
+        if self.error:
+            raise self.error
+        return self._done.is_set()
+
+    def wait_for_bytes(self, num_bytes: int, poll_interval: float = 0.1) -> None:
+        """Wait until the partial file holds ``num_bytes`` or the download ends"""
+        while self.part_path.stat().st_size < num_bytes and not self.finished():
+            time.sleep(poll_interval)
+
+    def join(self) -> None:
+        self._thread.join()
+        if self.error:
+            raise self.error
+        self.part_path.rename(self.file_path)
@@ -0,0 +1,33 @@
+from datetime import datetime
+from pathlib import Path
+
+from app.api.deps import get_db_context
+from app.celery_app import celery_app
+from app.core.config import settings
+from app.crud.audit_archive import (
+    AUDIT_LOG_MODELS,
+    archive_audit_logs,
+    get_archive_cutoff,
+)
+
+
+@celery_app.task
+def archive_old_audit_logs() -> int:
+    """Move the audit rows past the retention period to Parquet archives"""
+    if settings.AUDIT_RETENTION_DAYS is None:
+        return 0
+
+    before = get_archive_cutoff(
+        now=datetime.now(), retention_days=settings.AUDIT_RETENTION_DAYS
+    )
+    num_archived = 0
+    with get_db_context() as session:
+        for model in AUDIT_LOG_MODELS:
+            num_archived += archive_audit_logs(
+                session=session,
+                model=model,
+                before=before,
+                folder=Path(settings.AUDIT_ARCHIVE_FOLDER),
+                batch_size=settings.AUDIT_ARCHIVE_BATCH_SIZE,
+            )
+    return num_archived
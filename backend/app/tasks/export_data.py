@@ -0,0 +1,124 @@
+import time
+from collections.abc import Generator, Iterable
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from celery import Task
+from loguru import logger
+from sqlalchemy import func
+from sqlmodel import select
+
+from app.api.deps import get_db_context
+from app.celery_app import celery_app
+from app.core.config import settings
+from app.crud.projects import iter_project_for_download
+from app.models import LineItem, ProjectDownloadRequest, ProjectExport
+from app.tasks.progress import ProgressReporter
+from app.utils import write_export_file
+
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def export_project(
+    self: Task, export_id: int, file_path: str, export_request: dict[str, Any]
+) -> None:
+    """Write a project export artifact to ``file_path``"""
+    request = ProjectDownloadRequest.model_validate(export_request)
+    part_path = Path(f"{file_path}.part")
+
+    with get_db_context() as session:
+        db_export = session.get(ProjectExport, export_id)
+        statement = (
+            select(func.count())
+            .select_from(LineItem)
+            .where(LineItem.project_id == db_export.project_id)
+        )
+        if request.include_statuses:
+            statement = statement.where(LineItem.status.in_(request.include_statuses))
+        total = session.exec(statement).one()
+        if request.limit:
+            total = min(total, request.limit)
+
+        info = {
+            "type": "exporting",
+            "content": f"Exporting {total} samples ...",
+        }
+        db_export.status = "PROGRESS"
+        db_export.info = info
+        db_export.updated_at = datetime.now()
+        session.add(db_export)
+        session.commit()
+
+        self.update_state(
+            state="PROGRESS",
+            meta=info,
+        )
+
+        progress = ProgressReporter(
+            task=self,
+            session=session,
+            record=db_export,
+            every_rows=settings.INGESTION_PROGRESS_EVERY_ROWS,
+            every_seconds=settings.INGESTION_PROGRESS_EVERY_SECONDS,
+            info_type="exporting",
+        )
+        num_records = 0
+
+        def report_progress(
+            records: Iterable[dict[str, Any]],
+        ) -> Generator[dict[str, Any], None, None]:
+            nonlocal num_records
+            for record in records:
+                yield record
+                num_records += 1
+                progress.update(num_records, total)
+
+        started_at = time.perf_counter()
+        try:
+            # Line items are read with their own session, progress commits
+            # on this one would expire the page being serialized
+            with get_db_context() as export_session:
+                write_export_file(
+                    report_progress(
+                        iter_project_for_download(
+                            session=export_session,
+                            project_id=db_export.project_id,
+                            limit=request.limit,
+                            include_statuses=request.include_statuses,
+                        )
+                    ),
+                    part_path,
+                    request,
+                )
+            part_path.rename(file_path)
+        except Exception as e:
+            logger.exception(e)
+            part_path.unlink(missing_ok=True)
+            db_export.status = "FAILURE"
+            db_export.info = {
+                "type": "failed",
+                "content": f"Export failed: {e}",
+            }
+            session.add(db_export)
+            session.commit()
+            raise
+
+        db_export.status = "SUCCESS"
+        db_export.file_path = file_path
+        db_export.num_records = num_records
+        db_export.updated_at = datetime.now()
+        db_export.info = info = {
+            "type": "completed",
+            "content": f"Exported {num_records} samples",
+        }
+        session.add(db_export)
+        session.commit()
+
+    logger.info(
+        f"Exported {num_records} line items to {file_path} in "
+        f"{time.perf_counter() - started_at:.2f}s"
+    )
+    self.update_state(
+        state="SUCCESS",
+        meta=info,
+    )
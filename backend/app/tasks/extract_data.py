@@ -1,37 +1,155 @@
+import time
 from pathlib import Path
+from typing import Any
 
-from celery import Task
+from celery import Task, chord
 from loguru import logger
+from sqlalchemy.exc import DBAPIError
 
 from app.api.deps import get_db_context
 from app.celery_app import celery_app
-from app.models import LineItem, LineItemMessage, Project
-from app.utils import download_file_from_gdrive, extract_data_from_jsonl
+from app.core.config import settings
+from app.core.db import is_deadlock
+from app.crud.ingestion import (
+    create_ingestion_checkpoints,
+    get_ingestion_checkpoints,
+    ingest_records,
+)
+from app.crud.status_counts import get_status_counts
+from app.models import IngestionCheckpoint, Project
+from app.sources import BackgroundDownload, get_dataset_source
+from app.tasks.progress import ProgressReporter
+from app.utils import (
+    ZSTD_MAGIC,
+    count_jsonl_lines,
+    detect_jsonl_compression,
+    read_jsonl_records,
+    split_jsonl_shards,
+)
 
 
-@celery_app.task(bind=True)
-def extract_data(self: Task, url: str, file_path: str, project_id: int) -> None:
+def mark_ingestion_failed(project_id: int, exc: BaseException) -> None:
+    """Mark the project failed, so that its ingestion can be resumed"""
     with get_db_context() as session:
         db_project = session.get(Project, project_id)
-
-        # Download file
-        info = {
-            "type": "downloading",
-            "content": "Downloading file from Google Drive",
+        db_project.status = "FAILURE"
+        db_project.info = {
+            "type": "failed",
+            "content": f"Extraction process failed: {exc}",
         }
-        db_project.status = "PROGRESS"
-        db_project.info = info
         session.add(db_project)
         session.commit()
-        session.refresh(db_project)
 
-        self.update_state(
-            state="PROGRESS",
-            meta=info,
-        )
 
-        logger.info(f"Downloading file from {url} to {file_path}...")
-        download_file_from_gdrive(url, file_path)
+class ExtractDataTask(Task):
+    def on_failure(
+        self,
+        exc: Exception,
+        task_id: str,  # noqa: ARG002
+        args: tuple,
+        kwargs: dict,
+        einfo: Any,  # noqa: ARG002
+    ) -> None:
+        # Errors of the single range ingestion, shard errors go to fail_ingestion
+        mark_ingestion_failed(kwargs.get("project_id", args[-1]), exc)
+
+
+# Ingestion tasks are acknowledged after they finish, so a task whose worker
+# dies is re-delivered and resumes from its checkpoints
+@celery_app.task(
+    base=ExtractDataTask, bind=True, acks_late=True, reject_on_worker_lost=True
+)
+def extract_data(self: Task, url: str, file_path: str, project_id: int) -> None:
+    with get_db_context() as session:
+        db_project = session.get(Project, project_id)
+        checkpoints = get_ingestion_checkpoints(session=session, project_id=project_id)
+
+        source = get_dataset_source(db_project.source, url, file_path)
+        data_path = source.local_path() or Path(file_path)
+        download = None
+
+        if not data_path.exists():
+            # Download file
+            info = {
+                "type": "downloading",
+                "content": f"Downloading file from {source.label}",
+            }
+            db_project.status = "PROGRESS"
+            db_project.info = info
+            session.add(db_project)
+            session.commit()
+            session.refresh(db_project)
+
+            self.update_state(
+                state="PROGRESS",
+                meta=info,
+            )
+
+            logger.info(f"Downloading file from {url} to {file_path}...")
+            download = BackgroundDownload(source, file_path).start()
+            # Without streaming, or when resuming shards, wait for the full file
+            if not settings.INGESTION_STREAMING or len(checkpoints) > 1:
+                download.join()
+                download = None
+            else:
+                # Compressed streams can't be followed, wait for the full file
+                download.wait_for_bytes(len(ZSTD_MAGIC))
+                if detect_jsonl_compression(download.part_path):
+                    download.join()
+                    download = None
+
+        if checkpoints:
+            logger.info(
+                f"Resuming ingestion of project {project_id} "
+                f"from {len(checkpoints)} checkpoint(s)..."
+            )
+        elif (
+            download is None
+            and settings.INGESTION_SHARDS > 1
+            # Compressed files are read as a single range
+            and not detect_jsonl_compression(data_path)
+            and data_path.stat().st_size >= settings.INGESTION_SHARD_MIN_BYTES
+        ):
+            logger.info(f"Splitting {data_path} into shards...")
+            checkpoints = create_ingestion_checkpoints(
+                session=session,
+                project_id=project_id,
+                shards=split_jsonl_shards(data_path, settings.INGESTION_SHARDS),
+            )
+        else:
+            checkpoints = create_ingestion_checkpoints(
+                session=session, project_id=project_id, shards=[(0, None, None)]
+            )
+
+        # Only files downloaded or uploaded for the project are deleted afterwards
+        owned_file_path = file_path if data_path == Path(file_path) else None
+
+        # Fan out large files to shard tasks, the chord callback finalizes
+        if len(checkpoints) > 1:
+            total = sum(checkpoint.num_records for checkpoint in checkpoints)
+            info = {
+                "type": "extracting",
+                "content": f"Extracting {total} samples in {len(checkpoints)} shards ...",
+            }
+            db_project.status = "PROGRESS"
+            db_project.info = info
+            session.add(db_project)
+            session.commit()
+
+            self.update_state(
+                state="PROGRESS",
+                meta=info,
+            )
+
+            chord(
+                ingest_shard.s(str(data_path), project_id, checkpoint.id, total)
+                for checkpoint in checkpoints
+            )(
+                finalize_ingestion.s(project_id, owned_file_path).on_error(
+                    fail_ingestion.s(project_id)
+                )
+            )
+            return
 
         # Extract data
         info = {
@@ -49,46 +167,45 @@ def extract_data(self: Task, url: str, file_path: str, project_id: int) -> None:
             meta=info,
         )
 
-        logger.info(f"Extracting data from {file_path}...")
-
-        current = 0
+        logger.info(f"Extracting data from {data_path}...")
 
-        # Save data to the database
-        for item_base, line_messages, total in extract_data_from_jsonl(file_path):
-            current += 1
-            db_line_item = LineItem(
-                project_id=project_id,
-                tools=item_base.tools,
-                line_index=current,
+        checkpoint = checkpoints[0]
+        if download:
+            # Follow the partial file, the total is unknown until it completes
+            records = read_jsonl_records(
+                download.part_path, checkpoint.byte_offset, finished=download.finished
             )
-            session.add(db_line_item)
-            session.commit()
-            session.refresh(db_line_item)
-
-            for line_message in line_messages:
-                db_line_message = LineItemMessage(
-                    line_item_id=db_line_item.id,
-                    role=line_message.role,
-                    content=line_message.content,
-                    line_message_index=line_message.line_message_index,
-                )
-                session.add(db_line_message)
-                session.commit()
-                session.refresh(db_line_message)
+            total = None
+        else:
+            records = read_jsonl_records(data_path, checkpoint.byte_offset)
+            total = count_jsonl_lines(data_path)
+        started_at = time.perf_counter()
+        progress = ProgressReporter(
+            task=self,
+            session=session,
+            record=db_project,
+            every_rows=settings.INGESTION_PROGRESS_EVERY_ROWS,
+            every_seconds=settings.INGESTION_PROGRESS_EVERY_SECONDS,
+        )
 
-            info = {
-                "type": "extracting",
-                "content": f"{current / total * 100:.2f}% - {current}/{total}",
-            }
-            db_project.info = info
-            session.add(db_project)
-            session.commit()
-            session.refresh(db_project)
+        # Save data to the database
+        current = ingest_records(
+            session=session,
+            project_id=project_id,
+            records=records,
+            checkpoint=checkpoint,
+            on_progress=lambda current: progress.update(current, total),
+        )
+        if download:
+            download.join()
+        progress.update(current, current, force=True)
 
-            self.update_state(
-                state="PROGRESS",
-                meta=info,
-            )
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            f"Ingested {current} line items, this run took {elapsed:.2f}s "
+            f"({current / elapsed if elapsed > 0 else 0:.2f} rows/s, "
+            f"mode={settings.INGESTION_MODE})"
+        )
 
         # Update project status
         db_project.status = "SUCCESS"
@@ -101,10 +218,106 @@ def extract_data(self: Task, url: str, file_path: str, project_id: int) -> None:
         session.refresh(db_project)
 
     # Delete file
-    logger.info(f"Deleting file {file_path}...")
-    Path(file_path).unlink(missing_ok=True)
+    if owned_file_path:
+        logger.info(f"Deleting file {owned_file_path}...")
+        Path(owned_file_path).unlink(missing_ok=True)
 
     self.update_state(
         state="SUCCESS",
         meta=db_project.info,
     )
+
+
+@celery_app.task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=settings.INGESTION_DEADLOCK_RETRIES,
+)
+def ingest_shard(
+    self: Task,
+    file_path: str,
+    project_id: int,
+    checkpoint_id: int,
+    total: int,
+) -> int:
+    """Ingest the byte range of a downloaded JSONL file tracked by a checkpoint"""
+    try:
+        with get_db_context() as session:
+            db_project = session.get(Project, project_id)
+            checkpoint = session.get(IngestionCheckpoint, checkpoint_id)
+            progress = ProgressReporter(
+                task=self,
+                session=session,
+                record=db_project,
+                every_rows=settings.INGESTION_PROGRESS_EVERY_ROWS,
+                every_seconds=settings.INGESTION_PROGRESS_EVERY_SECONDS,
+            )
+
+            def report_project_progress(_: int) -> None:
+                # Shards share the project row, so report the project-wide
+                # count, read from the counters committed with every chunk
+                num_inserted = sum(
+                    get_status_counts(session=session, project_id=project_id).values()
+                )
+                progress.update(num_inserted, total)
+
+            started_at = time.perf_counter()
+            current = ingest_records(
+                session=session,
+                project_id=project_id,
+                records=read_jsonl_records(
+                    file_path, checkpoint.byte_offset, checkpoint.shard_end
+                ),
+                checkpoint=checkpoint,
+                on_progress=report_project_progress,
+            )
+            shard_start, shard_end = checkpoint.shard_start, checkpoint.shard_end
+    except DBAPIError as e:
+        if not is_deadlock(e):
+            raise
+        # The rolled back chunk is not in the checkpoint, the retry redoes it
+        logger.warning(
+            f"Shard {checkpoint_id} of project {project_id} hit a lock conflict, "
+            f"retrying: {e.orig}"
+        )
+        raise self.retry(exc=e, countdown=1 + self.request.retries)
+
+    elapsed = time.perf_counter() - started_at
+    logger.info(
+        f"Shard [{shard_start}, {shard_end}) of {file_path}: ingested {current} "
+        f"line items, this run took {elapsed:.2f}s"
+    )
+    return current
+
+
+@celery_app.task
+def finalize_ingestion(
+    shard_counts: list[int], project_id: int, file_path: str | None
+) -> None:
+    with get_db_context() as session:
+        db_project = session.get(Project, project_id)
+        db_project.status = "SUCCESS"
+        db_project.info = {
+            "type": "completed",
+            "content": "Extraction process completed",
+        }
+        session.add(db_project)
+        session.commit()
+
+    logger.info(
+        f"Inserted {sum(shard_counts)} line items in {len(shard_counts)} shards"
+    )
+    if file_path:
+        logger.info(f"Deleting file {file_path}...")
+        Path(file_path).unlink(missing_ok=True)
+
+
+@celery_app.task
+def fail_ingestion(
+    request: Any,  # noqa: ARG001
+    exc: Exception,
+    traceback: Any,  # noqa: ARG001
+    project_id: int,
+) -> None:
+    mark_ingestion_failed(project_id, exc)
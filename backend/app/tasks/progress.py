@@ -0,0 +1,81 @@
+import time
+from datetime import datetime
+
+from celery import Task
+from sqlmodel import Session
+
+from app.models import Project, ProjectExport
+
+
+class ProgressReporter:
+    """Throttle progress writes to the tracked row and Celery backend.
+
+    ``record`` is the project being ingested or the export being written.
+    An update is emitted at most once every ``every_rows`` rows or
+    ``every_seconds`` seconds, whichever comes first, instead of on every row.
+    """
+
+    def __init__(
+        self,
+        *,
+        task: Task,
+        session: Session,
+        record: Project | ProjectExport,
+        every_rows: int,
+        every_seconds: float,
+        info_type: str = "extracting",
+    ) -> None:
+        self.task = task
+        self.session = session
+        self.record = record
+        self.info_type = info_type
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.started_at = time.perf_counter()
+        self.last_reported_at = self.started_at
+        self.last_reported_rows = 0
+
+    def update(self, current: int, total: int | None, force: bool = False) -> None:
+        """Report ``current`` rows out of ``total``, None when not known yet"""
+        now = time.perf_counter()
+        if not force and (
+            current - self.last_reported_rows < self.every_rows
+            and now - self.last_reported_at < self.every_seconds
+        ):
+            return
+
+        elapsed = now - self.started_at
+        rows_per_second = current / elapsed if elapsed > 0 else 0.0
+        percent = current / total * 100 if total else None
+        eta_seconds = (
+            (total - current) / rows_per_second
+            if total and rows_per_second > 0
+            else None
+        )
+        info = {
+            "type": self.info_type,
+            "content": (
+                f"{percent:.2f}% - {current}/{total}"
+                if percent is not None
+                else f"{current} samples"
+            ),
+            "current": current,
+            "total": total,
+            "percent": round(percent, 2) if percent is not None else None,
+            "rows_per_second": round(rows_per_second, 2),
+            "eta_seconds": round(eta_seconds) if eta_seconds is not None else None,
+        }
+        self.record.info = info
+        if isinstance(self.record, ProjectExport):
+            # Heartbeat of running exports, see EXPORT_STALE_AFTER_SECONDS
+            self.record.updated_at = datetime.now()
+        self.session.add(self.record)
+        self.session.commit()
+
+        self.task.update_state(
+            state="PROGRESS",
+            meta=info,
+        )
+
+        self.last_reported_at = now
+        self.last_reported_rows = current
@@ -0,0 +1,22 @@
+from loguru import logger
+from sqlmodel import select
+
+from app.api.deps import get_db_context
+from app.celery_app import celery_app
+from app.crud.status_counts import reconcile_status_counts
+from app.models import Project
+
+
+@celery_app.task
+def reconcile_project_status_counts(project_id: int | None = None) -> None:
+    """Rebuild the status counters of a project, or of every project"""
+    with get_db_context() as session:
+        project_ids = (
+            [project_id]
+            if project_id is not None
+            else session.exec(select(Project.id)).all()
+        )
+        for id_ in project_ids:
+            reconcile_status_counts(session=session, project_id=id_)
+
+    logger.info(f"Reconciled the status counters of {len(project_ids)} project(s)")
@@ -0,0 +1,53 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.crud.projects import decode_line_item_cursor, encode_line_item_cursor
+from app.tests.utils.project import create_line_items, create_random_project
+
+
+def test_line_item_cursor_round_trip() -> None:
+    assert decode_line_item_cursor(encode_line_item_cursor(after=42)) == (42, None)
+    assert decode_line_item_cursor(encode_line_item_cursor(before=7)) == (None, 7)
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "WzFd", "eyJhZnRlciI6ICJ4In0="])
+def test_decode_line_item_cursor_invalid(cursor: str) -> None:
+    with pytest.raises(HTTPException) as e:
+        decode_line_item_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_get_line_items_keyset_pages(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=10)
+    url = f"{settings.API_V1_STR}/projects/{project.id}/samples"
+
+    pages = []
+    params: dict = {"limit": 4, "fields": "summary"}
+    while True:
+        r = client.get(url, headers=superuser_token_headers, params=params)
+        assert r.status_code == 200
+        page = r.json()
+        pages.append([item["line_index"] for item in page["data"]])
+        assert page["total_count"] == 10
+        if not page["next_cursor"]:
+            break
+        params = {"limit": 4, "fields": "summary", "cursor": page["next_cursor"]}
+
+    assert pages == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+
+    # The previous page of the last one
+    r = client.get(
+        url,
+        headers=superuser_token_headers,
+        params={"limit": 4, "fields": "summary", "cursor": page["prev_cursor"]},
+    )
+    assert [item["line_index"] for item in r.json()["data"]] == [5, 6, 7, 8]
+
+    r = client.get(url, headers=superuser_token_headers, params={"cursor": "WzFd"})
+    assert r.status_code == 400
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+from sqlmodel import Session
+
+from app.core.audit_sink import AuditSink
+from app.crud import audit
+from app.models import LineItemAuditLog
+
+
+class Writer:
+    """Records the batches written by a sink"""
+
+    def __init__(self) -> None:
+        self.batches: list[list[int]] = []
+        self.written = threading.Event()
+
+    def __call__(self, batch: list[int]) -> None:
+        self.batches.append(batch)
+        self.written.set()
+
+    @property
+    def rows(self) -> list[int]:
+        return [row for batch in self.batches for row in batch]
+
+
+def test_audit_sink_writes_inline_when_stopped() -> None:
+    writer = Writer()
+    sink = AuditSink(write=writer, flush_size=10, flush_interval=60)
+
+    sink.enqueue([1, 2])
+
+    assert not sink.running
+    assert writer.batches == [[1, 2]]
+
+
+def test_audit_sink_writes_full_batches() -> None:
+    writer = Writer()
+    sink = AuditSink(write=writer, flush_size=3, flush_interval=60)
+    sink.start()
+    try:
+        sink.enqueue([1, 2, 3, 4])
+        assert writer.written.wait(timeout=5)
+        assert writer.batches == [[1, 2, 3]]
+    finally:
+        sink.stop()
+
+    # The rows still queued are written on stop
+    assert not sink.running
+    assert writer.batches == [[1, 2, 3], [4]]
+
+
+def test_audit_sink_writes_after_interval() -> None:
+    writer = Writer()
+    sink = AuditSink(write=writer, flush_size=100, flush_interval=0.1)
+    sink.start()
+    try:
+        started_at = time.monotonic()
+        sink.enqueue([1])
+        assert writer.written.wait(timeout=5)
+        assert time.monotonic() - started_at >= 0.1
+        assert writer.batches == [[1]]
+    finally:
+        sink.stop()
+
+
+def test_audit_sink_flush() -> None:
+    writer = Writer()
+    sink = AuditSink(write=writer, flush_size=2, flush_interval=60)
+    # Queue without the writer thread, as while it is busy
+    sink._queue.put(1)
+    sink._queue.put(2)
+    sink._queue.put(3)
+
+    sink.flush()
+
+    assert writer.batches == [[1, 2], [3]]
+
+
+def test_audit_sink_survives_write_errors() -> None:
+    writer = Writer()
+
+    def write(batch: list[int]) -> None:
+        if batch == [1]:
+            raise RuntimeError("Database unavailable")
+        writer(batch)
+
+    sink = AuditSink(write=write, flush_size=1, flush_interval=60)
+    sink.start()
+    try:
+        sink.enqueue([1, 2])
+        assert writer.written.wait(timeout=5)
+    finally:
+        sink.stop()
+
+    assert writer.rows == [2]
+
+
+def test_add_audit_logs_queued_on_commit(
+    db: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    writer = Writer()
+    sink = AuditSink(write=writer, flush_size=100, flush_interval=60)
+    monkeypatch.setattr(audit, "audit_sink", sink)
+    sink.start()
+    try:
+        rolled_back = LineItemAuditLog(line_item_id=1, project_id=1, action="UPDATE")
+        audit.add_audit_logs(session=db, audit_logs=[rolled_back])
+        db.rollback()
+
+        committed = LineItemAuditLog(line_item_id=1, project_id=1, action="UPDATE")
+        audit.add_audit_logs(session=db, audit_logs=[committed])
+        assert writer.rows == []
+        db.commit()
+    finally:
+        sink.stop()
+
+    assert writer.rows == [committed]
@@ -0,0 +1,129 @@
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, func, select
+
+from app.crud.projects import assign_task, deal_line_items, rebalance_tasks
+from app.crud.status_counts import (
+    get_project_task_totals,
+    get_status_counts,
+    reconcile_status_counts,
+)
+from app.models import AssignmentStrategy, LineItem, RebalanceTasksRequest, Task
+from app.tests.utils.project import create_line_items, create_random_project
+from app.tests.utils.user import create_random_user
+
+
+def get_assigned_line_indexes(db: Session, project_id: int, user_id: int) -> list[int]:
+    return list(
+        db.exec(
+            select(LineItem.line_index)
+            .join(Task, Task.line_item_id == LineItem.id)
+            .where(Task.project_id == project_id, Task.user_id == user_id)
+            .order_by(LineItem.line_index)
+        ).all()
+    )
+
+
+def test_assign_task(db: Session) -> None:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=10)
+    first_user = create_random_user(db)
+    second_user = create_random_user(db)
+
+    assert assign_task(
+        session=db, project_id=project.id, user_id=first_user.id, num_samples=4
+    ) == (4, 1, 4)
+    assert assign_task(
+        session=db, project_id=project.id, user_id=second_user.id, num_samples=3
+    ) == (3, 5, 7)
+    assert assign_task(
+        session=db, project_id=project.id, user_id=first_user.id, num_samples=2
+    ) == (2, 8, 9)
+
+    first_line_indexes = get_assigned_line_indexes(db, project.id, first_user.id)
+    assert first_line_indexes == [1, 2, 3, 4, 8, 9]
+    assert get_assigned_line_indexes(db, project.id, second_user.id) == [5, 6, 7]
+    # A line item is assigned at most once
+    num_assigned_line_items = db.exec(
+        select(func.count(func.distinct(Task.line_item_id))).where(
+            Task.project_id == project.id
+        )
+    ).one()
+    assert num_assigned_line_items == 9
+    assert get_project_task_totals(session=db, project_id=project.id) == (10, 9)
+
+
+def test_assign_task_not_enough_line_items(db: Session) -> None:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=3)
+    user = create_random_user(db)
+
+    with pytest.raises(HTTPException) as e:
+        assign_task(session=db, project_id=project.id, user_id=user.id, num_samples=4)
+
+    assert e.value.status_code == 400
+    assert get_assigned_line_indexes(db, project.id, user.id) == []
+    assert get_project_task_totals(session=db, project_id=project.id) == (3, 0)
+
+
+def test_deal_line_items() -> None:
+    needs = {1: 3, 2: 0, 3: 1, 4: 2}
+    assert deal_line_items(needs, AssignmentStrategy.CONTIGUOUS) == [1, 1, 1, 3, 4, 4]
+    assert deal_line_items(needs, AssignmentStrategy.RANDOM) == [1, 1, 1, 3, 4, 4]
+    assert deal_line_items(needs, AssignmentStrategy.ROUND_ROBIN) == [1, 3, 4, 1, 4, 1]
+    assert deal_line_items({}, AssignmentStrategy.ROUND_ROBIN) == []
+
+
+@pytest.mark.parametrize("strategy", list(AssignmentStrategy))
+def test_rebalance_tasks(db: Session, strategy: AssignmentStrategy) -> None:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=10)
+    first_user = create_random_user(db)
+    second_user = create_random_user(db)
+    assign_task(session=db, project_id=project.id, user_id=first_user.id, num_samples=6)
+
+    rebalanced = rebalance_tasks(
+        session=db,
+        project_id=project.id,
+        rebalance_request=RebalanceTasksRequest(
+            percentages={first_user.id: 20, second_user.id: 50}, strategy=strategy
+        ),
+    )
+
+    assert {
+        user.user_id: (user.previous_count, user.new_count) for user in rebalanced
+    } == {first_user.id: (6, 2), second_user.id: (0, 5)}
+    # The first user keeps their oldest tasks
+    assert get_assigned_line_indexes(db, project.id, first_user.id) == [1, 2]
+    assert len(get_assigned_line_indexes(db, project.id, second_user.id)) == 5
+    assert get_project_task_totals(session=db, project_id=project.id) == (10, 7)
+    # The counters were kept up to date
+    counts = {
+        user_id: get_status_counts(session=db, project_id=project.id, user_id=user_id)
+        for user_id in (first_user.id, second_user.id)
+    }
+    reconcile_status_counts(session=db, project_id=project.id)
+    for user_id, status_counts in counts.items():
+        assert (
+            get_status_counts(session=db, project_id=project.id, user_id=user_id)
+            == status_counts
+        )
+
+
+def test_rebalance_tasks_invalid_request(db: Session) -> None:
+    project = create_random_project(db)
+    user = create_random_user(db)
+
+    for rebalance_request in [
+        RebalanceTasksRequest(),
+        RebalanceTasksRequest(counts={user.id: 1}, percentages={user.id: 10}),
+        RebalanceTasksRequest(percentages={user.id: 101}),
+        RebalanceTasksRequest(counts={user.id: -1}),
+        # Not enough line items
+        RebalanceTasksRequest(counts={user.id: 1}),
+    ]:
+        with pytest.raises(HTTPException) as e:
+            rebalance_tasks(
+                session=db, project_id=project.id, rebalance_request=rebalance_request
+            )
+        assert e.value.status_code == 400
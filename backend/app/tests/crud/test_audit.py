@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.crud.audit import (
+    CONTENT_ENCODING_DIFF,
+    compact_message_audit_log,
+    decode_audit_log_cursor,
+    encode_audit_log_cursor,
+    expand_message_audit_log,
+)
+from app.models import LineItem, LineItemAuditLog, LineItemMessageAuditLog
+from app.tests.utils.project import create_line_items, create_random_project
+
+
+def message_audit_log(
+    old_content: str | None, new_content: str | None
+) -> LineItemMessageAuditLog:
+    return LineItemMessageAuditLog(
+        line_item_message_id=1,
+        line_item_id=1,
+        project_id=1,
+        action="UPDATE",
+        old_content=old_content,
+        new_content=new_content,
+    )
+
+
+def test_compact_and_expand_message_audit_log() -> None:
+    old_content = " ".join(f"word{i}" for i in range(200))
+    new_content = old_content.replace("word100", "edited")
+    audit_log = message_audit_log(old_content, new_content)
+
+    compact_message_audit_log(audit_log)
+    assert audit_log.content_encoding == CONTENT_ENCODING_DIFF
+    assert len(audit_log.old_content) < len(old_content)
+    # Compacting twice keeps the patch
+    patch = audit_log.old_content
+    compact_message_audit_log(audit_log)
+    assert audit_log.old_content == patch
+
+    expand_message_audit_log(audit_log)
+    assert audit_log.content_encoding is None
+    assert audit_log.old_content == old_content
+    assert audit_log.new_content == new_content
+
+
+def test_compact_message_audit_log_keeps_full_text() -> None:
+    # The patch of a rewrite is longer than the old content
+    audit_log = message_audit_log("short", "a completely different text")
+    compact_message_audit_log(audit_log)
+    assert audit_log.content_encoding is None
+    assert audit_log.old_content == "short"
+
+    # Created or deleted messages have a single content
+    for audit_log in [message_audit_log(None, "new"), message_audit_log("old", None)]:
+        compact_message_audit_log(audit_log)
+        assert audit_log.content_encoding is None
+
+
+def test_audit_log_cursor_round_trip() -> None:
+    timestamp = datetime(2026, 1, 2, 3, 4, 5, 678901)
+    cursor = encode_audit_log_cursor(timestamp, 42)
+    assert decode_audit_log_cursor(cursor) == (timestamp, 42)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        # [1]
+        "WzFd",
+        # {"id": 1}
+        "eyJpZCI6IDF9",
+        # {"timestamp": "yesterday", "id": 1}
+        "eyJ0aW1lc3RhbXAiOiAieWVzdGVyZGF5IiwgImlkIjogMX0=",
+    ],
+)
+def test_decode_audit_log_cursor_invalid(cursor: str) -> None:
+    with pytest.raises(HTTPException) as e:
+        decode_audit_log_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_get_line_item_audit_logs_keyset_pages(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=2)
+    line_item_ids = db.exec(
+        select(LineItem.id).where(LineItem.project_id == project.id)
+    ).all()
+    now = datetime.now().replace(microsecond=0)
+    # Pairs of rows share a timestamp, the id breaks the tie
+    for i in range(7):
+        db.add(
+            LineItemAuditLog(
+                line_item_id=line_item_ids[i % 2],
+                project_id=project.id,
+                action="UPDATE",
+                timestamp=now - timedelta(seconds=i // 2),
+            )
+        )
+    db.commit()
+    expected_ids = db.exec(
+        select(LineItemAuditLog.id)
+        .where(LineItemAuditLog.project_id == project.id)
+        .order_by(LineItemAuditLog.timestamp.desc(), LineItemAuditLog.id.desc())
+    ).all()
+    url = f"{settings.API_V1_STR}/projects/{project.id}/audit/line-items"
+
+    r = client.get(url, headers=superuser_token_headers, params={"limit": 3})
+    assert r.status_code == 200
+    page = r.json()
+    assert page["count"] == 7
+    assert page["total_pages"] == 3
+    ids = [log["id"] for log in page["data"]]
+    while page["next_cursor"]:
+        r = client.get(
+            url,
+            headers=superuser_token_headers,
+            params={"limit": 3, "cursor": page["next_cursor"]},
+        )
+        page = r.json()
+        # Cursor pages are not counted
+        assert page["count"] is None
+        ids += [log["id"] for log in page["data"]]
+    assert ids == expected_ids
+
+    r = client.get(
+        url, headers=superuser_token_headers, params={"limit": 3, "count": "none"}
+    )
+    page = r.json()
+    assert page["count"] is None
+    assert [log["id"] for log in page["data"]] == expected_ids[:3]
+
+    r = client.get(url, headers=superuser_token_headers, params={"cursor": "WzFd"})
+    assert r.status_code == 400
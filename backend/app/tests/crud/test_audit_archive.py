@@ -0,0 +1,164 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import polars as pl
+import pytest
+from sqlmodel import Session, select
+
+from app.crud.audit import CONTENT_ENCODING_DIFF, compact_message_audit_log
+from app.crud.audit_archive import archive_audit_logs, get_archive_cutoff
+from app.models import (
+    LineItem,
+    LineItemAuditLog,
+    LineItemMessage,
+    LineItemMessageAuditLog,
+)
+from app.tests.utils.project import create_line_items, create_random_project
+
+# Far in the past, so that only the rows of these tests are archived
+BEFORE = datetime(2001, 1, 1)
+
+
+def create_line_item_message(db: Session) -> LineItemMessage:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=1)
+    return db.exec(
+        select(LineItemMessage).join(LineItem).where(LineItem.project_id == project.id)
+    ).first()
+
+
+def read_archive(folder: Path) -> list[dict]:
+    return pl.read_parquet(sorted(folder.glob("*.parquet"))).sort("id").to_dicts()
+
+
+def test_get_archive_cutoff() -> None:
+    cutoff = get_archive_cutoff(now=datetime(2026, 3, 15, 12, 30), retention_days=30)
+    # 30 days before is February 13th, February is the first month kept
+    assert cutoff == datetime(2026, 2, 1)
+
+
+def test_archive_audit_logs(db: Session, tmp_path: Path) -> None:
+    line_message = create_line_item_message(db)
+    timestamps = [
+        datetime(2000, 11, 30, 23, 59),
+        datetime(2000, 12, 1),
+        datetime(2000, 12, 31, 12),
+        # Kept, at the cutoff
+        BEFORE,
+    ]
+    audit_logs = [
+        LineItemAuditLog(
+            line_item_id=line_message.line_item_id,
+            project_id=line_message.line_item.project_id,
+            action="UPDATE",
+            new_tools={"name": "search", "arguments": ["é"]},
+            timestamp=timestamp,
+        )
+        for timestamp in timestamps
+    ]
+    db.add_all(audit_logs)
+    db.commit()
+    ids = [audit_log.id for audit_log in audit_logs]
+
+    num_archived = archive_audit_logs(
+        session=db,
+        model=LineItemAuditLog,
+        before=BEFORE,
+        folder=tmp_path,
+        batch_size=2,
+    )
+
+    assert num_archived == 3
+    table_folder = tmp_path / "line_item_audit_log"
+    assert sorted(path.name for path in table_folder.iterdir()) == [
+        "2000-11",
+        "2000-12",
+    ]
+    assert [row["id"] for row in read_archive(table_folder / "2000-11")] == ids[:1]
+    december = read_archive(table_folder / "2000-12")
+    assert [row["id"] for row in december] == ids[1:3]
+    # JSON columns are archived as JSON strings
+    assert json.loads(december[0]["new_tools"]) == {
+        "name": "search",
+        "arguments": ["é"],
+    }
+    assert december[0]["old_tools"] is None
+    assert not list(tmp_path.rglob("*.part"))
+
+    remaining = db.exec(
+        select(LineItemAuditLog.id).where(LineItemAuditLog.id.in_(ids))
+    ).all()
+    assert remaining == ids[3:]
+
+
+def test_archive_expands_diff_content(db: Session, tmp_path: Path) -> None:
+    line_message = create_line_item_message(db)
+    old_content = " ".join(f"word{i}" for i in range(100))
+    audit_log = LineItemMessageAuditLog(
+        line_item_message_id=line_message.id,
+        line_item_id=line_message.line_item_id,
+        project_id=line_message.line_item.project_id,
+        action="UPDATE",
+        old_content=old_content,
+        new_content=old_content.replace("word50", "edited"),
+        timestamp=datetime(2000, 6, 1),
+    )
+    compact_message_audit_log(audit_log)
+    assert audit_log.content_encoding == CONTENT_ENCODING_DIFF
+    db.add(audit_log)
+    db.commit()
+
+    archive_audit_logs(
+        session=db,
+        model=LineItemMessageAuditLog,
+        before=BEFORE,
+        folder=tmp_path,
+        batch_size=100,
+    )
+
+    [row] = read_archive(tmp_path / "line_item_message_audit_log" / "2000-06")
+    assert row["old_content"] == old_content
+    assert row["content_encoding"] is None
+
+
+def test_archive_failed_write_keeps_rows(db: Session, tmp_path: Path) -> None:
+    line_message = create_line_item_message(db)
+    audit_log = LineItemAuditLog(
+        line_item_id=line_message.line_item_id,
+        project_id=line_message.line_item.project_id,
+        action="UPDATE",
+        timestamp=datetime(2000, 6, 1),
+    )
+    db.add(audit_log)
+    db.commit()
+    audit_log_id = audit_log.id
+
+    with patch.object(pl.DataFrame, "write_parquet", side_effect=OSError("full")):
+        with pytest.raises(OSError):
+            archive_audit_logs(
+                session=db,
+                model=LineItemAuditLog,
+                before=BEFORE,
+                folder=tmp_path,
+                batch_size=100,
+            )
+
+    db.rollback()
+    assert db.get(LineItemAuditLog, audit_log_id) is not None
+    assert not list(tmp_path.rglob("*.parquet"))
+
+    # The next run archives them
+    assert (
+        archive_audit_logs(
+            session=db,
+            model=LineItemAuditLog,
+            before=BEFORE,
+            folder=tmp_path,
+            batch_size=100,
+        )
+        == 1
+    )
+    db.expire_all()
+    assert db.get(LineItemAuditLog, audit_log_id) is None
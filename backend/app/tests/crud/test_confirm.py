@@ -0,0 +1,169 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+from app.crud.projects import assign_task, confirm_line_item
+from app.crud.status_counts import get_status_counts
+from app.models import (
+    LineItem,
+    LineItemAuditLog,
+    LineItemConfirmRequest,
+    LineItemMessage,
+    LineItemMessageAuditLog,
+    LineItemMessageConfirmRequest,
+    LineItemStatus,
+    Project,
+    User,
+)
+from app.tests.utils.project import create_line_items, create_random_project
+from app.tests.utils.user import create_random_user
+
+ZERO_COUNTS = {status.value: 0 for status in LineItemStatus}
+
+
+def create_assigned_line_item(
+    db: Session,
+) -> tuple[Project, User, LineItem, list[LineItemMessage]]:
+    project = create_random_project(db)
+    user = create_random_user(db)
+    create_line_items(db, project=project, num_line_items=3)
+    assign_task(session=db, project_id=project.id, user_id=user.id, num_samples=1)
+    line_item = db.exec(
+        select(LineItem)
+        .where(LineItem.project_id == project.id)
+        .order_by(LineItem.line_index)
+    ).first()
+    line_messages = db.exec(
+        select(LineItemMessage)
+        .where(LineItemMessage.line_item_id == line_item.id)
+        .order_by(LineItemMessage.line_message_index)
+    ).all()
+    return project, user, line_item, list(line_messages)
+
+
+def confirm_request(
+    line_messages: list[LineItemMessage],
+    *,
+    contents: dict[int, str] | None = None,
+    status: LineItemStatus = LineItemStatus.CONFIRMED,
+) -> LineItemConfirmRequest:
+    contents = contents or {}
+    return LineItemConfirmRequest(
+        line_messages=[
+            LineItemMessageConfirmRequest(
+                id=line_message.id,
+                role=line_message.role,
+                content=contents.get(line_message.id, line_message.content),
+            )
+            for line_message in line_messages
+        ],
+        status=status,
+    )
+
+
+def get_audit_logs(
+    db: Session, line_item: LineItem
+) -> tuple[list[LineItemAuditLog], list[LineItemMessageAuditLog]]:
+    return (
+        list(
+            db.exec(
+                select(LineItemAuditLog).where(
+                    LineItemAuditLog.line_item_id == line_item.id
+                )
+            ).all()
+        ),
+        list(
+            db.exec(
+                select(LineItemMessageAuditLog).where(
+                    LineItemMessageAuditLog.line_item_id == line_item.id
+                )
+            ).all()
+        ),
+    )
+
+
+def test_confirm_line_item(db: Session) -> None:
+    project, user, line_item, line_messages = create_assigned_line_item(db)
+    edited = line_messages[1]
+
+    confirm_line_item(
+        session=db,
+        user_id=user.id,
+        is_superuser=False,
+        project_id=project.id,
+        line_item_id=line_item.id,
+        line_item_confirm_request=confirm_request(
+            line_messages, contents={edited.id: "edited"}
+        ),
+    )
+
+    db.expire_all()
+    assert db.get(LineItem, line_item.id).status == LineItemStatus.CONFIRMED
+    assert db.get(LineItemMessage, edited.id).content == "edited"
+    # The line item moved between counters, project-wide and for its assignee
+    assert get_status_counts(session=db, project_id=project.id) == {
+        **ZERO_COUNTS,
+        "UNLABELED": 2,
+        "CONFIRMED": 1,
+    }
+    assert get_status_counts(session=db, project_id=project.id, user_id=user.id) == {
+        **ZERO_COUNTS,
+        "CONFIRMED": 1,
+    }
+    # The audit rows of both tables are committed with the update
+    [line_item_log], [message_log] = get_audit_logs(db, line_item)
+    assert line_item_log.action == "STATUS_CHANGE"
+    assert line_item_log.user_id == user.id
+    assert message_log.line_item_message_id == edited.id
+    assert message_log.new_content == "edited"
+
+
+def test_confirm_line_item_unknown_message(db: Session) -> None:
+    project, user, line_item, line_messages = create_assigned_line_item(db)
+    request = confirm_request(line_messages, contents={line_messages[0].id: "edited"})
+    request.line_messages.append(
+        LineItemMessageConfirmRequest(id=-1, role="user", content="unknown")
+    )
+
+    with pytest.raises(HTTPException) as e:
+        confirm_line_item(
+            session=db,
+            user_id=user.id,
+            is_superuser=False,
+            project_id=project.id,
+            line_item_id=line_item.id,
+            line_item_confirm_request=request,
+        )
+
+    assert e.value.status_code == 400
+    # Rejected before any change to the session
+    assert not db.dirty
+    db.rollback()
+    assert db.get(LineItem, line_item.id).status == LineItemStatus.UNLABELED
+    assert db.get(LineItemMessage, line_messages[0].id).content != "edited"
+    assert get_audit_logs(db, line_item) == ([], [])
+    assert get_status_counts(session=db, project_id=project.id) == {
+        **ZERO_COUNTS,
+        "UNLABELED": 3,
+    }
+
+
+def test_confirm_line_item_without_changes(db: Session) -> None:
+    project, user, line_item, line_messages = create_assigned_line_item(db)
+
+    with patch.object(db, "commit") as commit:
+        confirm_line_item(
+            session=db,
+            user_id=user.id,
+            is_superuser=False,
+            project_id=project.id,
+            line_item_id=line_item.id,
+            line_item_confirm_request=confirm_request(
+                line_messages, status=line_item.status
+            ),
+        )
+
+    commit.assert_not_called()
+    assert get_audit_logs(db, line_item) == ([], [])
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.crud.exports import create_project_export
+from app.models import ProjectDownloadRequest
+from app.tests.utils.project import create_line_items, create_random_project
+
+
+def test_create_project_export_reuses_running_export(db: Session) -> None:
+    project = create_random_project(db)
+    create_line_items(db, project=project, num_line_items=3)
+    export_request = ProjectDownloadRequest(file_name="export", include_statuses=[])
+
+    with patch("app.crud.exports.export_project") as export_project:
+        export_project.delay.return_value = MagicMock(id="task-id")
+        first = create_project_export(
+            session=db, project_id=project.id, export_request=export_request
+        )
+        second = create_project_export(
+            session=db, project_id=project.id, export_request=export_request
+        )
+
+        # No progress for too long, the worker is considered lost
+        first.updated_at = datetime.now() - timedelta(
+            seconds=settings.EXPORT_STALE_AFTER_SECONDS + 1
+        )
+        db.add(first)
+        db.commit()
+        third = create_project_export(
+            session=db, project_id=project.id, export_request=export_request
+        )
+
+    assert second.id == first.id
+    assert third.id != first.id
+    assert third.status == "PENDING"
+    assert export_project.delay.call_count == 2
+
+
+def test_create_project_export_not_queued(db: Session) -> None:
+    project = create_random_project(db)
+    export_request = ProjectDownloadRequest(file_name="export", include_statuses=[])
+
+    with patch("app.crud.exports.export_project") as export_project:
+        export_project.delay.side_effect = ConnectionError("Broker unavailable")
+        with pytest.raises(HTTPException) as e:
+            create_project_export(
+                session=db, project_id=project.id, export_request=export_request
+            )
+        assert e.value.status_code == 503
+
+        # The failed export is not reused
+        export_project.delay.side_effect = None
+        export_project.delay.return_value = MagicMock(id="task-id")
+        db_export = create_project_export(
+            session=db, project_id=project.id, export_request=export_request
+        )
+
+    assert db_export.status == "PENDING"
+    assert db_export.task_id == "task-id"
+    assert export_project.delay.call_count == 2
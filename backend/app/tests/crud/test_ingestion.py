@@ -0,0 +1,171 @@
+from collections.abc import Generator, Iterable
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, func, select
+
+from app.core.config import settings
+from app.crud.ingestion import create_ingestion_checkpoints, ingest_records
+from app.crud.projects import resume_project_ingestion
+from app.crud.status_counts import get_status_counts
+from app.models import LineItem, LineItemMessage
+from app.tasks.extract_data import extract_data
+from app.tests.utils.project import create_random_project, random_records
+from app.utils import read_jsonl_records
+
+
+@pytest.mark.parametrize("mode", ["bulk", "row"])
+def test_ingest_records(
+    db: Session, monkeypatch: pytest.MonkeyPatch, mode: str
+) -> None:
+    monkeypatch.setattr(settings, "INGESTION_MODE", mode)
+    monkeypatch.setattr(settings, "INGESTION_BATCH_SIZE", 10)
+    project = create_random_project(db)
+    [checkpoint] = create_ingestion_checkpoints(
+        session=db, project_id=project.id, shards=[(0, None, None)]
+    )
+    progress: list[int] = []
+
+    num_ingested = ingest_records(
+        session=db,
+        project_id=project.id,
+        records=random_records(25),
+        checkpoint=checkpoint,
+        on_progress=progress.append,
+    )
+
+    assert num_ingested == 25
+    line_indexes = db.exec(
+        select(LineItem.line_index)
+        .where(LineItem.project_id == project.id)
+        .order_by(LineItem.line_index)
+    ).all()
+    assert line_indexes == list(range(1, 26))
+    num_messages = db.exec(
+        select(func.count())
+        .select_from(LineItemMessage)
+        .join(LineItem)
+        .where(LineItem.project_id == project.id)
+    ).one()
+    assert num_messages == 50
+    assert checkpoint.byte_offset == 25
+    assert checkpoint.line_index == 25
+    assert progress[-1] == 25
+    if mode == "bulk":
+        assert progress == [10, 20, 25]
+    assert get_status_counts(session=db, project_id=project.id)["UNLABELED"] == 25
+
+
+def crash_after(records: Iterable, num_records: int) -> Generator:
+    for i, record in enumerate(records):
+        if i == num_records:
+            raise RuntimeError("Worker lost")
+        yield record
+
+
+def test_ingest_records_resumes_from_checkpoint(
+    db: Session, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setattr(settings, "INGESTION_MODE", "bulk")
+    monkeypatch.setattr(settings, "INGESTION_BATCH_SIZE", 10)
+    file_path = tmp_path / "data.jsonl"
+    file_path.write_text(
+        "".join(
+            f'{{"messages": [{{"role": "user", "content": "{i}"}}]}}\n'
+            for i in range(1, 36)
+        )
+    )
+    project = create_random_project(db)
+    [checkpoint] = create_ingestion_checkpoints(
+        session=db, project_id=project.id, shards=[(0, None, None)]
+    )
+
+    # The chunk being inserted when the worker dies is rolled back
+    with pytest.raises(RuntimeError):
+        ingest_records(
+            session=db,
+            project_id=project.id,
+            records=crash_after(read_jsonl_records(file_path), 25),
+            checkpoint=checkpoint,
+        )
+    db.rollback()
+    db.refresh(checkpoint)
+    assert checkpoint.line_index == 20
+
+    num_ingested = ingest_records(
+        session=db,
+        project_id=project.id,
+        records=read_jsonl_records(
+            file_path, checkpoint.byte_offset, checkpoint.shard_end
+        ),
+        checkpoint=checkpoint,
+    )
+
+    assert num_ingested == 35
+    rows = db.exec(
+        select(LineItem.line_index, LineItemMessage.content)
+        .join(LineItemMessage)
+        .where(LineItem.project_id == project.id)
+        .order_by(LineItem.line_index)
+    ).all()
+    assert rows == [(i, str(i)) for i in range(1, 36)]
+    assert checkpoint.byte_offset == file_path.stat().st_size
+    assert get_status_counts(session=db, project_id=project.id)["UNLABELED"] == 35
+
+
+@pytest.mark.parametrize(
+    ("status", "status_code"),
+    [("SUCCESS", 400), ("processing", 409), ("PENDING", 409), ("PROGRESS", 409)],
+)
+def test_resume_project_ingestion_refused(
+    db: Session, status: str, status_code: int
+) -> None:
+    project = create_random_project(db)
+    project.status = status
+    db.add(project)
+    db.commit()
+
+    with patch("app.crud.projects.extract_data") as extract_data:
+        with pytest.raises(HTTPException) as e:
+            resume_project_ingestion(session=db, project=project)
+
+    assert e.value.status_code == status_code
+    extract_data.delay.assert_not_called()
+
+
+def test_resume_project_ingestion(db: Session) -> None:
+    project = create_random_project(db)
+    project.status = "FAILURE"
+    db.add(project)
+    db.commit()
+
+    with patch("app.crud.projects.extract_data") as extract_data:
+        extract_data.delay.return_value = MagicMock(id="task-id")
+        project = resume_project_ingestion(session=db, project=project)
+
+    extract_data.delay.assert_called_once()
+    assert project.status == "processing"
+    assert project.task_id == "task-id"
+
+
+def test_failed_ingestion_can_be_resumed(db: Session, tmp_path: Path) -> None:
+    project = create_random_project(db)
+    file_path = tmp_path / "data.jsonl"
+    file_path.write_text(
+        '{"messages": [{"role": "user", "content": "hello"}]}\n{"tools": []}\n'
+    )
+
+    with patch.object(extract_data, "update_state"):
+        result = extract_data.apply(args=(project.url, str(file_path), project.id))
+
+    assert result.failed()
+    db.refresh(project)
+    assert project.status == "FAILURE"
+    assert "messages" in project.info["content"]
+
+    with patch("app.crud.projects.extract_data") as extract_data_mock:
+        extract_data_mock.delay.return_value = MagicMock(id="task-id")
+        project = resume_project_ingestion(session=db, project=project)
+    assert project.status == "processing"
@@ -0,0 +1,159 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.crud.projects import assign_task
+from app.crud.status_counts import (
+    PROJECT_WIDE,
+    adjust_status_counts,
+    get_project_task_totals,
+    get_status_counts,
+    move_line_item_status,
+    reconcile_status_counts,
+)
+from app.models import LineItem, LineItemStatus, LineItemStatusCount
+from app.tests.utils.project import create_line_items, create_random_project
+from app.tests.utils.user import create_random_user
+
+ZERO_COUNTS = {status.value: 0 for status in LineItemStatus}
+
+
+def test_new_project_has_zero_counters(db: Session) -> None:
+    project = create_random_project(db)
+    num_rows = len(
+        db.exec(
+            select(LineItemStatusCount).where(
+                LineItemStatusCount.project_id == project.id
+            )
+        ).all()
+    )
+    assert num_rows == len(LineItemStatus)
+    assert get_status_counts(session=db, project_id=project.id) == ZERO_COUNTS
+
+
+def test_adjust_status_counts(db: Session) -> None:
+    project = create_random_project(db)
+    user = create_random_user(db)
+
+    adjust_status_counts(
+        session=db,
+        project_id=project.id,
+        deltas={LineItemStatus.UNLABELED: 5, LineItemStatus.CONFIRMED: 0},
+    )
+    adjust_status_counts(
+        session=db,
+        project_id=project.id,
+        deltas={LineItemStatus.UNLABELED: -2, LineItemStatus.CONFIRMED: 2},
+    )
+    adjust_status_counts(
+        session=db,
+        project_id=project.id,
+        user_id=user.id,
+        deltas={LineItemStatus.APPROVED: 1},
+    )
+    db.commit()
+
+    assert get_status_counts(session=db, project_id=project.id) == {
+        **ZERO_COUNTS,
+        "UNLABELED": 3,
+        "CONFIRMED": 2,
+    }
+    assert get_status_counts(session=db, project_id=project.id, user_id=user.id) == {
+        **ZERO_COUNTS,
+        "APPROVED": 1,
+    }
+
+
+def test_move_line_item_status(db: Session) -> None:
+    project = create_random_project(db)
+    user = create_random_user(db)
+    create_line_items(db, project=project, num_line_items=4)
+    assign_task(session=db, project_id=project.id, user_id=user.id, num_samples=2)
+    line_item = db.exec(
+        select(LineItem).where(
+            LineItem.project_id == project.id, LineItem.line_index == 1
+        )
+    ).one()
+
+    move_line_item_status(
+        session=db,
+        line_item=line_item,
+        old_status=LineItemStatus.UNLABELED,
+        new_status=LineItemStatus.CONFIRMED,
+    )
+    line_item.status = LineItemStatus.CONFIRMED
+    db.add(line_item)
+    db.commit()
+
+    assert get_status_counts(session=db, project_id=project.id) == {
+        **ZERO_COUNTS,
+        "UNLABELED": 3,
+        "CONFIRMED": 1,
+    }
+    assert get_status_counts(session=db, project_id=project.id, user_id=user.id) == {
+        **ZERO_COUNTS,
+        "UNLABELED": 1,
+        "CONFIRMED": 1,
+    }
+    assert get_project_task_totals(session=db, project_id=project.id) == (4, 2)
+
+
+def test_reconcile_status_counts(db: Session) -> None:
+    project = create_random_project(db)
+    user = create_random_user(db)
+    create_line_items(db, project=project, num_line_items=6)
+    assign_task(session=db, project_id=project.id, user_id=user.id, num_samples=3)
+    expected = {
+        user_id: get_status_counts(session=db, project_id=project.id, user_id=user_id)
+        for user_id in (PROJECT_WIDE, user.id)
+    }
+
+    # Drifted counters
+    adjust_status_counts(
+        session=db,
+        project_id=project.id,
+        deltas={LineItemStatus.UNLABELED: 7, LineItemStatus.REJECTED: -1},
+    )
+    adjust_status_counts(
+        session=db,
+        project_id=project.id,
+        user_id=user.id,
+        deltas={LineItemStatus.APPROVED: 2},
+    )
+    db.commit()
+
+    reconcile_status_counts(session=db, project_id=project.id)
+
+    for user_id, status_counts in expected.items():
+        assert (
+            get_status_counts(session=db, project_id=project.id, user_id=user_id)
+            == status_counts
+        )
+    # Project-wide zero counters are kept for the ingestion upserts
+    num_project_rows = len(
+        db.exec(
+            select(LineItemStatusCount).where(
+                LineItemStatusCount.project_id == project.id,
+                LineItemStatusCount.user_id == PROJECT_WIDE,
+            )
+        ).all()
+    )
+    assert num_project_rows == len(LineItemStatus)
+
+
+def test_delete_user_drops_status_counts(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    project = create_random_project(db)
+    user = create_random_user(db)
+    create_line_items(db, project=project, num_line_items=5)
+    assign_task(session=db, project_id=project.id, user_id=user.id, num_samples=3)
+    assert get_project_task_totals(session=db, project_id=project.id) == (5, 3)
+
+    r = client.delete(
+        f"{settings.API_V1_STR}/users/{user.id}", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+
+    db.expire_all()
+    assert get_project_task_totals(session=db, project_id=project.id) == (5, 0)
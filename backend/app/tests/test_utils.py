@@ -0,0 +1,239 @@
+import gzip
+import json
+import random
+from pathlib import Path
+
+import polars as pl
+import pytest
+from zstandard import ZstdCompressor
+
+from app import utils
+from app.models import ExportFormat, ProjectDownloadRequest
+from app.utils import (
+    apply_content_diff,
+    count_jsonl_lines,
+    detect_jsonl_compression,
+    encode_content_diff,
+    get_export_file_suffix,
+    iter_jsonl_lines,
+    read_jsonl_records,
+    split_jsonl_shards,
+    write_export_file,
+)
+
+RECORD = b'{"messages": [{"role": "user", "content": "hello"}]}'
+
+
+def write_jsonl(path: Path, body: bytes, compression: str | None = None) -> Path:
+    if compression == "gzip":
+        body = gzip.compress(body)
+    elif compression == "zstd":
+        body = ZstdCompressor().compress(body)
+    path.write_bytes(body)
+    return path
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_count_jsonl_lines_skips_blank_lines(
+    tmp_path: Path, compression: str | None
+) -> None:
+    body = b"\n".join([RECORD] * 1000) + b"\n\n  \n\r\n"
+    file_path = write_jsonl(tmp_path / "data.jsonl", body, compression)
+    assert count_jsonl_lines(file_path) == 1000
+    assert count_jsonl_lines(file_path) == sum(1 for _ in iter_jsonl_lines(file_path))
+
+
+def test_count_jsonl_lines_across_chunks(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Chunks end in the middle of lines
+    monkeypatch.setattr(utils, "LINE_COUNT_CHUNK_SIZE", 7)
+    file_path = write_jsonl(tmp_path / "data.jsonl", b"\n".join([RECORD] * 10))
+    assert count_jsonl_lines(file_path) == 10
+
+
+def test_count_jsonl_lines_empty_file(tmp_path: Path) -> None:
+    assert count_jsonl_lines(write_jsonl(tmp_path / "data.jsonl", b"")) == 0
+
+
+def test_read_jsonl_records(tmp_path: Path) -> None:
+    lines = [
+        b'{"messages": [{"role": "user", "content": "a"}, '
+        b'{"role": "assistant", "content": "b"}]}',
+        b"",
+        b'{"messages": [{"role": "user", "content": "c"}], '
+        b'"tools": "[{\\"name\\": \\"search\\"}]"}',
+    ]
+    file_path = write_jsonl(tmp_path / "data.jsonl", b"\n".join(lines) + b"\n")
+
+    records = list(read_jsonl_records(file_path))
+
+    assert [offset for offset, _, _ in records] == [
+        len(lines[0]) + 1,
+        file_path.stat().st_size,
+    ]
+    _, item_base, line_messages = records[0]
+    assert item_base.tools == []
+    assert [(m.role, m.content, m.line_message_index) for m in line_messages] == [
+        ("user", "a", 1),
+        ("assistant", "b", 2),
+    ]
+    # Tools given as a JSON string are decoded
+    assert records[1][1].tools == [{"name": "search"}]
+
+
+@pytest.mark.parametrize("num_shards", [1, 3, 7, 100])
+def test_split_jsonl_shards(tmp_path: Path, num_shards: int) -> None:
+    lines = [b'{"messages": [], "id": %d}' % i + b" " * (i % 13) for i in range(50)]
+    file_path = write_jsonl(tmp_path / "data.jsonl", b"\n".join(lines) + b"\n\n")
+
+    shards = split_jsonl_shards(file_path, num_shards)
+
+    assert len(shards) <= num_shards + 1
+    assert shards[0][0] == 0
+    assert shards[-1][1] == file_path.stat().st_size
+    # Contiguous ranges
+    assert [end for _, end, _ in shards[:-1]] == [start for start, _, _ in shards[1:]]
+    assert sum(num_records for _, _, num_records in shards) == 50
+    # Every line is read by exactly one shard
+    read_lines = [
+        line
+        for start, end, _ in shards
+        for _, line in iter_jsonl_lines(file_path, start, end)
+    ]
+    assert read_lines == [line.strip() for line in lines]
+    for start, end, num_records in shards:
+        assert sum(1 for _ in iter_jsonl_lines(file_path, start, end)) == num_records
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_iter_jsonl_lines_resumes_at_offset(
+    tmp_path: Path, compression: str | None
+) -> None:
+    lines = [b'{"messages": [], "id": %d}' % i for i in range(100)]
+    body = b"\n".join(lines) + b"\n"
+    file_path = write_jsonl(tmp_path / "data.jsonl", body, compression)
+    assert detect_jsonl_compression(file_path) == compression
+
+    # Offsets are in decompressed bytes, whatever the compression
+    offsets = [offset for offset, _ in iter_jsonl_lines(file_path)]
+    assert offsets[-1] == len(body)
+    resumed = list(iter_jsonl_lines(file_path, offsets[41]))
+    assert [line for _, line in resumed] == lines[42:]
+    assert [offset for offset, _ in resumed] == offsets[42:]
+
+
+def export_records(num_records: int) -> list[dict]:
+    return [
+        {
+            "tools": [{"name": f"tool-{i}"}] if i % 2 else [],
+            "messages": [
+                {"role": "user", "content": f"question {i}"},
+                {"role": "assistant", "content": f"answer {i} é"},
+            ],
+        }
+        for i in range(num_records)
+    ]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_write_export_file_jsonl(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, compress: bool
+) -> None:
+    # Several chunks of NDJSON
+    monkeypatch.setattr(utils, "NDJSON_CHUNK_SIZE", 256)
+    records = export_records(50)
+    export_request = ProjectDownloadRequest(
+        file_name="export", include_statuses=[], compress=compress
+    )
+    file_path = tmp_path / f"export{get_export_file_suffix(export_request)}"
+
+    write_export_file(iter(records), file_path, export_request)
+
+    body = file_path.read_bytes()
+    if compress:
+        assert file_path.name == "export.jsonl.gz"
+        body = gzip.decompress(body)
+    assert [json.loads(line) for line in body.splitlines()] == records
+
+
+@pytest.mark.parametrize("export_format", [ExportFormat.PARQUET, ExportFormat.ARROW])
+@pytest.mark.parametrize("num_records", [0, 1, 25])
+def test_write_export_file_columnar(
+    tmp_path: Path, export_format: ExportFormat, num_records: int
+) -> None:
+    records = export_records(num_records)
+    export_request = ProjectDownloadRequest(
+        file_name="export", include_statuses=[], format=export_format
+    )
+    file_path = tmp_path / f"export{get_export_file_suffix(export_request)}"
+
+    write_export_file(iter(records), file_path, export_request, batch_size=10)
+
+    if export_format == ExportFormat.PARQUET:
+        frame = pl.read_parquet(file_path)
+    else:
+        frame = pl.read_ipc(file_path)
+    assert frame.schema == utils.EXPORT_SCHEMA
+    assert [
+        {"tools": json.loads(row["tools"]), "messages": row["messages"]}
+        for row in frame.to_dicts()
+    ] == records
+    # Batches are spilled next to the output and removed
+    assert list(tmp_path.iterdir()) == [file_path]
+
+
+@pytest.mark.parametrize(
+    ("source", "target"),
+    [
+        ("", ""),
+        ("", "new text"),
+        ("old text", ""),
+        ("same text", "same text"),
+        ("The quick brown fox", "The quick red fox jumps"),
+        ("line one\nline two\n", "line one\n\tline 2\n"),
+        ("héllo wörld 👋", "hello world 👋"),
+    ],
+)
+def test_content_diff_round_trip(source: str, target: str) -> None:
+    patch = encode_content_diff(source, target)
+    assert apply_content_diff(source, patch) == target
+
+
+def test_content_diff_round_trip_random_edits() -> None:
+    rng = random.Random(0)
+    words = ["a", "bb", "ccc", " ", "  ", "\n", "é", "{", "}", '"']
+    for _ in range(200):
+        source = "".join(rng.choices(words, k=rng.randint(0, 40)))
+        target = list(source)
+        for _ in range(rng.randint(0, 5)):
+            position = rng.randint(0, len(target))
+            target[position : position + rng.randint(0, 3)] = rng.choice(words)
+        target = "".join(target)
+        assert apply_content_diff(source, encode_content_diff(source, target)) == target
+
+
+def test_content_diff_is_small_for_small_edits() -> None:
+    source = " ".join(f"word{i}" for i in range(1000))
+    target = source.replace("word500", "changed")
+    patch = encode_content_diff(source, target)
+    assert len(patch) < 50
+    assert apply_content_diff(source, patch) == target
+
+
+def test_content_diff_large_content() -> None:
+    # Long messages with few distinct words, the worst case of word matching
+    rng = random.Random(0)
+    words = ["the", "a", "of", "x", "\n", "  "]
+    source = " ".join(rng.choices(words, k=20000))
+    middle = len(source) // 2
+    target = source[:middle] + "fixed" + source[middle:]
+    patch = encode_content_diff(source, target)
+    assert len(patch) < 50
+    assert apply_content_diff(source, patch) == target
+
+    # A rewrite past DIFF_MAX_TOKENS words is one edit of the changed span
+    rewrite = source[:100] + " ".join(rng.choices(words, k=20000)) + source[-100:]
+    patch = encode_content_diff(source, rewrite)
+    assert len(json.loads(patch)) == 1
+    assert apply_content_diff(source, patch) == rewrite
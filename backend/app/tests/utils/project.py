@@ -0,0 +1,57 @@
+from sqlmodel import Session
+
+from app.crud.ingestion import create_ingestion_checkpoints, ingest_records
+from app.crud.status_counts import create_status_counts
+from app.models import LineItemBase, LineItemMessageBase, Project, User
+from app.tests.utils.user import create_random_user
+from app.tests.utils.utils import random_lower_string
+
+
+def create_random_project(db: Session, *, owner: User | None = None) -> Project:
+    owner = owner or create_random_user(db)
+    project = Project(
+        name=random_lower_string(),
+        url=random_lower_string(),
+        status="SUCCESS",
+        owner_id=owner.id,
+    )
+    db.add(project)
+    db.flush()
+    create_status_counts(session=db, project_id=project.id)
+    db.commit()
+    db.refresh(project)
+    return project
+
+
+def random_records(
+    num_records: int, num_messages: int = 2
+) -> list[tuple[int, LineItemBase, list[LineItemMessageBase]]]:
+    """``(byte_offset, item_base, line_messages)`` records, as parsed from JSONL"""
+    return [
+        (
+            i + 1,
+            LineItemBase(tools=[]),
+            [
+                LineItemMessageBase(
+                    role="user" if j % 2 == 0 else "assistant",
+                    content=random_lower_string(),
+                    line_message_index=j + 1,
+                )
+                for j in range(num_messages)
+            ],
+        )
+        for i in range(num_records)
+    ]
+
+
+def create_line_items(db: Session, *, project: Project, num_line_items: int) -> int:
+    """Ingest random line items into a new project, with their status counters"""
+    [checkpoint] = create_ingestion_checkpoints(
+        session=db, project_id=project.id, shards=[(0, None, None)]
+    )
+    return ingest_records(
+        session=db,
+        project_id=project.id,
+        records=random_records(num_line_items),
+        checkpoint=checkpoint,
+    )
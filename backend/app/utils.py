@@ -1,22 +1,52 @@
-from collections.abc import Generator
+import difflib
+import gzip
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+from collections.abc import Callable, Generator, Iterable
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO
 
 import emails  # type: ignore
-import gdown
 import jwt
 import polars as pl
 from jinja2 import Template
 from json_repair import loads
 from jwt.exceptions import InvalidTokenError
 from loguru import logger
-from tqdm import tqdm
+from zstandard import ZstdDecompressor
 
 from app.core import security
 from app.core.config import settings
-from app.models import LineItemBase, LineItemMessageBase
+from app.models import (
+    ExportFormat,
+    LineItemBase,
+    LineItemMessageBase,
+    ProjectDownloadRequest,
+)
+
+LINE_COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+# Words with their trailing whitespace, the units of content diffs
+DIFF_TOKEN_PATTERN = re.compile(r"\s+|\S+\s*")
+# Changed spans with more tokens are stored whole, matching them is quadratic
+DIFF_MAX_TOKENS = 2000
+NDJSON_CHUNK_SIZE = 64 * 1024
+# Tools are free-form, they are exported as JSON strings to keep one schema
+EXPORT_SCHEMA = pl.Schema(
+    {
+        "tools": pl.String,
+        "messages": pl.List(pl.Struct({"role": pl.String, "content": pl.String})),
+    }
+)
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
 
 
 @dataclass
@@ -126,34 +156,312 @@ def verify_password_reset_token(token: str) -> str | None:
         return None
 
 
-def download_file_from_gdrive(url: str, output_path: str) -> None:
-    gdown.download(url, output=output_path, fuzzy=True)
+def detect_jsonl_compression(file_path: Path) -> str | None:
+    """Detect a gzip or zstd compressed file from its magic bytes"""
+    with open(file_path, "rb") as f:
+        header = f.read(len(ZSTD_MAGIC))
+    if header.startswith(GZIP_MAGIC):
+        return "gzip"
+    if header.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def open_jsonl(file_path: Path, start: int = 0) -> BinaryIO:
+    """
+    Open a JSONL file for binary reading at byte ``start``, decompressing gzip
+    and zstd files on the fly. Offsets of compressed files are in decompressed
+    bytes, so resuming skips by decompressing up to ``start``.
+    """
+    compression = detect_jsonl_compression(file_path)
+    if compression == "gzip":
+        f = gzip.open(file_path, "rb")
+    elif compression == "zstd":
+        reader = ZstdDecompressor().stream_reader(
+            open(file_path, "rb"), read_across_frames=True
+        )
+        # Zstd readers only seek forward, and not once buffered
+        reader.seek(start)
+        return io.BufferedReader(reader)
+    else:
+        f = open(file_path, "rb")
+    f.seek(start)
+    return f
+
+
+def count_jsonl_lines(file_path: Path) -> int:
+    """Count the non-blank lines of a JSONL file, the ones the parser reads"""
+    total = 0
+    pending = b""
+    with open_jsonl(file_path) as f:
+        while chunk := f.read(LINE_COUNT_CHUNK_SIZE):
+            # Only complete lines are counted, the tail waits for the next chunk
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            total += sum(1 for line in lines if line.strip())
+    if pending.strip():
+        total += 1
+    return total
+
+
+def iter_jsonl_lines(
+    file_path: Path, start: int = 0, end: int | None = None
+) -> Generator[tuple[int, bytes], None, None]:
+    """
+    Yields:
+        - offset (int): byte offset right after the line
+        - line (bytes): the non-empty line, without surrounding whitespace
+    """
+    if end is not None and start >= end:
+        return
+    with open_jsonl(file_path, start) as f:
+        offset = start
+        for line in f:
+            offset += len(line)
+            line = line.strip()
+            if line:
+                yield offset, line
+            if end is not None and offset >= end:
+                break
+
+
+def follow_jsonl_lines(
+    file_path: Path,
+    start: int,
+    finished: Callable[[], bool],
+    poll_interval: float = 0.5,
+) -> Generator[tuple[int, bytes], None, None]:
+    """
+    Like ``iter_jsonl_lines``, for an uncompressed file still being written.
+
+    Reaching the end of the file waits for more data until ``finished()``
+    returns True, a trailing line without newline is only yielded then.
+    """
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        offset = start
+        pending = b""
+        while True:
+            # Sampled before reading, so everything written by then is read
+            is_finished = finished()
+            chunk = f.readline()
+            while chunk:
+                pending += chunk
+                if pending.endswith(b"\n"):
+                    offset += len(pending)
+                    line = pending.strip()
+                    pending = b""
+                    if line:
+                        yield offset, line
+                chunk = f.readline()
+            if is_finished:
+                break
+            time.sleep(poll_interval)
 
+        offset += len(pending)
+        if pending.strip():
+            yield offset, pending.strip()
+
+
+def parse_jsonl_record(
+    record: dict[str, Any],
+) -> tuple[LineItemBase, list[LineItemMessageBase]]:
+    tools = record.get("tools") or []
+    if isinstance(tools, str):
+        tools = loads(tools)
+    item_base = LineItemBase(
+        tools=tools,
+    )
+    line_messages = []
+    current_line_message_index = 0
+    for message in record["messages"]:
+        current_line_message_index += 1
+        item_message = LineItemMessageBase(
+            role=message["role"],
+            content=message["content"],
+            line_message_index=current_line_message_index,
+        )
+        line_messages.append(item_message)
+    return item_base, line_messages
 
-def extract_data_from_jsonl(
+
+def read_jsonl_records(
     file_path: Path,
-) -> Generator[tuple[LineItemBase, list[LineItemMessageBase], int], None, None]:
+    start: int = 0,
+    end: int | None = None,
+    finished: Callable[[], bool] | None = None,
+) -> Generator[tuple[int, LineItemBase, list[LineItemMessageBase]], None, None]:
     """
+    Parse the records of a byte range of a JSONL file. With ``finished``, the
+    file is followed until its writer is done, see ``follow_jsonl_lines``.
+
     Yields:
+        - offset (int): byte offset right after the record's line
         - item_base: LineItemBase
         - line_messages: list[LineItemMessageBase]
-        - total (int): total number of lines in the file
-    """
-    df = pl.read_ndjson(file_path)
-    total = len(df)
-    for row in tqdm(df.iter_rows(named=True), total=total):
-        tools = loads(row["tools"]) if isinstance(row["tools"], str) else row["tools"]
-        item_base = LineItemBase(
-            tools=tools,
-        )
-        line_messages = []
-        current_line_message_index = 0
-        for message in row["messages"]:
-            current_line_message_index += 1
-            item_message = LineItemMessageBase(
-                role=message["role"],
-                content=message["content"],
-                line_message_index=current_line_message_index,
+    """
+    lines = (
+        follow_jsonl_lines(file_path, start, finished)
+        if finished
+        else iter_jsonl_lines(file_path, start, end)
+    )
+    for offset, line in lines:
+        yield offset, *parse_jsonl_record(json.loads(line))
+
+
+def split_jsonl_shards(file_path: Path, num_shards: int) -> list[tuple[int, int, int]]:
+    """
+    Split an uncompressed JSONL file into byte ranges aligned on line boundaries.
+
+    Returns:
+        list of (start, end, num_records) tuples, ``num_records`` only counts
+        non-empty lines so line indexes can be pre-assigned per shard
+    """
+    file_size = Path(file_path).stat().st_size
+    shard_size = max(1, file_size // max(1, num_shards))
+    shards = []
+    with open(file_path, "rb") as f:
+        start = 0
+        while start < file_size:
+            f.seek(min(start + shard_size, file_size))
+            if f.tell() < file_size:
+                f.readline()
+            end = f.tell()
+            num_records = sum(1 for _ in iter_jsonl_lines(file_path, start, end))
+            shards.append((start, end, num_records))
+            start = end
+    return shards
+
+
+def encode_ndjson(
+    records: Iterable[dict[str, Any]], compress: bool = False
+) -> Generator[bytes, None, None]:
+    """
+    Serialize records to NDJSON on the fly, optionally gzip-compressed.
+
+    Yields chunks of about ``NDJSON_CHUNK_SIZE`` bytes, so only the current
+    chunk is held in memory.
+    """
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = bytearray()
+    for record in records:
+        buffer += json.dumps(record, ensure_ascii=False).encode()
+        buffer += b"\n"
+        if len(buffer) < NDJSON_CHUNK_SIZE:
+            continue
+        chunk = compressor.compress(buffer) if compressor else bytes(buffer)
+        buffer.clear()
+        if chunk:
+            yield chunk
+
+    if compressor:
+        yield compressor.compress(buffer) + compressor.flush()
+    elif buffer:
+        yield bytes(buffer)
+
+
+def get_export_file_suffix(export_request: ProjectDownloadRequest) -> str:
+    if export_request.format == ExportFormat.PARQUET:
+        return ".parquet"
+    if export_request.format == ExportFormat.ARROW:
+        return ".arrow"
+    return ".jsonl.gz" if export_request.compress else ".jsonl"
+
+
+def write_export_file(
+    records: Iterable[dict[str, Any]],
+    file_path: str | Path,
+    export_request: ProjectDownloadRequest,
+    batch_size: int = settings.EXPORT_BATCH_SIZE,
+) -> None:
+    """
+    Write export records to ``file_path`` in the requested format.
+
+    Parquet and Arrow exports are built with polars one batch at a time, each
+    batch is spilled to a temporary Parquet file and the batches are streamed
+    into the output, so memory stays bounded by a single batch.
+    """
+    if export_request.format == ExportFormat.JSONL:
+        with open(file_path, "wb") as f:
+            for chunk in encode_ndjson(records, compress=export_request.compress):
+                f.write(chunk)
+        return
+
+    with tempfile.TemporaryDirectory(dir=Path(file_path).parent) as batch_dir:
+        batch_paths = []
+        batch: list[dict[str, Any]] = []
+
+        def write_batch() -> None:
+            batch_path = Path(batch_dir) / f"{len(batch_paths):06d}.parquet"
+            pl.DataFrame(
+                {
+                    "tools": [json.dumps(record["tools"]) for record in batch],
+                    "messages": [record["messages"] for record in batch],
+                },
+                schema=EXPORT_SCHEMA,
+            ).write_parquet(batch_path, compression="uncompressed")
+            batch_paths.append(batch_path)
+            batch.clear()
+
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                write_batch()
+        if batch or not batch_paths:
+            write_batch()
+
+        lazy_frame = pl.scan_parquet(batch_paths, schema=EXPORT_SCHEMA)
+        if export_request.format == ExportFormat.PARQUET:
+            lazy_frame.sink_parquet(
+                file_path, compression=export_request.parquet_compression
             )
-            line_messages.append(item_message)
-        yield item_base, line_messages, total
+        else:
+            lazy_frame.sink_ipc(file_path)
+
+
+def encode_content_diff(source: str, target: str) -> str:
+    """
+    Compact patch turning ``source`` into ``target``: a JSON list of
+    ``[start, end, replacement]`` edits of ``source``.
+
+    The common prefix and suffix are skipped, the rest is matched word by
+    word, or replaced whole when longer than ``DIFF_MAX_TOKENS`` words.
+    """
+    prefix = len(os.path.commonprefix([source, target]))
+    max_suffix = min(len(source), len(target)) - prefix
+    suffix = len(os.path.commonprefix([source[::-1][:max_suffix], target[::-1]]))
+    source_end = len(source) - suffix
+    target_end = len(target) - suffix
+    # Start and end on word boundaries, so that a changed word is one token
+    while prefix and not source[prefix - 1].isspace():
+        prefix -= 1
+    source_tokens = DIFF_TOKEN_PATTERN.findall(source, prefix, source_end)
+    target_tokens = DIFF_TOKEN_PATTERN.findall(target, prefix, target_end)
+    if not source_tokens and not target_tokens:
+        edits = []
+    elif max(len(source_tokens), len(target_tokens)) > DIFF_MAX_TOKENS:
+        edits = [[prefix, source_end, target[prefix:target_end]]]
+    else:
+        offsets = list(itertools.accumulate(map(len, source_tokens), initial=prefix))
+        matcher = difflib.SequenceMatcher(
+            None, source_tokens, target_tokens, autojunk=False
+        )
+        edits = [
+            [offsets[i1], offsets[i2], "".join(target_tokens[j1:j2])]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"
+        ]
+    return json.dumps(edits, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_content_diff(source: str, patch: str) -> str:
+    """Rebuild the target of ``encode_content_diff`` from its source"""
+    parts = []
+    position = 0
+    for start, end, replacement in json.loads(patch):
+        parts.append(source[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(source[position:])
+    return "".join(parts)